@@ -0,0 +1,36 @@
+"""Multiple sessions per user
+
+Revision ID: 5b1f0c3a9d2e
+Revises: 3ee34cf4d6e7
+Create Date: 2026-10-16 23:15:07.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1f0c3a9d2e'
+down_revision: Union[str, None] = '3ee34cf4d6e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Every login is a session of its own, the device is only a label. Existing sessions become 'unknown'
+    op.add_column('sessions', sa.Column('device', sa.String(), server_default='unknown', nullable=False))
+    op.drop_constraint('sessions_user_id_key', 'sessions', type_='unique')
+    op.create_index('ix_sessions_user_id_created_at', 'sessions', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    # Keeps the newest session of every user so that user_id can be unique again
+    op.execute(
+        "DELETE FROM sessions WHERE id NOT IN "
+        "(SELECT DISTINCT ON (user_id) id FROM sessions ORDER BY user_id, created_at DESC, id DESC)"
+    )
+    op.drop_index('ix_sessions_user_id_created_at', table_name='sessions')
+    op.create_unique_constraint('sessions_user_id_key', 'sessions', ['user_id'])
+    op.drop_column('sessions', 'device')
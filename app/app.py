@@ -1,40 +1,105 @@
 import time
-from fastapi import APIRouter, Cookie, Depends, FastAPI, HTTPException, Request, Response
-from sqlalchemy.orm import Session
-
-from . import service, models, schemas
-from .database import SessionLocal, engine
+import_started_at = time.perf_counter()      # Before the other imports, they are part of the cold start
+
+import asyncio
+import csv
+from contextlib import asynccontextmanager
+from uuid import UUID
+
+from fastapi import APIRouter, BackgroundTasks, Cookie, Depends, FastAPI, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+
+from . import responses, schemas, service
+from .database import DB_REPLICA_LAG_CHECK_SECONDS, DBSession, dispose_engines, get_db, pool_stats, replica_set, warm_up_pool
+from .db_service import db_service, export_detailed_users
+from .bulk_import import detect_import_format, import_registrations, import_summary, read_import_rows
+from .cache_backends import cache_backend
+from .profile_cache import profile_cache
+from .token_denylist import token_denylist
+from .token_cache import verified_token_cache
+from .rate_limiter import limit_password_attempts, refund_password_attempt
+from .session_reaper import start_session_reaper
 
 from .utils import Utility
-from .authenticator import Authenticator, AuthenticationMiddleware
+from .password_hasher import PasswordHasherBusy
+from .authenticator import Authenticator, AuthenticationMiddleware, build_access_token_data
+from .middleware import ProcessTimeMiddleware
+from .responses import encoded_response, json_response, model_response
+from .metrics import registry as metrics_registry, login_failures_total, password_rehashes_total
 
 from .config import *
 
-models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+startup_stats = {}
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = f"{process_time * 1000} ms"
-    return response
+
+def subscribe_cache_listeners():
+    profile_cache.subscribe()
+    token_denylist.subscribe()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing at import does I/O, the DB pool, the password hashing and the cache backend's listeners (a Redis
+    # connection) are set up here in parallel instead. The schema is Alembic's, `alembic upgrade head` before starting
+    warm_up_started_at = time.perf_counter()
+    pool_warm_up = asyncio.create_task(warm_up_pool())
+    # Fail the start, e.g. without signing keys or with Redis unreachable
+    await asyncio.gather(asyncio.to_thread(Utility.warm_up), asyncio.to_thread(subscribe_cache_listeners))
+    try:
+        await pool_warm_up
+    except Exception as e:      # The pool connects on demand, requests will get the error if the DB is still down
+        print(f"Database pool warm up failed: {e}")
+
+    metrics_registry.start_flushing()
+    session_reaper = start_session_reaper()
+    replica_lag_monitor = replica_set.start_lag_monitor(DB_REPLICA_LAG_CHECK_SECONDS)
+
+    started_at = time.perf_counter()
+    startup_stats.update(import_ms=(warm_up_started_at - import_started_at) * 1000, warm_up_ms=(started_at - warm_up_started_at) * 1000)
+    startup_stats["cold_start_ms"] = startup_stats["import_ms"] + startup_stats["warm_up_ms"]
+    print(f"***** STARTED in {startup_stats['cold_start_ms']:.0f} ms (import {startup_stats['import_ms']:.0f} ms, warm up {startup_stats['warm_up_ms']:.0f} ms) *****")
+
+    yield
+
+    for task in (session_reaper, replica_lag_monitor):
+        if task is not None:
+            task.cancel()
+    Utility.password_hasher.shutdown()
+    cache_backend.close()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+app.add_middleware(ProcessTimeMiddleware)
 
 ### Add base route
 router = APIRouter(prefix=BASE_PATH)
 
-# =============Initialize App Utilities=============
-Utility.initialize()
+async def reissue_profile_claims(request: Request, db: DBSession, auth_payload: schemas.AccessTokenPayload, user_info: schemas.User):
+    # The AuthenticationMiddleware sets the cookie, same as for a refreshed token. Only this session's token, the
+    # other sessions of the user get the new claims at their next refresh
+    access_token_data = await build_access_token_data(db, user_id=auth_payload.sub, role=auth_payload.role, session_id=auth_payload.session_id, user_info=user_info)
+    request.state.new_access_token = Utility.create_access_token(data=access_token_data)
+
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+async def rehash_password(user: schemas.UserRecord, password: str):
+    # Runs after the login response so the login isn't slowed down. When the hasher is busy it's skipped and the next login tries again
     try:
-        yield db
-    finally:
-        db.close()
+        new_hashed_password = await Utility.password_hasher.hash(password)
+    except PasswordHasherBusy:
+        password_rehashes_total.inc("busy")
+        return
+    updated = await db_service.rehash_user_password(user_id=user.id, email=user.email, hashed_password=user.hashed_password, new_hashed_password=new_hashed_password)
+    password_rehashes_total.inc("rehashed" if updated else "superseded")
+
+
+async def revoke_current_access_token(request: Request, response: Response, jwt_payload: schemas.AccessTokenPayload):
+    if jwt_payload.jti is not None:
+        await cache_backend.call(token_denylist.revoke, jwt_payload.jti, jwt_payload.exp)
+    verified_token_cache.evict(request.cookies.get("access_token", ""))
+    response.delete_cookie("access_token")
 
 
 @app.get("/")
@@ -42,12 +107,76 @@ def home():
     return "Welcome to Auth Service with FastAPI. Go to /docs to see all API routes"
 
 
+def collect_component_metrics():
+    if "cold_start_ms" in startup_stats:
+        yield "app_cold_start_seconds", "gauge", "Import plus warm up time of the worker", startup_stats["cold_start_ms"] / 1000
+
+    # The hasher is only built by the first use of Utility when the lifespan didn't run
+    if Utility.initialized:
+        hasher_stats = Utility.password_hasher.stats()
+        yield "password_hasher_in_flight", "gauge", "Password hash/verify jobs queued or running", hasher_stats["in_flight"]
+        yield "password_hasher_completed_total", "counter", "Password hash/verify jobs completed", hasher_stats["completed"]
+        yield "password_hasher_rejected_total", "counter", "Password hash/verify jobs rejected with 503", hasher_stats["rejected"]
+        yield "password_hasher_queue_wait_ms_avg", "gauge", "Average time jobs waited for a hasher worker", hasher_stats["queue_wait_ms_avg"]
+        yield "password_hasher_hash_ms_avg", "gauge", "Average time of a hash/verify call", hasher_stats["hash_ms_avg"]
+        yield "password_hash_rounds", "gauge", "Rounds of the password hashing policy", Utility.password_policy.rounds
+
+    cache_stats = profile_cache.stats()
+    yield "profile_cache_entries", "gauge", "Entries in the local profile cache", cache_stats["size"]
+    yield "profile_cache_hits_total", "counter", "Local profile cache hits", cache_stats["hits"]
+    yield "profile_cache_misses_total", "counter", "Local profile cache misses", cache_stats["misses"]
+    yield "profile_cache_evictions_total", "counter", "Local profile cache LRU evictions", cache_stats["evictions"]
+
+    token_cache_stats = verified_token_cache.stats()
+    yield "verified_token_cache_entries", "gauge", "Verified access tokens cached", token_cache_stats["size"]
+    yield "verified_token_cache_hits_total", "counter", "Access tokens served from the verified token cache", token_cache_stats["hits"]
+    yield "verified_token_cache_misses_total", "counter", "Access tokens decoded and validated", token_cache_stats["misses"]
+
+    for engine_name, engine_pool_stats in pool_stats().items():
+        yield f"db_pool_{engine_name}_checked_out", "gauge", "Connections checked out of the pool", engine_pool_stats["checked_out"]
+        yield f"db_pool_{engine_name}_overflow", "gauge", "Overflow connections in use", engine_pool_stats["overflow"]
+        yield f"db_pool_{engine_name}_checkouts_total", "counter", "Pool checkouts", engine_pool_stats["checkouts"]
+        yield f"db_pool_{engine_name}_checkout_timeouts_total", "counter", "Pool checkouts that timed out", engine_pool_stats["checkout_timeouts"]
+        yield f"db_pool_{engine_name}_checkout_wait_ms_avg", "gauge", "Average wait for a pool connection", engine_pool_stats["checkout_wait_ms_avg"]
+
+    if replica_set.replicas:
+        yield "db_replica_primary_fallbacks_total", "counter", "Replica reads sent to the primary since no replica was in sync", replica_set.primary_fallbacks
+        for replica in replica_set.replicas:
+            # -1 while the lag is unknown, e.g. the replica can't be reached
+            yield f"db_{replica.name}_lag_seconds", "gauge", "Replication lag of the replica", -1 if replica.lag_seconds is None else replica.lag_seconds
+            yield f"db_{replica.name}_reads_total", "counter", "Statements run on the replica", replica.reads
+
+
+metrics_registry.add_collector(collect_component_metrics)
+
+
+@app.get("/.well-known/jwks.json", include_in_schema=False)
+def jwks(request: Request):
+    '''
+    Public keys for verifying access tokens locally, only available with an asymmetric JWT_ALGORITHM
+    '''
+    Utility.lazy_initialize()
+    if Utility.key_ring is None:
+        raise HTTPException(status_code=404, detail="Tokens are not signed with public keys")
+
+    headers = {"Cache-Control": f"public, max-age={JWKS_CACHE_SECONDS}", "ETag": Utility.key_ring.jwks_etag}
+    if request.headers.get("if-none-match") == Utility.key_ring.jwks_etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=Utility.key_ring.jwks_json, media_type="application/jwk-set+json", headers=headers)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Add the authentication middleware to the app
 app.add_middleware(AuthenticationMiddleware)
 
 
 @router.get("/set-cookie")
-def set_cookie(response: Response):
+def set_cookie():
+    response = encoded_response(responses.COOKIE_SET)
     response.set_cookie(
         key="my_cookie",
         value="cookie_value",
@@ -56,7 +185,7 @@ def set_cookie(response: Response):
         expires=3600,  # expires in 1 hour
         samesite="lax"  # can be 'strict', 'lax', or 'none'
     )
-    return {"message": "Cookie has been set"}
+    return response
 
 
 @router.get("/get-cookie")
@@ -64,107 +193,192 @@ def get_cookie(my_cookie: str = Cookie(None)):
     if my_cookie:
         return {"this_cookie": my_cookie}
     else:
-        return {"message": "No cookie found"}
+        return encoded_response(responses.NO_COOKIE_FOUND)
 
 
+# Routes are async so that bcrypt runs on the dedicated hasher pool and the DB calls go through db_service,
+# which is either AsyncSession based or runs the sync service functions on the threadpool (DB_ASYNC_MODE)
 @router.post("/register")
-def register(register_info: schemas.UserCredentials, db: Session = Depends(get_db)):
-    user = service.get_user_by_email(db, email=register_info.email)
+async def register(register_info: schemas.UserCredentials, db: DBSession = Depends(get_db)):
+    user = await db_service.get_user_by_email(db, email=register_info.email)
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    created_user = service.create_user(db=db, register_info=register_info)
+    hashed_password = await Utility.get_hashed_password_async(register_info.password)
+    created_user = await db_service.create_user(db=db, register_info=register_info, hashed_password=hashed_password)
 
     if created_user:
-        return {"message":"User registered successfully"}
+        return encoded_response(responses.USER_REGISTERED)
     else:
         raise HTTPException(status_code=500, detail="Something went wrong")
     
 
 @router.post("/register-full")
-def register_with_info(register_info: schemas.RegistrationWithInfoSchema, db: Session = Depends(get_db)):
-    user = service.get_user_by_email(db, email=register_info.email)
+async def register_with_info(register_info: schemas.RegistrationWithInfoSchema, db: DBSession = Depends(get_db)):
+    user = await db_service.get_user_by_email(db, email=register_info.email)
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    staff_info = service.get_user_by_staff_id(db=db, staff_id=register_info.staff_id)
+    staff_info = await db_service.get_user_by_staff_id(db=db, staff_id=register_info.staff_id)
     if staff_info:
         raise HTTPException(status_code=400, detail="Staff id already exists")
     
-    user_creation_successful = service.create_user_with_info(db=db, register_info=register_info)
+    hashed_password = await Utility.get_hashed_password_async(register_info.password)
+    user_creation_successful = await db_service.create_user_with_info(db=db, register_info=register_info, hashed_password=hashed_password)
 
     if user_creation_successful:
-        return {"message":"User registered successfully"}
+        return encoded_response(responses.USER_REGISTERED)
     else:
         raise HTTPException(status_code=500, detail="Something went wrong")
 
 
 @router.post("/login")
-def login(login_info: schemas.UserCredentials, response: Response, db: Session = Depends(get_db)):
-    user = service.get_user_by_email(db, email=login_info.email)
+async def login(login_info: schemas.LoginCredentials, request: Request, background_tasks: BackgroundTasks, db: DBSession = Depends(get_db)):
+    await limit_password_attempts(request, login_info.email)
+    user = await db_service.get_user_by_email(db, email=login_info.email)
     if user is None:
+        login_failures_total.inc("unknown_email")
         raise HTTPException(status_code=400, detail="Incorrect email")
 
-    if not Utility.verify_password(login_info.password, user.hashed_password):
+    if not await Utility.verify_password_async(login_info.password, user.hashed_password):
+        login_failures_total.inc("wrong_password")
         raise HTTPException(
             status_code=400,
             detail="Incorrect password"
         )
+    await refund_password_attempt(request, login_info.email)
+
+    # Hashed under another scheme or a lower cost than the current policy, e.g. before the rounds were raised
+    if Utility.password_needs_update(user.hashed_password):
+        background_tasks.add_task(rehash_password, user, login_info.password)
+
+    device = (login_info.device or request.headers.get("user-agent") or "unknown")[:SESSION_DEVICE_MAX_LENGTH]
+    new_user_session = await db_service.open_user_session(db=db, user_id=user.id, device=device)
     
-    service.delete_user_session(db=db, user_id=user.id)
-    new_user_session = service.create_user_session(db=db, user_id=user.id)
-    
-    access_token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=user.id, role=user.role, session_id=str(new_user_session.session_id)))
+    access_token_data = await build_access_token_data(db, user_id=user.id, role=user.role, session_id=str(new_user_session.session_id))
+    access_token = Utility.create_access_token(data=access_token_data)
 
-    # Set the access token cookie
+    # Set the access token cookie, the background rehash is attached to the returned response by FastAPI
+    response = encoded_response(responses.LOGGED_IN)
     Utility.set_access_token_cookie(response, access_token)
-
-    return {"message":"Logged in successfully"}
+    return response
 
 
 @router.get("/logout")
-def logout(response: Response, db: Session = Depends(get_db), jwt_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
-    service.delete_user_session(db, user_id=jwt_payload.sub)
+async def logout(request: Request, db: DBSession = Depends(get_db), jwt_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    await db_service.delete_user_session(db, user_id=jwt_payload.sub, session_id=UUID(jwt_payload.session_id))
+    response = encoded_response(responses.LOGGED_OUT)
+    await revoke_current_access_token(request, response, jwt_payload)
+    return response
+
+
+@router.get("/sessions", response_model=list[schemas.SessionInfo])
+async def read_sessions(db: DBSession = Depends(get_db), jwt_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    return await db_service.get_user_sessions(db, user_id=jwt_payload.sub, current_session_id=jwt_payload.session_id)
 
-    response.delete_cookie("access_token")
 
-    return {"message": "Logged out successfully"}
+@router.delete("/sessions")
+async def revoke_other_sessions(db: DBSession = Depends(get_db), jwt_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    # Signs out every other session, their access tokens are denylisted by session id
+    revoked = await db_service.revoke_other_user_sessions(db, user_id=jwt_payload.sub, session_id=UUID(jwt_payload.session_id))
+    return {"message": f"Revoked {revoked} sessions"}
+
+
+@router.delete("/sessions/{id}")
+async def revoke_session(id: int, request: Request, db: DBSession = Depends(get_db), jwt_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    revoked_session_id = await db_service.revoke_user_session(db, user_id=jwt_payload.sub, id=id)
+    if revoked_session_id is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    response = encoded_response(responses.SESSION_REVOKED)
+    if str(revoked_session_id) == jwt_payload.session_id:
+        await revoke_current_access_token(request, response, jwt_payload)
+    return response
 
 
 @router.post('/change-password')
-def change_password(request: schemas.UserPasswordChangeSchema, db: Session = Depends(get_db)):
-    user = service.get_user_by_email(db, request.email)
+async def change_password(request: schemas.UserPasswordChangeSchema, http_request: Request, db: DBSession = Depends(get_db)):
+    await limit_password_attempts(http_request, request.email)
+    user = await db_service.get_user_by_email(db, request.email)
     if user is None:
         raise HTTPException(status_code=400, detail="User not found")
     
-    if not Utility.verify_password(request.password, user.hashed_password):
+    if not await Utility.verify_password_async(request.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Invalid old password")
+    await refund_password_attempt(http_request, request.email)
     
-    new_hashed_password = Utility.get_hashed_password(request.new_password)
-    user.hashed_password = new_hashed_password
-    db.commit()
+    new_hashed_password = await Utility.get_hashed_password_async(request.new_password)
+    await db_service.update_user_password(db=db, user_id=user.id, hashed_password=new_hashed_password)
     
-    return {"message": "Password changed successfully"}
+    return encoded_response(responses.PASSWORD_CHANGED)
 
 
 @router.get("/users", response_model=list[schemas.UserInfo])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+async def read_users(skip: int = 0, limit: int = Query(100, ge=1, le=1000), cursor: str | None = None, db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    '''
+    Pass the X-Next-Cursor header of a page as `cursor` to get the next one, `skip` is only used without a cursor
+    '''
     if auth_payload.role != 'admin':
         raise HTTPException(status_code=403, detail="Unauthorized")
-    users = service.get_detailed_users(db, skip=skip, limit=limit)
-    return users
+
+    after_id = None
+    if cursor is not None:
+        try:
+            after_id = service.decode_users_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    users = await db_service.get_detailed_users(db, skip=skip, limit=limit, after_id=after_id)
+    headers = None
+    if len(users) == limit:
+        headers = {"X-Next-Cursor": service.encode_users_cursor(users[-1]["user_id"])}
+    return json_response(users, headers=headers)
+
+
+@router.get("/users/export")
+async def export_users(auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    '''
+    Streams every user as newline delimited JSON with constant memory
+    '''
+    if auth_payload.role != 'admin':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return StreamingResponse(export_detailed_users(batch_size=USERS_EXPORT_BATCH_SIZE), media_type="application/x-ndjson")
+
+
+@router.post("/users/import")
+async def import_users(file: UploadFile, db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    '''
+    Registers users with their info from a CSV file or NDJSON (columns/keys: email, password, fullname, designation, staff_id),
+    returns the result of each row
+    '''
+    if auth_payload.role != 'admin':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+    import_format = detect_import_format(file.filename, file.content_type)
+    if import_format is None:
+        raise HTTPException(status_code=415, detail="Upload a .csv or .ndjson file")
+
+    try:
+        rows = read_import_rows(await file.read(), import_format)
+    except (UnicodeDecodeError, csv.Error):
+        raise HTTPException(status_code=400, detail="File could not be parsed")
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_IMPORT_MAX_ROWS} rows per import")
+
+    results = await import_registrations(db, rows, hash_passwords=Utility.get_hashed_passwords_async)
+    return json_response(import_summary(results))
 
 
 @router.get("/users/{user_id}", response_model=schemas.UserInfo)
-def read_user(user_id: int, db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
-    db_user = service.get_user(db, user_id=user_id)
+async def read_user(user_id: int, db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    db_user = await db_service.get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
     if user_id == auth_payload.sub or auth_payload.role == 'admin':
-        user_info = service.get_detailed_user_info(db=db, user_id=user_id)
-        if user_info:
-            return user_info
+        profile = await db_service.get_detailed_user_profile(db=db, user_id=user_id)
+        if profile:
+            return json_response(service.user_info_response_body(profile))
         else:
             raise HTTPException(status_code=500, detail="Failed to retrieve user info")
     else:
@@ -172,81 +386,106 @@ def read_user(user_id: int, db: Session = Depends(get_db), auth_payload: schemas
     
 
 @router.get("/user-info", response_model=schemas.UserInfo)
-def read_user_info(db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):    
-    user_info = service.get_detailed_user_info(db=db, user_id=auth_payload.sub)
-    if user_info:
-        return user_info
+async def read_user_info(db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):    
+    profile = await db_service.get_detailed_user_profile(db=db, user_id=auth_payload.sub)
+    if profile:
+        return json_response(service.user_info_response_body(profile))
     else:
         raise HTTPException(status_code=500, detail="Failed to retrieve user info")
 
 
 @router.post("/user-info", response_model=schemas.UserInfo)
-def create_user_info(info: schemas.UserInfoCreate, db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+async def create_user_info(info: schemas.UserInfoCreate, request: Request, db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
     user_id = auth_payload.sub
-    user = service.get_user(db, user_id=user_id)
-    if user is None:
+    current_user_info = await db_service.get_detailed_user_info(db=db, user_id=user_id)
+    if current_user_info is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if user.user_info:
+    if isinstance(current_user_info, schemas.UserInfo):
         raise HTTPException(status_code=400, detail="User info already exists")
     
-    staff_info = service.get_user_by_staff_id(db=db, staff_id=info.staff_id)
+    staff_info = await db_service.get_user_by_staff_id(db=db, staff_id=info.staff_id)
     if staff_info:
         raise HTTPException(status_code=400, detail="Staff id already exists")
 
-    user_info = service.create_user_info(db=db, user_info_create=info, user_id=user_id)
+    user_info = await db_service.create_user_info(db=db, user_info_create=info, user_id=user_id)
     if user_info:
-        detailed_user_info = service.get_detailed_user_info(db=db, user_id=user_id)
-        return detailed_user_info
+        detailed_user_info = await db_service.get_detailed_user_info(db=db, user_id=user_id)
+        if AUTH_PROFILE_CLAIMS:
+            await reissue_profile_claims(request, db, auth_payload, user_info=detailed_user_info)
+        return model_response(detailed_user_info)
     else:
         raise HTTPException(status_code=500, detail="Something went wrong")
     
 
 @router.put("/user-info", response_model = schemas.UserInfo)
-def edit_user_info(info: schemas.UserInfoCreate, db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+async def edit_user_info(info: schemas.UserInfoCreate, request: Request, db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
     user_id = auth_payload.sub
-    user = service.get_user(db, user_id=user_id)
-    if user is None:
+    current_user_info = await db_service.get_detailed_user_info(db=db, user_id=user_id)
+    if current_user_info is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if not user.user_info:
+    if not isinstance(current_user_info, schemas.UserInfo):
         raise HTTPException(status_code=404, detail="User info not found")
     
-    if user.user_info.staff_id != info.staff_id:
-        staff_info = service.get_user_by_staff_id(db=db, staff_id=info.staff_id)
+    if current_user_info.staff_id != info.staff_id:
+        staff_info = await db_service.get_user_by_staff_id(db=db, staff_id=info.staff_id)
         if staff_info:
             raise HTTPException(status_code=400, detail="Staff id belongs to someone else")
 
-    user_info = service.edit_user_info(db=db, user_info_create=info, user_id=user_id)
+    user_info = await db_service.edit_user_info(db=db, user_info_create=info, user_id=user_id)
     if user_info:
-        detailed_user_info = service.get_detailed_user_info(db=db, user_id=user_id)
-        return detailed_user_info
+        detailed_user_info = await db_service.get_detailed_user_info(db=db, user_id=user_id)
+        if AUTH_PROFILE_CLAIMS:
+            await reissue_profile_claims(request, db, auth_payload, user_info=detailed_user_info)
+        return model_response(detailed_user_info)
     else:
         raise HTTPException(status_code=500, detail="Something went wrong")
 
 
 @router.post("/superuser")
-def create_super_user(superuser_credentials: schemas.SuperUserCredentials, db: Session = Depends(get_db)):
-    superuser = service.get_user_by_email(db, email=superuser_credentials.email)
+async def create_super_user(superuser_credentials: schemas.SuperUserCredentials, db: DBSession = Depends(get_db)):
+    superuser = await db_service.get_user_by_email(db, email=superuser_credentials.email)
     if superuser:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    if not Utility.verify_plain_password(superuser_credentials.superuser_password, Utility.SUPERUSER_PASSWORD):
+    if not Utility.verify_superuser_password(superuser_credentials.superuser_password):
         raise HTTPException(status_code=403, detail="Incorrect admin password")
     
-    created_user = service.create_user(db=db, register_info=schemas.UserCredentials(email=superuser_credentials.email, password=superuser_credentials.password), role='admin')
+    hashed_password = await Utility.get_hashed_password_async(superuser_credentials.password)
+    created_user = await db_service.create_user(db=db, register_info=schemas.UserCredentials(email=superuser_credentials.email, password=superuser_credentials.password), role='admin', hashed_password=hashed_password)
 
     if created_user:
-        return {"message":"Admin registered successfully"}
+        return encoded_response(responses.ADMIN_REGISTERED)
     else:
         raise HTTPException(status_code=500, detail="Something went wrong")
     
 
+@router.get("/stats")
+async def read_stats(auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):
+    if auth_payload.role != 'admin':
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return {
+        "startup": startup_stats,
+        "password_hasher": Utility.password_hasher.stats(),
+        "password_policy": Utility.password_policy.stats(),
+        "profile_cache": profile_cache.stats(),
+        "db_pool": pool_stats(),
+        "db_replicas": replica_set.stats(),
+        "token_denylist": token_denylist.stats(),
+        "verified_token_cache": verified_token_cache.stats()
+    }
+
+
 @router.get("/authenticate", response_model=schemas.UserInfo)
-def authenticate(db: Session = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):    
-    user_info = service.get_detailed_user_info(db=db, user_id=auth_payload.sub)
-    if user_info:
-        return user_info
+async def authenticate(db: DBSession = Depends(get_db), auth_payload: schemas.AccessTokenPayload = Depends(Authenticator())):    
+    # Stateless fast path, a valid token carrying the profile claims is answered without touching the DB
+    if AUTH_PROFILE_CLAIMS and auth_payload.profile is not None:
+        return json_response(service.user_info_response_body({"user_id": auth_payload.sub, **auth_payload.profile.model_dump()}))
+
+    profile = await db_service.get_detailed_user_profile(db=db, user_id=auth_payload.sub)
+    if profile:
+        return json_response(service.user_info_response_body(profile))
     else:
         raise HTTPException(status_code=500, detail="Failed to retrieve user info")
 
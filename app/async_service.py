@@ -0,0 +1,291 @@
+'''
+AsyncSession counterparts of the functionalities in service.py, used when DB_ASYNC_MODE is on.
+Nothing here relies on lazy loaded relationships since lazy loading can't happen outside of an await, and the
+cache backend is only reached through `cache_backend.call` so a Redis round trip doesn't block the event loop
+'''
+
+from datetime import datetime
+from typing import AsyncIterator
+from uuid import UUID, uuid4
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .database import AsyncSessionLocal, replica_set
+from .db_replicas import replica_read, replica_reads, served_by_replica
+
+from .utils import Utility
+from .cache_backends import cache_backend
+from .profile_cache import profile_cache
+from .session_cache import session_cache
+from .service import user_record, cached_detailed_user_info, insert_user_session_statement, rotate_user_session_statement, \
+    detailed_users_statement, detailed_users_page_statement, detailed_user_profile, detailed_user_export_line, user_info_response_body, \
+    registration_conflicts_statement, registration_conflicts, password_rehash_statement, delete_user_sessions_statement, \
+    excess_user_sessions_statement, user_sessions_statement, user_session_info, expired_sessions_batch_statement, end_user_sessions
+
+
+@replica_read
+async def get_user(db: AsyncSession, user_id: int) -> schemas.UserRecord | None:
+    cached_user = await profile_cache.get_user_async(user_id)
+    if cached_user is None:
+        result = await db.execute(select(models.User).filter(models.User.id == user_id))
+        user = result.scalars().first()
+        if user is None:
+            return None
+        cached_user = user_record(user)
+        if not served_by_replica(db):
+            await cache_backend.call(profile_cache.set_user, cached_user)
+    return schemas.UserRecord.model_construct(**cached_user)
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> schemas.UserRecord | None:
+    cached_user = await profile_cache.get_user_by_email_async(email)
+    if cached_user is None:
+        result = await db.execute(select(models.User).filter(models.User.email == email))
+        user = result.scalars().first()
+        if user is None:
+            return None
+        cached_user = user_record(user)
+        await cache_backend.call(profile_cache.set_user, cached_user)
+    return schemas.UserRecord.model_construct(**cached_user)
+
+
+async def get_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.User).offset(skip).limit(limit))
+    return result.scalars().all()
+
+
+async def create_user(db: AsyncSession, register_info: schemas.UserCredentials, role: str = 'user', hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = await Utility.get_hashed_password_async(register_info.password)
+    db_user = models.User(email=register_info.email, hashed_password=hashed_password, role=role)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    await cache_backend.call(profile_cache.invalidate_user, user_id=db_user.id, email=db_user.email)
+    await cache_backend.call(replica_set.stick_to_primary, db_user.id)
+    return db_user
+
+
+async def update_user_password(db: AsyncSession, user_id: int, hashed_password: str):
+    await db.execute(update(models.User).filter(models.User.id == user_id).values(hashed_password=hashed_password))
+    await db.commit()
+    await cache_backend.call(profile_cache.invalidate_user, user_id=user_id)
+    await cache_backend.call(replica_set.stick_to_primary, user_id)
+
+
+async def rehash_user_password(user_id: int, email: str, hashed_password: str, new_hashed_password: str) -> bool:
+    async with AsyncSessionLocal() as db:
+        updated = (await db.execute(password_rehash_statement(user_id, hashed_password, new_hashed_password))).rowcount == 1
+        await db.commit()
+
+    if updated:
+        await cache_backend.call(profile_cache.invalidate_user, user_id=user_id, email=email)
+    return updated
+
+
+async def delete_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    user = result.scalars().first()
+    if user:
+        await db.delete(user)
+        await db.commit()
+        await cache_backend.call(profile_cache.invalidate_user, user_id=user.id, email=user.email)
+
+
+async def create_user_with_info(db: AsyncSession, register_info: schemas.RegistrationWithInfoSchema, role: str = 'user', hashed_password: str = None) -> bool:
+    try:
+        if hashed_password is None:
+            hashed_password = await Utility.get_hashed_password_async(register_info.password)
+        db_user = models.User(email=register_info.email, hashed_password=hashed_password, role=role)
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+
+        user_info = models.UserInfo(fullname=register_info.fullname, designation=register_info.designation, staff_id=register_info.staff_id, user_id=db_user.id)
+        db.add(user_info)
+        await db.commit()
+        await db.refresh(user_info)
+        await cache_backend.call(profile_cache.invalidate_user, user_id=db_user.id, email=db_user.email)
+        await cache_backend.call(replica_set.stick_to_primary, db_user.id)
+
+        return True
+    except Exception as e:
+        print(e)
+        await db.rollback()
+
+        result = await db.execute(select(models.User).filter(models.User.email == register_info.email))
+        user = result.scalars().first()
+        if user:
+            await delete_user(db, user_id=user.id)
+
+        return False
+
+
+async def find_registration_conflicts(db: AsyncSession, emails: list[str], staff_ids: list[int]) -> tuple[set[str], set[int]]:
+    return registration_conflicts(await db.execute(registration_conflicts_statement(emails, staff_ids)))
+
+
+async def bulk_create_users_with_info(db: AsyncSession, registrations: list[dict]) -> list[int] | None:
+    try:
+        user_ids = (await db.scalars(
+            insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+            [{"email": registration["email"], "hashed_password": registration["hashed_password"], "role": registration["role"]} for registration in registrations]
+        )).all()
+        await db.execute(
+            insert(models.UserInfo),
+            [{"fullname": registration["fullname"], "designation": registration["designation"], "staff_id": registration["staff_id"], "user_id": user_id} for registration, user_id in zip(registrations, user_ids)]
+        )
+        await db.commit()
+        return list(user_ids)
+    except Exception as e:
+        print(e)
+        await db.rollback()
+        return None
+
+
+async def create_user_info(db: AsyncSession, user_info_create: schemas.UserInfoCreate, user_id: int):
+    user_info = models.UserInfo(**user_info_create.model_dump(), user_id=user_id)
+    db.add(user_info)
+    await db.commit()
+    await db.refresh(user_info)
+    await cache_backend.call(profile_cache.invalidate_user, user_id=user_id)
+    await cache_backend.call(replica_set.stick_to_primary, user_id)
+    return user_info
+
+
+async def edit_user_info(db: AsyncSession, user_info_create: schemas.UserInfoCreate, user_id: int):
+    result = await db.execute(select(models.UserInfo).filter(models.UserInfo.user_id == user_id))
+    user_info = result.scalars().first()
+
+    user_info.fullname = user_info_create.fullname
+    user_info.designation = user_info_create.designation
+    user_info.staff_id = user_info_create.staff_id
+
+    await db.commit()
+    await db.refresh(user_info)
+    await cache_backend.call(profile_cache.invalidate_user, user_id=user_id)
+    await cache_backend.call(replica_set.stick_to_primary, user_id)
+    return user_info
+
+
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Item).offset(skip).limit(limit))
+    return result.scalars().all()
+
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int):
+    db_item = models.Item(**item.model_dump(), owner_id=user_id)
+    db.add(db_item)
+    await db.commit()
+    await db.refresh(db_item)
+    return db_item
+
+
+async def delete_user_sessions(db: AsyncSession, user_id: int, *criteria) -> list[UUID]:
+    result = await db.execute(delete_user_sessions_statement(user_id, *criteria))
+    deleted_session_ids = result.scalars().all()
+    await db.commit()
+    if deleted_session_ids:
+        await cache_backend.call(end_user_sessions, deleted_session_ids)
+    return deleted_session_ids
+
+
+async def delete_user_session(db: AsyncSession, user_id: int, session_id: UUID) -> bool:
+    return bool(await delete_user_sessions(db, user_id, models.UserSession.session_id == session_id))
+
+
+async def revoke_user_session(db: AsyncSession, user_id: int, id: int) -> UUID | None:
+    deleted_session_ids = await delete_user_sessions(db, user_id, models.UserSession.id == id)
+    return deleted_session_ids[0] if deleted_session_ids else None
+
+
+async def revoke_other_user_sessions(db: AsyncSession, user_id: int, session_id: UUID) -> int:
+    return len(await delete_user_sessions(db, user_id, models.UserSession.session_id != session_id))
+
+
+async def get_user_sessions(db: AsyncSession, user_id: int, current_session_id: str) -> list[dict]:
+    result = await db.execute(user_sessions_statement(user_id))
+    return [user_session_info(row, current_session_id) for row in result]
+
+
+async def create_user_session(db: AsyncSession, user_id: int, device: str = "unknown") -> models.UserSession:
+    user_session = models.UserSession(session_id = uuid4(), user_id = user_id, device = device)
+    db.add(user_session)
+    await db.commit()
+    await db.refresh(user_session)
+    await cache_backend.call(session_cache.set, str(user_session.session_id), user_id=user_id, created_at=user_session.created_at)
+    return user_session
+
+
+async def open_user_session(db: AsyncSession, user_id: int, device: str = "unknown"):
+    result = await db.execute(insert_user_session_statement(user_id, device))
+    user_session = result.first()
+    excess_session_ids = (await db.execute(excess_user_sessions_statement(user_id))).scalars().all()
+    await db.commit()
+    await cache_backend.call(session_cache.set, str(user_session.session_id), user_id=user_id, created_at=user_session.created_at)
+    if excess_session_ids:
+        await cache_backend.call(end_user_sessions, excess_session_ids)
+    return user_session
+
+
+async def delete_expired_sessions_batch(expired_before: datetime, batch_size: int) -> int:
+    async with AsyncSessionLocal() as db:
+        deleted = (await db.execute(expired_sessions_batch_statement(expired_before, batch_size))).rowcount
+        await db.commit()
+        return deleted
+
+
+async def rotate_user_session(db: AsyncSession, session_id: UUID, user_id: int, created_after: datetime):
+    result = await db.execute(rotate_user_session_statement(session_id, user_id, created_after))
+    rotated_session = result.first()
+    await db.commit()
+
+    if rotated_session is None:
+        await cache_backend.call(session_cache.revoke, str(session_id))
+        return None
+
+    await cache_backend.call(session_cache.rotate, str(session_id), str(rotated_session.session_id), user_id=user_id, created_at=rotated_session.created_at)
+    return rotated_session
+
+
+@replica_read
+async def get_detailed_user_profile(db: AsyncSession, user_id: int) -> dict | None:
+    cached_profile = await profile_cache.get_profile_async(user_id)
+    if cached_profile is not None:
+        return cached_profile
+
+    result = await db.execute(detailed_users_statement().filter(models.User.id == user_id))
+    row = result.first()
+    if row is None:
+        return None
+    profile = detailed_user_profile(row)
+    if not served_by_replica(db):
+        await cache_backend.call(profile_cache.set_profile, user_id, profile)
+    return profile
+
+
+async def get_detailed_user_info(db: AsyncSession, user_id: int) -> schemas.UserInfo | schemas.User | None:
+    profile = await get_detailed_user_profile(db, user_id=user_id)
+    if profile is None:
+        return None
+    return cached_detailed_user_info(profile)
+
+
+@replica_read
+async def get_detailed_users(db: AsyncSession, skip: int = 0, limit: int = 100, after_id: int | None = None) -> list[dict]:
+    result = await db.execute(detailed_users_page_statement(skip, limit, after_id))
+    return [user_info_response_body(detailed_user_profile(row)) for row in result]
+
+
+async def export_detailed_users(batch_size: int = 1000) -> AsyncIterator[bytes]:
+    async with AsyncSessionLocal() as db:
+        with replica_reads(db):
+            rows = await db.stream(detailed_users_statement().execution_options(yield_per=batch_size))
+            async for row in rows:
+                yield detailed_user_export_line(row)
+
+
+async def get_user_by_staff_id(db: AsyncSession, staff_id: int):
+    result = await db.execute(select(models.User).join(models.UserInfo).filter(models.UserInfo.staff_id == staff_id))
+    return result.scalars().first()
@@ -1,31 +1,54 @@
-from datetime import UTC, datetime, timedelta
-from uuid import UUID, uuid4
+import asyncio
+import time
+from datetime import datetime, timedelta
+from uuid import UUID
 from fastapi import Depends, Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import jwt
 
-from app.models import UserSession
 from .utils import Utility
 import app.schemas as schemas
-from .database import SessionLocal
-from sqlalchemy.orm import Session
+from .database import DBSession, get_db
+from .db_service import db_service
+from .cache_backends import cache_backend
+from .session_cache import session_cache
+from .token_denylist import token_denylist
+from .token_cache import verified_token_cache
+from .metrics import cookie_deletions_total, token_refreshes_total, token_refresh_sources_total
 
 from .config import *
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+REFRESH_LOCK_POLL_SECONDS = 0.02
+
+# Refreshes being done by this worker, by the session_id they rotate
+refreshes_in_flight: dict[str, asyncio.Future] = {}
+
+
+async def build_access_token_data(db: DBSession, user_id: int, role: str, session_id: str, user_info: schemas.User | None = None) -> schemas.AccessTokenInputData:
+    profile = None
+    if AUTH_PROFILE_CLAIMS:
+        if user_info is None:
+            user_info = await db_service.get_detailed_user_info(db=db, user_id=user_id)
+        if user_info:
+            profile = schemas.AccessTokenProfileClaims(**user_info.model_dump(exclude={"user_id"}))
+
+    return schemas.AccessTokenInputData(sub=user_id, role=role, session_id=session_id, profile=profile)
+
+
+def cache_backend_unavailable(error: Exception) -> HTTPException:
+    # Not a reason to log the user out, the cookie is kept
+    print(f"Cache backend unavailable | {error}")
+    return HTTPException(status_code=503, detail="Service unavailable, try again later", headers={"Retry-After": "1"})
+
 
 class Authenticator(HTTPBearer):
     def __init__(self, auto_error: bool = False):
         super(Authenticator, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request, db: Session = Depends(get_db)):
+    async def __call__(self, request: Request, db: DBSession = Depends(get_db)):
         request.scope['auth_required'] = True
 
         # First, try to get the token from the cookies
@@ -45,91 +68,182 @@ class Authenticator(HTTPBearer):
 
         # Verify the token
         try:
-            jwt_payload = self.verify_jwt(token)
+            jwt_payload = await self.verify_jwt(token)
         except jwt.ExpiredSignatureError as e:      # Only refresh the token if the error is due to access token expiry
             try:
-                jwt_payload = self.refresh_access_token_and_get_payload(request, token, db)
+                jwt_payload = await self.refresh_access_token_and_get_payload(request, token, db)
+                token_refreshes_total.inc("success")
+            except cache_backend.unavailable_errors as e:
+                token_refreshes_total.inc("failure")
+                raise cache_backend_unavailable(e)
             except Exception as e:      # For any error encountered while refreshing token including session expiry, 
                 # ***might not reach here since access_token cookie max_age is set to SESSION_EXPIRE_MINUTES and refresh_token function 
                 # also checks expiry based on the same value, so cookie may be gone after session expiry before even coming here
                 # but if in case its not gone automatically, this bit of code will handle it through the AuthenticationMiddleware
+                token_refreshes_total.inc("failure")
                 request.state.delete_access_token = True
                 raise HTTPException(status_code=403, detail="Invalid token or session.")
+        except cache_backend.unavailable_errors as e:      # The token may well be valid, it's checked again on the retry
+            raise cache_backend_unavailable(e)
         except Exception as e:      # For any other error when verifying access token jwt
             request.state.delete_access_token = True
             raise HTTPException(status_code=403, detail="Invalid token or session.")
             
         return jwt_payload
 
-    def verify_jwt(self, jwtoken: str) -> schemas.AccessTokenPayload:
-        payload = Utility.decodeJWT(jwtoken)
-
-        if payload['token_type'] == 'access':
-            payload = schemas.AccessTokenPayload(**payload)
-        else:   # ***Resource accessible with access token only
-            # payload = Schemas.RefreshTokenPayload(**payload)
+    async def verify_jwt(self, jwtoken: str) -> schemas.AccessTokenPayload:
+        payload = verified_token_cache.get(jwtoken)
+        if payload is None:
+            decoded_payload = Utility.decodeJWT(jwtoken)
+
+            if decoded_payload['token_type'] == 'access':
+                payload = schemas.AccessTokenPayload(**decoded_payload)
+                verified_token_cache.set(jwtoken, payload, exp=decoded_payload['exp'])
+            else:   # ***Resource accessible with access token only
+                # payload = Schemas.RefreshTokenPayload(**payload)
+                raise jwt.InvalidTokenError
+
+        # Logged out tokens, almost always answered by the in-memory filter without I/O
+        if await token_denylist.is_revoked_async(payload.jti, payload.exp, session_id=payload.session_id):
+            verified_token_cache.evict(jwtoken)
             raise jwt.InvalidTokenError
 
         return payload
     
-    def refresh_access_token_and_get_payload(self, request: Request, access_token: str, db: Session) -> schemas.AccessTokenPayload:
+    async def refresh_access_token_and_get_payload(self, request: Request, access_token: str, db: DBSession) -> schemas.AccessTokenPayload:
+        verified_token_cache.evict(access_token)       # Normally already gone, it expires with the token
         payload = Utility.decodeJWT(jwtoken=access_token, options={ "verify_exp": False })
         payload = schemas.AccessTokenPayload(**payload)
 
-        
-        def get_valid_user_session(payload: schemas.AccessTokenPayload, auto_update = False) -> UserSession | None:
-            user_session = db.query(UserSession).filter(UserSession.session_id == UUID(payload.session_id)).first()
+        new_access_token = await self.refreshed_access_token(payload, db)
+        request.state.new_access_token = new_access_token
 
-            if user_session:
-                if user_session.user_id == payload.sub:
-                    if user_session.created_at >= (datetime.now() - timedelta(minutes=SESSION_EXPIRE_MINUTES)):
-                        if auto_update:
-                            user_session.session_id = uuid4()
-                            db.commit()
-                            db.refresh(user_session)
-                        return user_session
-                    
-            return None
+        # Answer this request with the session and profile claims that were just reissued
+        return await self.verify_jwt(new_access_token)
+
+    async def refreshed_access_token(self, payload: schemas.AccessTokenPayload, db: DBSession) -> str:
+        '''
+        Single flight per session: a burst of requests with the same expired token causes one rotation.
+        Requests after the rotation reuse its token during the grace window, requests during it wait for it,
+        in this worker on its future and in other workers on the lock
+        '''
+        rotated_access_token = await cache_backend.call(session_cache.get_rotation, payload.session_id, user_id=payload.sub)
+        if rotated_access_token is not None:
+            token_refresh_sources_total.inc("grace")
+            return rotated_access_token
+
+        while (in_flight := refreshes_in_flight.get(payload.session_id)) is not None:
+            token_refresh_sources_total.inc("coalesced")
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():       # This request was cancelled, not the refresh it waited for
+                    raise
+            # The refresh was cancelled along with the request doing it, one of its waiters takes over
 
-        valid_user_session = get_valid_user_session(payload=payload)
+        in_flight = refreshes_in_flight[payload.session_id] = asyncio.get_running_loop().create_future()
+        try:
+            new_access_token = await self.rotate_session(payload, db)
+            in_flight.set_result(new_access_token)
+            return new_access_token
+        except Exception as e:
+            in_flight.set_exception(e)
+            in_flight.exception()       # Retrieved here so that a refresh nobody else waited for doesn't log a warning
+            raise
+        finally:
+            del refreshes_in_flight[payload.session_id]
+            if not in_flight.done():        # Cancelled, the waiters must not hang on it
+                in_flight.cancel()
+
+    async def rotate_session(self, payload: schemas.AccessTokenPayload, db: DBSession) -> str:
+        session_created_after = datetime.now() - timedelta(minutes=SESSION_EXPIRE_MINUTES)
+
+        # Reject sessions already known to be rotated, revoked, foreign or expired without going to the DB,
+        # unless it was rotated by a concurrent refresh that finished in the meantime
+        if await cache_backend.call(session_cache.is_known_invalid, payload.session_id, user_id=payload.sub, created_after=session_created_after):
+            return await self.rotation_in_grace_window(payload)
+
+        lock_acquired = await cache_backend.call(session_cache.acquire_refresh_lock, payload.session_id)
+        if not lock_acquired:
+            # Another worker is rotating this session
+            deadline = time.monotonic() + session_cache.refresh_lock_seconds
+            while time.monotonic() < deadline:
+                await asyncio.sleep(REFRESH_LOCK_POLL_SECONDS)
+                rotated_access_token = await cache_backend.call(session_cache.get_rotation, payload.session_id, user_id=payload.sub)
+                if rotated_access_token is not None:
+                    token_refresh_sources_total.inc("other_worker")
+                    return rotated_access_token
+            # The lock expired without a rotation (its holder failed or died), the UPDATE below settles it
 
-        if not valid_user_session:
+        try:
+            # Validate and update the session in a single statement
+            valid_user_session = await db_service.rotate_user_session(db, session_id=UUID(payload.session_id), user_id=payload.sub, created_after=session_created_after)
+
+            if not valid_user_session:
+                return await self.rotation_in_grace_window(payload)
+
+            new_access_token_data = await build_access_token_data(db, user_id=payload.sub, role=payload.role, session_id=str(valid_user_session.session_id))
+            new_access_token = Utility.create_access_token(data=new_access_token_data)
+            await cache_backend.call(session_cache.remember_rotation, payload.session_id, user_id=payload.sub, access_token=new_access_token)
+            token_refresh_sources_total.inc("rotated")
+            return new_access_token
+        finally:
+            if lock_acquired:
+                await cache_backend.call(session_cache.release_refresh_lock, payload.session_id)
+
+    async def rotation_in_grace_window(self, payload: schemas.AccessTokenPayload) -> str:
+        rotated_access_token = await cache_backend.call(session_cache.get_rotation, payload.session_id, user_id=payload.sub)
+        if rotated_access_token is None:
             raise jwt.InvalidTokenError
-        
-        # Update the session
-        valid_user_session.session_id = uuid4()
-        db.commit()
-        db.refresh(valid_user_session)
-        
-        new_access_token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=payload.sub, role=payload.role, session_id=str(valid_user_session.session_id)))
-        
-        request.state.new_access_token = new_access_token
-
-        return payload
+        token_refresh_sources_total.inc("grace")
+        return rotated_access_token
     
 
 
-class AuthenticationMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Check if the path is one that should be skipped
-        if request.url.path in [f"{BASE_PATH}/logout"]:
+class AuthenticationMiddleware:
+    '''
+    Applies the cookie changes requested by the Authenticator dependency (deletion or a rotated access token),
+    as pure ASGI middleware patching the http.response.start message
+    '''
+
+    # Paths that should be skipped
+    SKIPPED_PATHS = (f"{BASE_PATH}/logout",)
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in self.SKIPPED_PATHS:
             # Skip the middleware logic
-            return await call_next(request)
-        
-        # Call the next middleware or endpoint handler
-        response = await call_next(request)
-
-        # Check if the request has authentication requirement
-        if request.scope.get("auth_required", False):
-            # Check if there's a token deletion request from authenticator dependency
-            delete_access_token = getattr(request.state, 'delete_access_token', False)
-            if delete_access_token:
-                response.delete_cookie("access_token")
-            else:   # If there's no request for deletion, there might be a request for addition
-                # Check if there's a new access token in the state
-                new_access_token = getattr(request.state, 'new_access_token', None)
-                if new_access_token:
-                    # Set the access token cookie
-                    Utility.set_access_token_cookie(response, new_access_token)
-
-        return response
\ No newline at end of file
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookies(message: Message):
+            # Check if the request has authentication requirement
+            if message["type"] == "http.response.start" and scope.get("auth_required", False):
+                # request.state of the endpoint is backed by scope["state"]
+                state = scope.get("state", {})
+
+                cookie_response = None
+                # Check if there's a token deletion request from authenticator dependency
+                if state.get("delete_access_token", False):
+                    cookie_response = Response()
+                    cookie_response.delete_cookie("access_token")
+                    cookie_deletions_total.inc()
+                else:   # If there's no request for deletion, there might be a request for addition
+                    # Check if there's a new access token in the state
+                    new_access_token = state.get("new_access_token")
+                    if new_access_token:
+                        # Set the access token cookie
+                        cookie_response = Response()
+                        Utility.set_access_token_cookie(cookie_response, new_access_token)
+
+                if cookie_response is not None:
+                    headers = MutableHeaders(scope=message)
+                    for name, value in cookie_response.raw_headers:
+                        if name == b"set-cookie":
+                            headers.append("set-cookie", value.decode("latin-1"))
+
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookies)
@@ -0,0 +1,117 @@
+'''
+Bulk registration of users with their user info from CSV or NDJSON, used by the admin /users/import route and the cli.
+Rows are validated and checked against each other first, then against the DB in one query, only the rows left
+are hashed (in parallel on the password hasher) and inserted, so a rejected row never costs a bcrypt hash.
+'''
+
+import csv
+import io
+from typing import Awaitable, Callable
+
+import orjson
+from pydantic import ValidationError
+
+from . import schemas
+from .database import DBSession
+from .db_service import db_service
+
+IMPORT_FORMATS = ("csv", "ndjson")
+
+
+def detect_import_format(filename: str | None, content_type: str | None) -> str | None:
+    filename = (filename or "").lower()
+    if filename.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if filename.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+
+def read_import_rows(content: bytes, import_format: str) -> list[dict | None]:
+    '''
+    Returns one dict per data row, None for NDJSON lines that are not a JSON object
+    '''
+    text = content.decode("utf-8-sig")
+    if import_format == "csv":
+        # Empty cells are left out so that they are reported as missing fields
+        return [{field: value for field, value in row.items() if value} for row in csv.DictReader(io.StringIO(text))]
+
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            row = None
+        rows.append(row if isinstance(row, dict) else None)
+    return rows
+
+
+def import_result(row_number: int, email: str | None, user_id: int | None = None, detail: str | None = None) -> dict:
+    if user_id is not None:
+        return {"row": row_number, "email": email, "status": "created", "user_id": user_id}
+    return {"row": row_number, "email": email, "status": "failed", "detail": detail}
+
+
+async def import_registrations(db: DBSession, rows: list[dict | None], hash_passwords: Callable[[list[str]], Awaitable[list[str]]], role: str = 'user') -> list[dict]:
+    '''
+    Registers the rows and returns a result per row, in order, with its 1-based row number
+    '''
+    results: list[dict | None] = [None] * len(rows)
+    pending: list[tuple[int, schemas.RegistrationWithInfoSchema]] = []
+    seen_emails, seen_staff_ids = set(), set()
+
+    for index, row in enumerate(rows):
+        if row is None:
+            results[index] = import_result(index + 1, None, detail="Invalid JSON object")
+            continue
+        try:
+            registration = schemas.RegistrationWithInfoSchema.model_validate(row)
+        except ValidationError as e:
+            error = e.errors()[0]
+            results[index] = import_result(index + 1, row.get("email"), detail=f"{'.'.join(map(str, error['loc']))}: {error['msg']}")
+            continue
+
+        if registration.email in seen_emails:
+            results[index] = import_result(index + 1, registration.email, detail="Email repeated in the import")
+        elif registration.staff_id in seen_staff_ids:
+            results[index] = import_result(index + 1, registration.email, detail="Staff id repeated in the import")
+        else:
+            pending.append((index, registration))
+        seen_emails.add(registration.email)
+        seen_staff_ids.add(registration.staff_id)
+
+    if pending:
+        taken_emails, taken_staff_ids = await db_service.find_registration_conflicts(
+            db, emails=[registration.email for _, registration in pending], staff_ids=[registration.staff_id for _, registration in pending]
+        )
+        accepted = []
+        for index, registration in pending:
+            if registration.email in taken_emails:
+                results[index] = import_result(index + 1, registration.email, detail="Email already registered")
+            elif registration.staff_id in taken_staff_ids:
+                results[index] = import_result(index + 1, registration.email, detail="Staff id already exists")
+            else:
+                accepted.append((index, registration))
+        pending = accepted
+
+    if pending:
+        hashed_passwords = await hash_passwords([registration.password for _, registration in pending])
+        user_ids = await db_service.bulk_create_users_with_info(db, registrations=[
+            {**registration.model_dump(exclude={"password"}), "hashed_password": hashed_password, "role": role}
+            for (_, registration), hashed_password in zip(pending, hashed_passwords)
+        ])
+        for position, (index, registration) in enumerate(pending):
+            if user_ids is None:
+                # The whole insert was rolled back, e.g. a concurrent registration took one of the emails
+                results[index] = import_result(index + 1, registration.email, detail="Not imported, the batch failed to insert, retry the import")
+            else:
+                results[index] = import_result(index + 1, registration.email, user_id=user_ids[position])
+
+    return results
+
+
+def import_summary(results: list[dict]) -> dict:
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
@@ -0,0 +1,299 @@
+'''
+Shared cache backends used by the profile cache, the session validation, the token denylist and the rate limits.
+Values must be JSON serializable. The in-memory backend only shares data inside one worker process and needs
+no external service, the Redis backend shares it between workers and containers.
+
+The methods are blocking. Async code awaits the calls reaching the backend through `backend.call(...)`, which runs
+them inline on the in-memory backend and on a thread with Redis, so a round trip doesn't stall the event loop.
+'''
+
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Callable
+
+import orjson
+
+from .config import *
+
+
+class CacheBackend:
+    name = "base"
+    unavailable_errors: tuple[type[Exception], ...] = ()     # Raised when the backend can't be reached for now
+
+    def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    def get_many(self, keys: list[str]) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None):
+        raise NotImplementedError
+
+    def set_many(self, mapping: dict[str, Any], ttl_seconds: float | None = None):
+        raise NotImplementedError
+
+    def add(self, key: str, value: Any, ttl_seconds: float | None = None) -> bool:
+        '''Sets the key only if it doesn't exist yet, returns whether it was set'''
+        raise NotImplementedError
+
+    def rate_limit(self, key: str, interval_seconds: float, burst: int) -> float:
+        '''
+        Charges one request to the GCRA limiter at key, which allows `burst` requests at once and one more every
+        `interval_seconds`. Returns 0 when the request is allowed, else the seconds until it would be
+        '''
+        raise NotImplementedError
+
+    def rate_limit_refund(self, key: str, interval_seconds: float):
+        '''Gives back one request charged to the GCRA limiter at key'''
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def publish(self, channel: str, message: Any):
+        raise NotImplementedError
+
+    def subscribe(self, channel: str, callback: Callable[[Any], None]):
+        '''Calls `callback` with the messages published on the channel, subscribing the same callback again is a no-op'''
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    async def call(self, func: Callable, *args, **kwargs):
+        '''Runs `func(*args, **kwargs)`, which uses this backend, for async code'''
+        return func(*args, **kwargs)
+
+
+class InMemoryCacheBackend(CacheBackend):
+    name = "memory"
+
+    SWEEP_EVERY_WRITES = 1024
+
+    def __init__(self):
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._subscribers: dict[str, list[Callable[[Any], None]]] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def _set(self, key: str, value: Any, ttl_seconds: float | None):
+        expires_at = math.inf if ttl_seconds is None else time.monotonic() + ttl_seconds
+        # Round trip through JSON so callers get the same copies and types as from Redis
+        self._entries[key] = (expires_at, orjson.loads(orjson.dumps(value)))
+
+        # Expired entries are otherwise only dropped when they are read again
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY_WRITES == 0:
+            now = time.monotonic()
+            for expired_key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+                del self._entries[expired_key]
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, keys: list[str]) -> dict[str, Any]:
+        with self._lock:
+            values = {key: self._get(key) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None):
+        with self._lock:
+            self._set(key, value, ttl_seconds)
+
+    def set_many(self, mapping: dict[str, Any], ttl_seconds: float | None = None):
+        with self._lock:
+            for key, value in mapping.items():
+                self._set(key, value, ttl_seconds)
+
+    def add(self, key: str, value: Any, ttl_seconds: float | None = None) -> bool:
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, ttl_seconds)
+            return True
+
+    def rate_limit(self, key: str, interval_seconds: float, burst: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            # Theoretical arrival time, when the limiter is back to a full burst
+            arrival_at = max(self._get(key) or now, now)
+            allowed_at = arrival_at + interval_seconds - burst * interval_seconds
+            if allowed_at > now:
+                return allowed_at - now
+            self._set(key, arrival_at + interval_seconds, ttl_seconds=arrival_at + interval_seconds - now)
+            return 0.0
+
+    def rate_limit_refund(self, key: str, interval_seconds: float):
+        with self._lock:
+            now = time.monotonic()
+            arrival_at = self._get(key)
+            if arrival_at is None:
+                return
+            if arrival_at - interval_seconds > now:
+                self._set(key, arrival_at - interval_seconds, ttl_seconds=arrival_at - interval_seconds - now)
+            else:
+                self._entries.pop(key, None)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def publish(self, channel: str, message: Any):
+        for callback in list(self._subscribers.get(channel, [])):
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[Any], None]):
+        callbacks = self._subscribers.setdefault(channel, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+
+# GCRA in one round trip, on the Redis clock so that all the workers and hosts agree on the time
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local arrival_at = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local allowed_at = arrival_at + interval - tonumber(ARGV[2]) * interval
+if allowed_at > now then
+    return tostring(allowed_at - now)
+end
+redis.call('SET', KEYS[1], tostring(arrival_at + interval), 'PX', math.ceil((arrival_at + interval - now) * 1000))
+return '0'
+"""
+
+RATE_LIMIT_REFUND_SCRIPT = """
+local arrival_at = tonumber(redis.call('GET', KEYS[1]))
+if not arrival_at then
+    return
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local refunded_at = arrival_at - tonumber(ARGV[1])
+if refunded_at > now then
+    redis.call('SET', KEYS[1], tostring(refunded_at), 'PX', math.ceil((refunded_at - now) * 1000))
+else
+    redis.call('DEL', KEYS[1])
+end
+"""
+
+
+class RedisCacheBackend(CacheBackend):
+    name = "redis"
+
+    def __init__(self, url: str, key_prefix: str = "fast-auth:"):
+        import redis      # Only needed when CACHE_BACKEND is redis
+
+        self.client = redis.Redis.from_url(url)
+        self.unavailable_errors = (redis.ConnectionError, redis.TimeoutError)
+        self.key_prefix = key_prefix
+        self._rate_limit_script = self.client.register_script(RATE_LIMIT_SCRIPT)
+        self._rate_limit_refund_script = self.client.register_script(RATE_LIMIT_REFUND_SCRIPT)
+
+        # Nothing connects before the first command, the pub/sub listener only starts with the first subscribe
+        self._pubsub = None
+        self._pubsub_thread = None
+        self._subscriptions: set[tuple[str, Callable]] = set()
+        self._subscribe_lock = threading.Lock()
+
+    def _key(self, key: str) -> str:
+        return self.key_prefix + key
+
+    async def call(self, func: Callable, *args, **kwargs):
+        # Each command is a network round trip
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    @staticmethod
+    def _ttl_ms(ttl_seconds: float | None) -> int | None:
+        return None if ttl_seconds is None else max(1, int(ttl_seconds * 1000))
+
+    def get(self, key: str) -> Any | None:
+        value = self.client.get(self._key(key))
+        return None if value is None else orjson.loads(value)
+
+    def get_many(self, keys: list[str]) -> dict[str, Any]:
+        if not keys:
+            return {}
+        values = self.client.mget([self._key(key) for key in keys])
+        return {key: orjson.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None):
+        self.client.set(self._key(key), orjson.dumps(value), px=self._ttl_ms(ttl_seconds))
+
+    def set_many(self, mapping: dict[str, Any], ttl_seconds: float | None = None):
+        # One round trip for the whole batch
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.set(self._key(key), orjson.dumps(value), px=self._ttl_ms(ttl_seconds))
+        pipeline.execute()
+
+    def add(self, key: str, value: Any, ttl_seconds: float | None = None) -> bool:
+        return bool(self.client.set(self._key(key), orjson.dumps(value), px=self._ttl_ms(ttl_seconds), nx=True))
+
+    def rate_limit(self, key: str, interval_seconds: float, burst: int) -> float:
+        # Returned as a string, Redis would truncate a Lua number to an integer
+        return float(self._rate_limit_script(keys=[self._key(key)], args=[interval_seconds, burst]))
+
+    def rate_limit_refund(self, key: str, interval_seconds: float):
+        self._rate_limit_refund_script(keys=[self._key(key)], args=[interval_seconds])
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*[self._key(key) for key in keys])
+
+    def publish(self, channel: str, message: Any):
+        self.client.publish(self._key(channel), orjson.dumps(message))
+
+    def subscribe(self, channel: str, callback: Callable[[Any], None]):
+        def handler(message):
+            try:
+                callback(orjson.loads(message["data"]))
+            except Exception as e:      # Keep the listener thread alive
+                print(f"{channel} | Subscriber error: {e}")
+
+        with self._subscribe_lock:
+            if (channel, callback) in self._subscriptions:
+                return
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{self._key(channel): handler})
+            # All channels are served by one listener thread per worker
+            if self._pubsub_thread is None:
+                self._pubsub_thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+            self._subscriptions.add((channel, callback))
+
+    def close(self):
+        with self._subscribe_lock:
+            if self._pubsub_thread is not None:
+                self._pubsub_thread.stop()
+                self._pubsub_thread.join(timeout=2)     # It polls every second
+            if self._pubsub is not None:
+                self._pubsub.close()
+            self._pubsub = self._pubsub_thread = None
+            self._subscriptions.clear()
+        self.client.close()
+
+
+def create_cache_backend(backend: str = CACHE_BACKEND) -> CacheBackend:
+    if backend == "memory":
+        return InMemoryCacheBackend()
+    if backend == "redis":
+        return RedisCacheBackend(url=REDIS_URL)
+    raise Exception(f"Unknown cache backend {backend}")
+
+
+cache_backend = create_cache_backend()
@@ -0,0 +1,151 @@
+'''
+Maintenance commands, run from the repository root with the same env as the server, e.g.
+`python -m app.cli import-users department.csv --results results.ndjson`
+'''
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import orjson
+from sqlalchemy import inspect
+
+from .bulk_import import IMPORT_FORMATS, detect_import_format, import_registrations, import_summary, read_import_rows
+from . import models
+from .database import DB_ASYNC_MODE, AsyncSessionLocal, SessionLocal, async_engine, engine
+from .config import PASSWORD_HASH_ARGON2_MEMORY_KIB, PASSWORD_HASH_SCHEME, PASSWORD_HASH_TARGET_MS, SESSION_REAPER_BATCH_SIZE, SESSION_REAPER_PAUSE_MS
+from .jwt_keys import ASYMMETRIC_ALGORITHMS, generate_private_key
+from .password_policy import SCHEMES, calibrate_rounds
+from .session_reaper import reap_expired_sessions
+from .utils import Utility
+
+
+def run_async(coroutine):
+    # The async engine's connections are closed before their event loop is, an open one would keep the process alive
+    async def run_and_dispose():
+        try:
+            return await coroutine
+        finally:
+            if async_engine is not None:
+                await async_engine.dispose()
+
+    return asyncio.run(run_and_dispose())
+
+
+async def import_users(rows: list[dict | None], role: str) -> list[dict]:
+    if DB_ASYNC_MODE:
+        async with AsyncSessionLocal() as db:
+            return await import_registrations(db, rows, hash_passwords=Utility.get_hashed_passwords_async, role=role)
+
+    db = SessionLocal()
+    try:
+        return await import_registrations(db, rows, hash_passwords=Utility.get_hashed_passwords_async, role=role)
+    finally:
+        db.close()
+
+
+def import_users_command(args: argparse.Namespace) -> int:
+    import_format = args.format or detect_import_format(args.path, None)
+    if import_format is None:
+        print("Can't tell the format from the file name, pass --format", file=sys.stderr)
+        return 2
+
+    with open(args.path, "rb") as import_file:
+        rows = read_import_rows(import_file.read(), import_format)
+
+    Utility.initialize()
+    started_at = time.perf_counter()
+    summary = import_summary(run_async(import_users(rows, role=args.role)))
+    print(f"Imported {summary['created']} users, {summary['failed']} failed, in {time.perf_counter() - started_at:.2f} s "
+          f"({Utility.password_hasher.max_workers} hashing workers)")
+
+    if args.results:
+        with open(args.results, "wb") as results_file:
+            results_file.writelines(orjson.dumps(result) + b"\n" for result in summary["results"])
+    else:
+        for result in summary["results"]:
+            if result["status"] == "failed":
+                print(f"  row {result['row']} ({result['email']}): {result['detail']}")
+
+    return 0 if summary["failed"] == 0 else 1
+
+
+def generate_jwt_key_command(args: argparse.Namespace) -> int:
+    private_pem = generate_private_key(args.algorithm)
+    # Created with owner only permissions, and never overwrites an existing key
+    with os.fdopen(os.open(args.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as key_file:
+        key_file.write(private_pem)
+    print(f"Wrote a {args.algorithm} private key to {args.path}")
+    return 0
+
+
+def calibrate_password_hash_command(args: argparse.Namespace) -> int:
+    rounds, elapsed_ms = calibrate_rounds(args.scheme, args.target_ms, argon2_memory_kib=PASSWORD_HASH_ARGON2_MEMORY_KIB)
+    print(f"{args.scheme} with {rounds} rounds takes {elapsed_ms:.0f} ms per hash on this host (target {args.target_ms:.0f} ms)")
+    print(f"PASSWORD_HASH_SCHEME = {args.scheme}\nPASSWORD_HASH_ROUNDS = {rounds}")
+    return 0
+
+
+def reap_sessions_command(args: argparse.Namespace) -> int:
+    result = run_async(reap_expired_sessions(batch_size=args.batch_size, pause_ms=args.pause_ms))
+    print(f"Reclaimed {result['reclaimed']} expired sessions in {result['batches']} batches, {result['seconds']:.2f} s")
+    return 0
+
+
+def init_db_command(args: argparse.Namespace) -> int:
+    from alembic import command
+    from alembic.config import Config
+
+    tables = inspect(engine).get_table_names()
+    if "alembic_version" in tables:
+        print("The database is managed by Alembic, `alembic upgrade head` migrates it")
+        return 0
+    if "users" in tables:
+        print("The database has tables but no Alembic revision, stamp the revision its schema matches before upgrading", file=sys.stderr)
+        return 1
+
+    # A fresh database gets the current schema at once, the migrations only go forward from an existing one
+    models.Base.metadata.create_all(bind=engine)
+    command.stamp(Config(args.alembic_config), "head")
+    print("Created the tables and stamped the Alembic head")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="fast-auth-server maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import-users", help="Register users with their info from a CSV or NDJSON file, hashing on PASSWORD_HASH_WORKERS threads")
+    import_parser.add_argument("path", help="File with email, password, fullname, designation and staff_id per row")
+    import_parser.add_argument("--format", choices=IMPORT_FORMATS, help="Defaults to the file extension")
+    import_parser.add_argument("--role", default="user")
+    import_parser.add_argument("--results", help="Write the result of every row to this NDJSON file instead of printing the failures")
+    import_parser.set_defaults(handler=import_users_command)
+
+    key_parser = subparsers.add_parser("generate-jwt-key", help="Write a new PEM private key for JWT_PRIVATE_KEY_FILES")
+    key_parser.add_argument("path")
+    key_parser.add_argument("--algorithm", choices=tuple(ASYMMETRIC_ALGORITHMS), default="EdDSA")
+    key_parser.set_defaults(handler=generate_jwt_key_command)
+
+    calibrate_parser = subparsers.add_parser("calibrate-password-hash", help="Print the rounds to pin in PASSWORD_HASH_ROUNDS for a target hash latency on this host")
+    calibrate_parser.add_argument("--scheme", choices=SCHEMES, default=PASSWORD_HASH_SCHEME)
+    calibrate_parser.add_argument("--target-ms", type=float, default=PASSWORD_HASH_TARGET_MS)
+    calibrate_parser.set_defaults(handler=calibrate_password_hash_command)
+
+    reap_parser = subparsers.add_parser("reap-sessions", help="Delete the expired sessions in batches, e.g. from cron with SESSION_REAPER_INTERVAL_SECONDS = 0")
+    reap_parser.add_argument("--batch-size", type=int, default=SESSION_REAPER_BATCH_SIZE, help="Sessions deleted per transaction")
+    reap_parser.add_argument("--pause-ms", type=float, default=SESSION_REAPER_PAUSE_MS, help="Pause between the batches")
+    reap_parser.set_defaults(handler=reap_sessions_command)
+
+    init_db_parser = subparsers.add_parser("init-db", help="Create the schema of a fresh database, run before `alembic upgrade head` on every deploy")
+    init_db_parser.add_argument("--alembic-config", default="alembic.ini")
+    init_db_parser.set_defaults(handler=init_db_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
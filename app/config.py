@@ -1,3 +1,87 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
 BASE_PATH = "/auth/v1"
+ENVIRONMENT = os.getenv('ENVIRONMENT', 'production')    # development relaxes the production requirements, e.g. pinned hashing rounds
 ACCESS_TOKEN_EXPIRE_MINUTES = 10  # 10 minutes
-SESSION_EXPIRE_MINUTES = 7 * 24 * 60  # 7 days
\ No newline at end of file
+SESSION_EXPIRE_MINUTES = 7 * 24 * 60  # 7 days
+MAX_SESSIONS_PER_USER = int(os.getenv('MAX_SESSIONS_PER_USER', 10))     # concurrent sessions of a user, a login beyond that ends the oldest
+SESSION_DEVICE_MAX_LENGTH = 200     # the device label of a session is the User-Agent unless the login names it
+
+# Expired sessions are deleted in batches by a background task of the app (0 disables it, e.g. when running
+# `python -m app.cli reap-sessions` from cron instead), pausing between batches to leave the DB room for requests
+SESSION_REAPER_INTERVAL_SECONDS = float(os.getenv('SESSION_REAPER_INTERVAL_SECONDS', 3600))
+SESSION_REAPER_BATCH_SIZE = int(os.getenv('SESSION_REAPER_BATCH_SIZE', 1000))
+SESSION_REAPER_PAUSE_MS = float(os.getenv('SESSION_REAPER_PAUSE_MS', 100))
+
+# Password hashing worker pool
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 32))     # jobs allowed to wait for a worker before requests get 503
+
+# Password hashing policy. The rounds have to be pinned outside development, so that every host hashes alike and a
+# start doesn't pay for a calibration. In development they're calibrated at startup to the target latency if unset
+PASSWORD_HASH_SCHEME = os.getenv('PASSWORD_HASH_SCHEME', 'bcrypt')      # bcrypt or argon2 (needs argon2-cffi)
+PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS')) if os.getenv('PASSWORD_HASH_ROUNDS') else None
+PASSWORD_HASH_TARGET_MS = float(os.getenv('PASSWORD_HASH_TARGET_MS', 250))
+PASSWORD_HASH_ROUNDS_TOLERANCE = int(os.getenv('PASSWORD_HASH_ROUNDS_TOLERANCE', 1))    # rounds a stored hash may be below the policy before it's rehashed on login
+PASSWORD_HASH_REHASH_DOWNWARD = os.getenv('PASSWORD_HASH_REHASH_DOWNWARD') == 'True'     # also rehash hashes costlier than the policy, after lowering the rounds on purpose
+PASSWORD_HASH_ARGON2_MEMORY_KIB = int(os.getenv('PASSWORD_HASH_ARGON2_MEMORY_KIB', 65536))
+
+# Carry the profile claims in the access token so /authenticate can answer valid tokens without the DB. A profile edit
+# only reissues the token of the session that made it, the user's other sessions keep answering the old profile until
+# their tokens are refreshed, i.e. for up to ACCESS_TOKEN_EXPIRE_MINUTES
+AUTH_PROFILE_CLAIMS = os.getenv('AUTH_PROFILE_CLAIMS') == 'True'
+
+# In-process cache of user records and profiles
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', 10000))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv('PROFILE_CACHE_TTL_SECONDS', 300))
+
+# Shared cache for multi worker deployments: 'memory' (per process, no external service) or 'redis'
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# How long rotated or deleted session ids are remembered, so replayed refreshes are rejected without the DB
+SESSION_CACHE_TOMBSTONE_SECONDS = float(os.getenv('SESSION_CACHE_TOMBSTONE_SECONDS', 3600))
+
+# Concurrent refreshes of one session are coalesced into a single rotation. The lock makes the other workers wait
+# for it, and the token it issued is handed to requests still presenting the old session during the grace window
+REFRESH_LOCK_SECONDS = float(os.getenv('REFRESH_LOCK_SECONDS', 5))
+REFRESH_GRACE_SECONDS = float(os.getenv('REFRESH_GRACE_SECONDS', 30))
+
+# Failed password attempts (/login and /change-password) allowed per client IP and per email within the period, with
+# bursts up to the limit, on the cache backend. Requests beyond that get 429 before any hashing, 0 disables a limit
+RATE_LIMIT_PERIOD_SECONDS = float(os.getenv('RATE_LIMIT_PERIOD_SECONDS', 60))
+RATE_LIMIT_PER_IP = int(os.getenv('RATE_LIMIT_PER_IP', 30))
+RATE_LIMIT_PER_EMAIL = int(os.getenv('RATE_LIMIT_PER_EMAIL', 10))     # per email and client IP, an email alone could be locked out by anyone
+# Header the reverse proxy puts the client IP in, e.g. X-Forwarded-For or X-Real-IP. Only set it when the app can't be
+# reached without the proxy, the header would be the client's own choice otherwise
+TRUSTED_PROXY_HEADER = os.getenv('TRUSTED_PROXY_HEADER') or None
+
+# Directory shared by the uvicorn workers for merging their metrics on /metrics, unset for a single process
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR') or None
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+# Rows fetched per server side cursor batch by the streaming /users/export
+USERS_EXPORT_BATCH_SIZE = int(os.getenv('USERS_EXPORT_BATCH_SIZE', 1000))
+
+# Largest number of rows accepted by one /users/import request, bigger files go through the cli
+BULK_IMPORT_MAX_ROWS = int(os.getenv('BULK_IMPORT_MAX_ROWS', 5000))
+
+# Token denylist, revoked jtis are grouped by exp in buckets of this many seconds with a Bloom filter each,
+# sized for the given number of revocations per bucket at the given false positive rate
+TOKEN_DENYLIST_BUCKET_SECONDS = int(os.getenv('TOKEN_DENYLIST_BUCKET_SECONDS', 60))
+TOKEN_DENYLIST_BUCKET_CAPACITY = int(os.getenv('TOKEN_DENYLIST_BUCKET_CAPACITY', 100000))
+TOKEN_DENYLIST_ERROR_RATE = float(os.getenv('TOKEN_DENYLIST_ERROR_RATE', 0.01))
+
+# Access token signing: HS256 with JWT_SECRET_KEY, or EdDSA/ES256 with PEM key files (comma separated),
+# the first private key signs and every key is published on /.well-known/jwks.json for local verification
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+JWT_PRIVATE_KEY_FILES = [path.strip() for path in os.getenv('JWT_PRIVATE_KEY_FILES', '').split(',') if path.strip()]
+JWT_PUBLIC_KEY_FILES = [path.strip() for path in os.getenv('JWT_PUBLIC_KEY_FILES', '').split(',') if path.strip()]
+JWKS_CACHE_SECONDS = int(os.getenv('JWKS_CACHE_SECONDS', 300))
+
+# Verified access tokens kept per worker, repeated requests with the same cookie skip the signature check, 0 disables
+VERIFIED_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('VERIFIED_TOKEN_CACHE_MAX_ENTRIES', 10000))
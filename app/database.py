@@ -1,18 +1,169 @@
+import asyncio
+import os
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
-from dotenv import load_dotenv
-import os
+from .cache_backends import cache_backend
+from .db_pool import InstrumentedAsyncAdaptedQueuePool, InstrumentedQueuePool
+from .db_replicas import AsyncRoutingSession, Replica, ReplicaSet, RoutingSession
+from . import config        # Loads the .env file
+
+DB_HOST = 'db' if os.getenv('FROM_DOCKER') == 'True' else 'localhost'      #hostname localhost or service name when ran from docker
+SQLALCHEMY_DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{DB_HOST}:5432/{os.getenv('DB_NAME')}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{DB_HOST}:5432/{os.getenv('DB_NAME')}"
+
+# Full URLs override the DB_* settings, e.g. DATABASE_URL=sqlite:///loadtest.db as a local stand-in for Postgres
+SQLALCHEMY_DATABASE_URL = os.getenv('DATABASE_URL', SQLALCHEMY_DATABASE_URL)
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', ASYNC_SQLALCHEMY_DATABASE_URL)
+
+# Read replicas for the service functions marked @replica_read, comma separated URLs. ASYNC_DB_REPLICA_URLS lists
+# the same servers in the same order for DB_ASYNC_MODE
+DB_REPLICA_URLS = [url.strip() for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()]
+ASYNC_DB_REPLICA_URLS = [url.strip() for url in os.getenv('ASYNC_DB_REPLICA_URLS', '').split(',') if url.strip()]
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 5))      # replicas further behind get no reads until they catch up
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DB_REPLICA_LAG_CHECK_SECONDS', 2))
+# Reads about a user go to the primary this long after their info or password changed, keep it above the max lag plus the check interval
+DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))
+
+# Serve the routes with AsyncSession on asyncpg instead of sync sessions on the threadpool
+DB_ASYNC_MODE = os.getenv('DB_ASYNC_MODE') == 'True'
+
+# Connection pool, per engine and worker process
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))      # seconds to wait for a connection before failing
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', -1))        # seconds before a connection is replaced, -1 never
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING') == 'True'
+
+# Server side timeouts in milliseconds, 0 keeps the server default
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+DB_LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', 0))
+
+server_settings = {}
+if DB_STATEMENT_TIMEOUT_MS:
+    server_settings['statement_timeout'] = str(DB_STATEMENT_TIMEOUT_MS)
+if DB_LOCK_TIMEOUT_MS:
+    server_settings['lock_timeout'] = str(DB_LOCK_TIMEOUT_MS)
+
+pool_options = dict(
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING
+)
+
+
+def create_sync_engine(url: str):
+    connect_args = {}
+    if url.startswith('sqlite'):
+        connect_args['check_same_thread'] = False      # Sessions are used from the threadpool
+    elif server_settings:
+        # psycopg2 takes the server settings as libpq options
+        connect_args['options'] = ' '.join(f'-c {name}={value}' for name, value in server_settings.items())
+
+    return create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        connect_args=connect_args,
+        **pool_options
+    )
+
+
+def create_asyncio_engine(url: str):
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        connect_args={'server_settings': server_settings} if server_settings else {},
+        **pool_options
+    )
 
-# Load environment variables from .env file
-load_dotenv()
 
-SQLALCHEMY_DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{'db' if os.getenv('FROM_DOCKER') == 'True' else 'localhost'}:5432/{os.getenv('DB_NAME')}"      #hostname localhost or service name when ran from docker
+if DB_ASYNC_MODE and len(ASYNC_DB_REPLICA_URLS) != len(DB_REPLICA_URLS):
+    raise ValueError("ASYNC_DB_REPLICA_URLS must list the same replicas as DB_REPLICA_URLS")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+# The sync engines of the replicas also measure their lag in DB_ASYNC_MODE
+replica_set = ReplicaSet(
+    [
+        Replica(f"replica{index}", create_sync_engine(url), create_asyncio_engine(ASYNC_DB_REPLICA_URLS[index]) if DB_ASYNC_MODE else None)
+        for index, url in enumerate(DB_REPLICA_URLS)
+    ],
+    max_lag_seconds=DB_REPLICA_MAX_LAG_SECONDS,
+    sticky_seconds=DB_REPLICA_STICKY_SECONDS,
+    backend=cache_backend
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+engine = create_sync_engine(SQLALCHEMY_DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession, replica_set=replica_set)
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC_MODE:
+    async_engine = create_asyncio_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    # Objects are not expired on commit since lazy refreshing an attribute is not possible outside of an await
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, sync_session_class=AsyncRoutingSession, replica_set=replica_set, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+# Type of the session handed out by get_db, depends on DB_ASYNC_MODE
+DBSession = Session | AsyncSession
+
+
+# Dependency
+def get_sync_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if DB_ASYNC_MODE else get_sync_db
+
+
+def pool_stats() -> dict:
+    pools = {"sync": engine.pool}
+    if async_engine is not None:
+        pools["async"] = async_engine.pool
+    for replica in replica_set.replicas:
+        pools[f"{replica.name}_sync"] = replica.engine.pool
+        if replica.async_engine is not None:
+            pools[f"{replica.name}_async"] = replica.async_engine.pool
+    return {name: pool.stats() for name, pool in pools.items() if hasattr(pool, "stats")}
+
+
+async def warm_up_pool(connections: int = DB_POOL_SIZE) -> int:
+    '''
+    Opens `connections` connections of the engine the routes use concurrently and returns them to its pool, so the
+    first requests after a start don't each wait for a connection to be established
+    '''
+    if DB_ASYNC_MODE:
+        opened = await asyncio.gather(*(async_engine.connect().start() for _ in range(connections)), return_exceptions=True)
+    else:
+        opened = await asyncio.gather(*(asyncio.to_thread(engine.connect) for _ in range(connections)), return_exceptions=True)
+
+    errors = [connection for connection in opened if isinstance(connection, Exception)]
+    for connection in opened:
+        if not isinstance(connection, Exception):
+            await connection.close() if DB_ASYNC_MODE else connection.close()
+    if errors:
+        raise errors[0]
+    return len(opened)
+
+
+async def dispose_engines():
+    engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica in replica_set.replicas:
+        replica.engine.dispose()
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
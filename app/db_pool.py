@@ -0,0 +1,57 @@
+'''
+Connection pools that record how long checkouts wait for a connection, to tell when the pool is the bottleneck
+'''
+
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolInstrumentation:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_ns_total = 0
+        self.checkout_wait_ns_max = 0
+
+    def _do_get(self):
+        started_at = time.perf_counter_ns()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+
+        wait_ns = time.perf_counter_ns() - started_at
+        with self._stats_lock:
+            self.checkouts += 1
+            self.checkout_wait_ns_total += wait_ns
+            self.checkout_wait_ns_max = max(self.checkout_wait_ns_max, wait_ns)
+        return connection
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            checkouts = self.checkouts or 1
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(0, self.overflow()),        # Negative while the pool is still filling up
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_ms_avg": self.checkout_wait_ns_total / checkouts / 1e6,
+                "checkout_wait_ms_max": self.checkout_wait_ns_max / 1e6,
+            }
+
+
+class InstrumentedQueuePool(PoolInstrumentation, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(PoolInstrumentation, AsyncAdaptedQueuePool):
+    pass
@@ -0,0 +1,229 @@
+'''
+Read replicas. The statements of service functions decorated with @replica_read go to a replica, everything else
+goes to the primary: writes, SELECT ... FOR UPDATE, flushes, and every statement of a session after it wrote.
+
+- A session keeps the replica it picked first, so the reads of one request see a single server
+- Replicas are only picked while their lag is at most DB_REPLICA_MAX_LAG_SECONDS. A background task of the app
+  measures it every DB_REPLICA_LAG_CHECK_SECONDS. Until the first measurement, or while a replica can't be
+  reached, its reads fall back to the primary
+- Read your writes: after a user's info or password changes, the reads about that user go to the primary for
+  DB_REPLICA_STICKY_SECONDS. Tracked in the cache backend so every worker knows
+- Rows read from a replica don't fill the shared profile cache, a stale copy would outlive the sticky window there
+'''
+
+import asyncio
+import functools
+import inspect
+import itertools
+from contextlib import contextmanager
+
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
+
+from .cache_backends import CacheBackend
+
+# Seconds the replay of a standby is behind, 0 once it replayed everything it received or when it isn't a standby.
+# Comparing the LSNs first keeps an idle primary from looking like lag
+POSTGRES_LAG_QUERY = text(
+    "SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)"
+)
+
+# Session.info keys
+REPLICA_READS = "replica_reads"
+REPLICA = "replica"
+WROTE = "wrote"
+
+
+class Replica:
+    def __init__(self, name: str, engine: Engine, async_engine: AsyncEngine | None = None):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        self.lag_seconds: float | None = None       # None until measured and while it can't be reached
+        self.reads = 0
+
+    def measure_lag(self) -> float:
+        with self.engine.connect() as connection:
+            if connection.dialect.name != "postgresql":
+                return 0.0      # e.g. a SQLite stand-in, only checks that it can be reached
+            return float(connection.execute(POSTGRES_LAG_QUERY).scalar())
+
+
+class ReplicaSet:
+    def __init__(self, replicas: list[Replica], max_lag_seconds: float, sticky_seconds: float, backend: CacheBackend):
+        self.replicas = replicas
+        self.max_lag_seconds = max_lag_seconds
+        self.sticky_seconds = sticky_seconds
+        self.backend = backend
+        self.primary_fallbacks = 0
+        self._next = itertools.count()
+
+    def in_sync(self, replica: Replica) -> bool:
+        return replica.lag_seconds is not None and replica.lag_seconds <= self.max_lag_seconds
+
+    def pick(self) -> Replica | None:
+        # Round robin over the replicas in sync, None sends the reads to the primary
+        replicas = [replica for replica in self.replicas if self.in_sync(replica)]
+        if not replicas:
+            self.primary_fallbacks += 1
+            return None
+        return replicas[next(self._next) % len(replicas)]
+
+    def mark_down(self, replica: Replica):
+        # Out of the rotation until the next lag check reaches it
+        if self.in_sync(replica):
+            print(f"Replica lag monitor | {replica.name} out of rotation, it failed a read")
+        replica.lag_seconds = None
+
+    def check_lag(self):
+        for replica in self.replicas:
+            was_in_sync = self.in_sync(replica)
+            error = None
+            try:
+                replica.lag_seconds = replica.measure_lag()
+            except Exception as e:
+                replica.lag_seconds, error = None, e
+
+            if self.in_sync(replica) != was_in_sync:
+                state = "back in rotation" if self.in_sync(replica) else "out of rotation"
+                print(f"Replica lag monitor | {replica.name} {state}, {error or f'{replica.lag_seconds:.1f} s behind'}")
+
+    async def run_lag_monitor(self, interval_seconds: float):
+        while True:
+            await asyncio.to_thread(self.check_lag)
+            await asyncio.sleep(interval_seconds)
+
+    def start_lag_monitor(self, interval_seconds: float) -> asyncio.Task | None:
+        if not self.replicas:
+            return None
+        return asyncio.create_task(self.run_lag_monitor(interval_seconds), name="replica-lag-monitor")
+
+    # ============== Read your writes ==============
+    def stick_to_primary(self, user_id: int):
+        if self.replicas:
+            self.backend.set(f"primary-reads:{user_id}", True, ttl_seconds=self.sticky_seconds)
+
+    def is_sticky(self, user_id: int) -> bool:
+        return self.backend.get(f"primary-reads:{user_id}") is not None
+
+    def stats(self) -> dict:
+        return {
+            "max_lag_seconds": self.max_lag_seconds,
+            "primary_fallbacks": self.primary_fallbacks,
+            "replicas": {replica.name: {"lag_seconds": replica.lag_seconds, "in_sync": self.in_sync(replica), "reads": replica.reads} for replica in self.replicas},
+        }
+
+
+class RoutingSession(Session):
+    '''
+    Session class of SessionLocal, its bind is the primary
+    '''
+
+    def __init__(self, *args, replica_set: ReplicaSet | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica_set = replica_set
+
+    def replica_engine(self, replica: Replica) -> Engine:
+        return replica.engine
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or (clause is not None and clause.is_dml):
+            self.info[WROTE] = True
+        elif self.info.get(REPLICA_READS) and not self.info.get(WROTE) and clause is not None and clause.is_select and getattr(clause, "_for_update_arg", None) is None:
+            replica = self.info.get(REPLICA) or self.replica_set.pick()
+            if replica is not None:
+                self.info[REPLICA] = replica
+                replica.reads += 1
+                return self.replica_engine(replica)
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+class AsyncRoutingSession(RoutingSession):
+    '''
+    sync_session_class of AsyncSessionLocal
+    '''
+
+    def replica_engine(self, replica: Replica) -> Engine:
+        return replica.async_engine.sync_engine
+
+
+def routing_session(db: Session | AsyncSession) -> Session:
+    return db.sync_session if isinstance(db, AsyncSession) else db
+
+
+@contextmanager
+def replica_reads(db: Session | AsyncSession):
+    '''
+    Sends the SELECTs of `db` inside the block to a replica, unless it wrote already
+    '''
+    session = routing_session(db)
+    session.info[REPLICA_READS] = session.info.get(REPLICA_READS, 0) + 1
+    try:
+        yield
+    finally:
+        session.info[REPLICA_READS] -= 1
+
+
+def served_by_replica(db: Session | AsyncSession) -> bool:
+    # Whether the SELECTs `db` just ran went to a replica
+    session = routing_session(db)
+    return bool(session.info.get(REPLICA_READS)) and session.info.get(REPLICA) is not None and not session.info.get(WROTE)
+
+
+def replica_failed(db: Session | AsyncSession) -> bool:
+    # After a connection error on a replica, whether the call can be retried on the primary: only if the session didn't write
+    session = routing_session(db)
+    replica = session.info.pop(REPLICA, None)
+    if replica is None:
+        return False
+    session.replica_set.mark_down(replica)
+    return not session.info.get(WROTE)
+
+
+def replica_read(func):
+    '''
+    Runs a read-only service function `func(db, ...)` on a replica. A `user_id` argument, positional or keyword,
+    makes it read your writes, and a replica that can't be reached is retried on the primary
+    '''
+    signature = inspect.signature(func)
+
+    def replica_routing(db: Session | AsyncSession, args: tuple, kwargs: dict) -> tuple[ReplicaSet | None, int | None]:
+        # The replica set when there are replicas, and the user whose reads may have to stick to the primary
+        replica_set = getattr(routing_session(db), "replica_set", None)
+        if replica_set is None or not replica_set.replicas:
+            return None, None
+        return replica_set, signature.bind(db, *args, **kwargs).arguments.get("user_id")
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(db: AsyncSession, *args, **kwargs):
+            replica_set, user_id = replica_routing(db, args, kwargs)
+            if replica_set is None or (user_id is not None and await replica_set.backend.call(replica_set.is_sticky, user_id)):
+                return await func(db, *args, **kwargs)
+            try:
+                with replica_reads(db):
+                    return await func(db, *args, **kwargs)
+            except OperationalError:
+                if not replica_failed(db):
+                    raise
+            await db.rollback()
+            return await func(db, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(db: Session, *args, **kwargs):
+        replica_set, user_id = replica_routing(db, args, kwargs)
+        if replica_set is None or (user_id is not None and replica_set.is_sticky(user_id)):
+            return func(db, *args, **kwargs)
+        try:
+            with replica_reads(db):
+                return func(db, *args, **kwargs)
+        except OperationalError:
+            if not replica_failed(db):
+                raise
+        db.rollback()
+        return func(db, *args, **kwargs)
+    return wrapper
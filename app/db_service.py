@@ -0,0 +1,35 @@
+'''
+Picks the service implementation matching the configured database mode, so the async routes can always
+`await db_service.<function>(db, ...)` whether the session behind `get_db` is sync or async
+'''
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import service, async_service
+from .database import DB_ASYNC_MODE
+
+
+class ThreadpoolService:
+    '''
+    Awaitable facade over the sync service module, every call is run on the threadpool
+    '''
+
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name: str):
+        func = getattr(self._module, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(func, *args, **kwargs)
+
+        setattr(self, name, call)      # Cache the wrapper so the lookup happens once per function
+        return call
+
+
+db_service = async_service if DB_ASYNC_MODE else ThreadpoolService(service)
+
+
+def export_detailed_users(batch_size: int):
+    # Not wrapped by the facade, StreamingResponse iterates a sync generator on the threadpool by itself
+    return (async_service if DB_ASYNC_MODE else service).export_detailed_users(batch_size=batch_size)
@@ -0,0 +1,89 @@
+'''
+Key ring for asymmetric access token signing (EdDSA or ES256), enabled by JWT_ALGORITHM.
+
+The first of JWT_PRIVATE_KEY_FILES signs new tokens, the others plus the public keys in JWT_PUBLIC_KEY_FILES only
+verify. All of them are published on /.well-known/jwks.json with their kid (the RFC 7638 thumbprint) which is also
+put in the token headers, so other services can verify tokens locally with the public keys.
+
+Rotation, without ever rejecting a valid token:
+1. Add the new public key to JWT_PUBLIC_KEY_FILES, downstream services see it once their JWKS cache expires
+2. Put the new private key first in JWT_PRIVATE_KEY_FILES and move the old one to JWT_PUBLIC_KEY_FILES
+3. Remove the old key after SESSION_EXPIRE_MINUTES, expired tokens it signed are still verified when refreshed until then
+'''
+
+import base64
+import hashlib
+import json
+
+import orjson
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+
+ASYMMETRIC_ALGORITHMS = {
+    "EdDSA": OKPAlgorithm,
+    "ES256": ECAlgorithm,
+}
+
+# Members of each key type that make up the RFC 7638 thumbprint
+THUMBPRINT_MEMBERS = {"OKP": ("crv", "kty", "x"), "EC": ("crv", "kty", "x", "y")}
+
+
+def generate_private_key(algorithm: str) -> bytes:
+    if algorithm == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == "ES256":
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f"Unsupported algorithm {algorithm}")
+    return private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+
+def read_pem(path: str, private: bool):
+    with open(path, "rb") as key_file:
+        pem = key_file.read()
+    if private:
+        return serialization.load_pem_private_key(pem, password=None)
+    if b"PRIVATE KEY" in pem:       # A retired private key can be listed as is, only its public half is used
+        return serialization.load_pem_private_key(pem, password=None).public_key()
+    return serialization.load_pem_public_key(pem)
+
+
+class KeyRing:
+    def __init__(self, algorithm: str, private_key_files: list[str], public_key_files: list[str]):
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported algorithm {algorithm}, expected one of {', '.join(ASYMMETRIC_ALGORITHMS)}")
+        if not private_key_files:
+            raise ValueError(f"{algorithm} needs a signing key in JWT_PRIVATE_KEY_FILES")
+
+        self.algorithm = algorithm
+        self.jwk_algorithm = ASYMMETRIC_ALGORITHMS[algorithm]
+
+        private_keys = [read_pem(path, private=True) for path in private_key_files]
+        public_keys = [private_key.public_key() for private_key in private_keys] + [read_pem(path, private=False) for path in public_key_files]
+
+        self.verification_keys = {}
+        jwks = []
+        for public_key in public_keys:
+            jwk = self.jwk_algorithm.to_jwk(public_key, as_dict=True)
+            kid = self.thumbprint(jwk)
+            if kid in self.verification_keys:
+                continue
+            self.verification_keys[kid] = public_key
+            jwks.append({**jwk, "kid": kid, "alg": algorithm, "use": "sig"})
+
+        self.signing_key = private_keys[0]
+        self.signing_kid = self.thumbprint(self.jwk_algorithm.to_jwk(self.signing_key.public_key(), as_dict=True))
+
+        # Served as is by /.well-known/jwks.json
+        self.jwks_json = orjson.dumps({"keys": jwks})
+        self.jwks_etag = '"' + hashlib.sha256(self.jwks_json).hexdigest()[:32] + '"'
+
+    @staticmethod
+    def thumbprint(jwk: dict) -> str:
+        members = {member: jwk[member] for member in THUMBPRINT_MEMBERS[jwk["kty"]]}
+        canonical = json.dumps(members, separators=(",", ":"), sort_keys=True).encode()
+        return base64.urlsafe_b64encode(hashlib.sha256(canonical).digest()).decode().rstrip("=")
+
+    def verification_key(self, kid: str | None):
+        return self.verification_keys.get(kid)
@@ -0,0 +1,256 @@
+'''
+Lightweight Prometheus style metrics: counters, gauges and histograms kept in process memory and rendered
+in the text exposition format by /metrics.
+
+With several uvicorn workers set METRICS_MULTIPROC_DIR to a directory shared by the workers, each worker then
+flushes a snapshot of its metrics there every METRICS_FLUSH_SECONDS, and a scrape served by any worker merges
+the snapshots of all of them. Counters and histograms are summed, gauges are reported per worker.
+'''
+
+import bisect
+import glob
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable
+
+import orjson
+
+from .config import *
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "type": self.type,
+                "documentation": self.documentation,
+                "labelnames": self.labelnames,
+                "samples": [[list(labels), self._copy(value)] for labels, value in self._values.items()],
+            }
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            value_entry = self._values.get(labels)
+            if value_entry is None:
+                # Per bucket (not cumulative) counts with a last +Inf bucket, then the sum
+                value_entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            value_entry[0][bucket_index] += 1
+            value_entry[1] += value
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = self.buckets
+        return snapshot
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+
+class MetricsRegistry:
+    def __init__(self, multiproc_dir: str | None = None, flush_seconds: float = 5):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors: list[Callable[[], Iterable[tuple[str, str, str, float]]]] = []
+        self.multiproc_dir = multiproc_dir
+        self.flush_seconds = flush_seconds
+        self._flush_thread = None
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, float]]]):
+        '''
+        Collectors are called at scrape/flush time and yield (name, type, documentation, value) samples,
+        for state that already lives elsewhere such as the hasher, cache and pool stats
+        '''
+        self.collectors.append(collector)
+
+    # ============== Snapshots ==============
+    def snapshot(self) -> dict:
+        snapshot = {name: metric.snapshot() for name, metric in self.metrics.items()}
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:      # A broken collector must not break the scrape
+                print(f"Metrics collector error: {e}")
+                continue
+            for name, metric_type, documentation, value in samples:
+                snapshot[name] = {"type": metric_type, "documentation": documentation, "labelnames": (), "samples": [[[], value]]}
+        return snapshot
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics-{pid}.json")
+
+    def flush(self):
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = self._snapshot_path(os.getpid())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(orjson.dumps({"pid": os.getpid(), "written_at": time.time(), "metrics": self.snapshot()}))
+        os.replace(temp_path, path)      # Readers never see a partially written snapshot
+
+    def start_flushing(self):
+        if self.multiproc_dir is None or self._flush_thread is not None:
+            return
+
+        def flush_periodically():
+            while True:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Metrics flush error: {e}")
+                time.sleep(self.flush_seconds)
+
+        self._flush_thread = threading.Thread(target=flush_periodically, name="metrics-flush", daemon=True)
+        self._flush_thread.start()
+
+    def collect_all_workers(self) -> list[tuple[int, bool, dict]]:
+        '''Returns (pid, is_live, metrics snapshot) for this worker and every worker that flushed to the shared directory'''
+        own_pid = os.getpid()
+        worker_snapshots = [(own_pid, True, self.snapshot())]
+        if self.multiproc_dir is None:
+            return worker_snapshots
+
+        stale_before = time.time() - 3 * self.flush_seconds
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics-*.json")):
+            try:
+                with open(path, "rb") as snapshot_file:
+                    worker_snapshot = orjson.loads(snapshot_file.read())
+            except (OSError, orjson.JSONDecodeError):
+                continue
+            if worker_snapshot["pid"] == own_pid:
+                continue
+            worker_snapshots.append((worker_snapshot["pid"], worker_snapshot["written_at"] >= stale_before, worker_snapshot["metrics"]))
+        return worker_snapshots
+
+    # ============== Exposition ==============
+    def render(self) -> str:
+        worker_snapshots = self.collect_all_workers()
+        per_worker = self.multiproc_dir is not None
+
+        merged: dict[str, dict] = {}
+        for pid, is_live, metrics in worker_snapshots:
+            for name, metric in metrics.items():
+                target = merged.setdefault(name, {**metric, "samples": {}})
+                for labels, value in metric["samples"]:
+                    labels = tuple(labels)
+                    if metric["type"] == "gauge":
+                        # Gauges of workers that stopped flushing no longer describe anything
+                        if not is_live:
+                            continue
+                        if per_worker:
+                            labels = labels + (str(pid),)
+                        target["samples"][labels] = value
+                    elif metric["type"] == "histogram":
+                        current = target["samples"].get(labels)
+                        if current is None:
+                            target["samples"][labels] = [list(value[0]), value[1]]
+                        else:
+                            current[0] = [a + b for a, b in zip(current[0], value[0])]
+                            current[1] += value[1]
+                    else:
+                        target["samples"][labels] = target["samples"].get(labels, 0) + value
+
+        lines = []
+        for name, metric in merged.items():
+            labelnames = tuple(metric["labelnames"])
+            if metric["type"] == "gauge" and per_worker:
+                labelnames = labelnames + ("worker",)
+
+            lines.append(f"# HELP {name} {metric['documentation']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in metric["samples"].items():
+                if metric["type"] == "histogram":
+                    cumulative = 0
+                    bucket_bounds = list(metric["buckets"]) + [math.inf]
+                    for bound, count in zip(bucket_bounds, value[0]):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append(f"{name}_bucket{format_labels(labelnames + ('le',), labels + (le,))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labelnames, labels)} {value[1]}")
+                    lines.append(f"{name}_count{format_labels(labelnames, labels)} {cumulative}")
+                else:
+                    lines.append(f"{name}{format_labels(labelnames, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labelnames: tuple, labels: tuple) -> str:
+    if not labelnames:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+registry = MetricsRegistry(multiproc_dir=METRICS_MULTIPROC_DIR, flush_seconds=METRICS_FLUSH_SECONDS)
+
+# ============== Application metrics ==============
+http_request_duration_seconds = registry.histogram("http_request_duration_seconds", "HTTP request latency by route template and status", ("method", "route", "status"))
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+token_refreshes_total = registry.counter("auth_token_refreshes_total", "Expired access token refresh attempts by result", ("result",))
+login_failures_total = registry.counter("auth_login_failures_total", "Rejected logins by reason", ("reason",))
+cookie_deletions_total = registry.counter("auth_cookie_deletions_total", "Access token cookies deleted by the AuthenticationMiddleware")
+token_revocations_total = registry.counter("auth_token_revocations_total", "Access tokens added to the denylist")
+token_denylist_lookups_total = registry.counter("auth_token_denylist_lookups_total", "Denylist lookups by outcome, filtered ones needed no I/O", ("result",))
+token_refresh_sources_total = registry.counter("auth_token_refresh_sources_total", "Refreshed tokens by where they came from, only `rotated` costs a DB write", ("source",))
+password_rehashes_total = registry.counter("auth_password_rehashes_total", "Background rehashes of passwords hashed under an older policy, by result", ("result",))
+rate_limit_decisions_total = registry.counter("auth_rate_limit_decisions_total", "Password attempts checked against the rate limits, by limit and decision", ("scope", "result"))
+sessions_reaped_total = registry.counter("auth_sessions_reaped_total", "Expired sessions deleted by the session reaper")
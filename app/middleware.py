@@ -0,0 +1,42 @@
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import http_request_duration_seconds, http_requests_in_flight
+
+
+class ProcessTimeMiddleware:
+    '''
+    Adds the X-Process-Time header and records the request latency per route and status,
+    as pure ASGI middleware patching the http.response.start message
+    '''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter_ns()
+        status_code = 500       # Reported if the app fails before starting a response
+
+        async def send_with_process_time(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = (time.perf_counter_ns() - start_time) / 1e9
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", f"{process_time * 1000} ms")
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_process_time)
+        finally:
+            http_requests_in_flight.dec()
+            # Label by route template (set by the router) so path parameters don't multiply the series
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            http_request_duration_seconds.observe((time.perf_counter_ns() - start_time) / 1e9, scope["method"], route_path, str(status_code))
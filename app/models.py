@@ -1,5 +1,5 @@
-from datetime import datetime, UTC
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Uuid, func
+from datetime import datetime
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Uuid, func
 from sqlalchemy.orm import relationship
 
 from .database import Base
@@ -16,7 +16,7 @@ class User(Base):
 
     user_info = relationship("UserInfo", back_populates="user", uselist=False, cascade="all, delete-orphan")
     items = relationship("Item", back_populates="owner")
-    session = relationship("UserSession", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    sessions = relationship("UserSession", back_populates="user", cascade="all, delete-orphan")
 
 
 class UserInfo(Base):
@@ -46,8 +46,14 @@ class UserSession(Base):
 
     id = Column(Integer, primary_key=True)
     session_id = Column(Uuid, unique=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True)
-    created_at = Column(DateTime(), default=datetime.now())
-    updated_at = Column(DateTime(), default=datetime.now(), onupdate=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"))
+    device = Column(String, nullable=False, default="unknown", server_default="unknown")
+    created_at = Column(DateTime(), default=datetime.now, index=True)      # Sessions expire by it, the reaper range scans it
+    updated_at = Column(DateTime(), default=datetime.now, onupdate=func.now())
+
+    user = relationship("User", back_populates="sessions")
 
-    user = relationship("User", back_populates="session")
\ No newline at end of file
+    __table_args__ = (
+        # Every login is a session of its own, the device is only a label. Listing the sessions of a user and dropping the oldest over MAX_SESSIONS_PER_USER
+        Index("ix_sessions_user_id_created_at", "user_id", "created_at"),
+    )
\ No newline at end of file
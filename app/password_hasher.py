@@ -0,0 +1,132 @@
+'''
+Dedicated worker pool for the CPU heavy password hashing and verification
+'''
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    '''
+    Runs hash/verify calls on a size capped thread pool (bcrypt releases the GIL while hashing) so that
+    a burst of logins can only occupy `max_workers` threads, instead of the whole request threadpool.
+    At most `max_workers + max_queue_depth` jobs are accepted at a time, anything beyond that is
+    rejected immediately with PasswordHasherBusy rather than waiting in an unbounded queue.
+    '''
+
+    def __init__(self, hash_func: Callable[[str], str], verify_func: Callable[[str, str], bool], max_workers: int, max_queue_depth: int):
+        self.hash_func = hash_func
+        self.verify_func = verify_func
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_depth)
+        # Shared by all the hash_many batches, concurrent imports together still queue at most `max_workers` jobs.
+        # Created on first use by the running loop: the hasher is built off the loop, e.g. by the lifespan's worker
+        # thread, and a semaphore can't be awaited from another loop than the one it was first used on
+        self._bulk_window: asyncio.Semaphore | None = None
+        self._bulk_window_loop: asyncio.AbstractEventLoop | None = None
+
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_wait_ns_total = 0
+        self._queue_wait_ns_max = 0
+        self._hash_ns_total = 0
+        self._hash_ns_max = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.hash_func, password)
+
+    async def verify(self, password: str, hashed_pass: str) -> bool:
+        return await self._submit(self.verify_func, password, hashed_pass)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        '''
+        Hashes a batch (bulk imports) on all the workers in parallel. It isn't limited by the queue depth, instead
+        at most `max_workers` bulk jobs, of all the batches, are queued at a time, so requests arriving meanwhile
+        only wait behind one round of hashes instead of the whole batch
+        '''
+        bulk_window = self._bulk_window_of_running_loop()
+
+        async def hash_one(password: str) -> str:
+            async with bulk_window:
+                with self._stats_lock:
+                    self._in_flight += 1
+                future = self._executor.submit(self._job, self.hash_func, (password,), time.perf_counter_ns())
+                future.add_done_callback(self._finished)
+                return await asyncio.wrap_future(future)
+
+        return list(await asyncio.gather(*(hash_one(password) for password in passwords)))
+
+    def _bulk_window_of_running_loop(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._bulk_window_loop is not loop:
+            self._bulk_window = asyncio.Semaphore(self.max_workers)
+            self._bulk_window_loop = loop
+        return self._bulk_window
+
+    async def _submit(self, func: Callable, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            raise PasswordHasherBusy
+
+        with self._stats_lock:
+            self._in_flight += 1
+
+        future = self._executor.submit(self._job, func, args, time.perf_counter_ns())
+        # Free the slot when the job actually finishes, not when the awaiting request goes away
+        future.add_done_callback(self._release)
+
+        return await asyncio.wrap_future(future)
+
+    def _job(self, func: Callable, args: tuple, enqueued_at: int):
+        started_at = time.perf_counter_ns()
+        try:
+            return func(*args)
+        finally:
+            self._record(queue_wait_ns=started_at - enqueued_at, hash_ns=time.perf_counter_ns() - started_at)
+
+    def _finished(self, _future):
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def _release(self, future):
+        self._finished(future)
+        self._slots.release()
+
+    def _record(self, queue_wait_ns: int, hash_ns: int):
+        with self._stats_lock:
+            self._completed += 1
+            self._queue_wait_ns_total += queue_wait_ns
+            self._queue_wait_ns_max = max(self._queue_wait_ns_max, queue_wait_ns)
+            self._hash_ns_total += hash_ns
+            self._hash_ns_max = max(self._hash_ns_max, hash_ns)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            completed = self._completed or 1
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "queue_wait_ms_avg": self._queue_wait_ns_total / completed / 1e6,
+                "queue_wait_ms_max": self._queue_wait_ns_max / 1e6,
+                "hash_ms_avg": self._hash_ns_total / completed / 1e6,
+                "hash_ms_max": self._hash_ns_max / 1e6,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
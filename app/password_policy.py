@@ -0,0 +1,127 @@
+'''
+Password hashing policy: the scheme (bcrypt, or argon2 with argon2-cffi installed) and its cost.
+
+Passlib calls the cost "rounds": the log2 work factor for bcrypt and the time_cost (passes over
+PASSWORD_HASH_ARGON2_MEMORY_KIB of memory) for argon2. Outside development PASSWORD_HASH_ROUNDS has to be pinned,
+e.g. to what `python -m app.cli calibrate-password-hash` prints on the production hardware. In development an unset
+PASSWORD_HASH_ROUNDS is calibrated at startup so that one hash takes about PASSWORD_HASH_TARGET_MS on this host,
+never below the scheme's default, so slow hardware doesn't weaken the hashes already stored.
+
+A stored hash needs an update when it uses the other scheme or when its rounds are more than
+PASSWORD_HASH_ROUNDS_TOLERANCE below the policy. /login then rehashes it in the background. Hashes costlier than the
+policy are kept unless PASSWORD_HASH_REHASH_DOWNWARD is set, hosts whose policies differ don't undo each other's
+rehashes and a lower policy never weakens a hash by accident.
+'''
+
+import math
+import time
+
+from passlib.context import CryptContext
+
+SCHEMES = ("bcrypt", "argon2")
+
+# Rounds calibration never goes outside of, the lower bounds are the defaults the existing hashes were made with
+ROUNDS_LIMITS = {"bcrypt": (12, 16), "argon2": (3, 20)}
+
+CALIBRATION_PASSWORD = "calibration-password"
+
+
+class PasswordHashPolicy:
+    def __init__(self, scheme: str, rounds: int, rounds_tolerance: int = 0, argon2_memory_kib: int = 65536, calibrated_ms: float | None = None,
+                 rehash_downward: bool = False):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unsupported password hash scheme {scheme}, expected one of {', '.join(SCHEMES)}")
+
+        self.scheme = scheme
+        self.rounds = rounds
+        self.rounds_tolerance = rounds_tolerance
+        self.argon2_memory_kib = argon2_memory_kib
+        self.calibrated_ms = calibrated_ms
+        self.rehash_downward = rehash_downward
+
+    def context(self) -> CryptContext:
+        # The other scheme stays listed so its hashes still verify, deprecated so that they get rehashed
+        settings = {
+            f"{self.scheme}__default_rounds": self.rounds,
+            f"{self.scheme}__min_rounds": max(hash_handler(self.scheme, self.rounds, self.argon2_memory_kib).min_rounds, self.rounds - self.rounds_tolerance),
+        }
+        if self.rehash_downward:
+            settings[f"{self.scheme}__max_rounds"] = self.rounds + self.rounds_tolerance
+        if self.scheme == "argon2":
+            settings["argon2__memory_cost"] = self.argon2_memory_kib
+        return CryptContext(schemes=[self.scheme, *(scheme for scheme in SCHEMES if scheme != self.scheme)], default=self.scheme, deprecated="auto", **settings)
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.scheme,
+            "rounds": self.rounds,
+            "rounds_tolerance": self.rounds_tolerance,
+            "rehash_downward": self.rehash_downward,
+            "calibrated_ms": self.calibrated_ms,
+        }
+
+
+def hash_handler(scheme: str, rounds: int, argon2_memory_kib: int):
+    handler = CryptContext(schemes=[scheme]).handler(scheme)
+    if scheme == "argon2":
+        return handler.using(rounds=rounds, memory_cost=argon2_memory_kib)
+    return handler.using(rounds=rounds)
+
+
+def time_hash_ms(scheme: str, rounds: int, argon2_memory_kib: int, repeat: int = 2) -> float:
+    handler = hash_handler(scheme, rounds, argon2_memory_kib)
+    samples = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        handler.hash(CALIBRATION_PASSWORD)
+        samples.append((time.perf_counter() - started_at) * 1000)
+    return min(samples)
+
+
+def calibrate_rounds(scheme: str, target_ms: float, argon2_memory_kib: int = 65536) -> tuple[int, float]:
+    '''
+    Returns the highest rounds whose hash takes at most `target_ms` (never below the scheme's default) and how long
+    a hash takes with them. Times the minimum rounds, predicts the rest from the cost model of the scheme (bcrypt
+    doubles per round, argon2 grows linearly) and checks the prediction, so it costs a couple of target hashes
+    '''
+    min_rounds, max_rounds = ROUNDS_LIMITS[scheme]
+    hash_handler(scheme, min_rounds, argon2_memory_kib).hash(CALIBRATION_PASSWORD)      # Loads the backend
+
+    base_ms = time_hash_ms(scheme, min_rounds, argon2_memory_kib)
+    if base_ms >= target_ms:
+        return min_rounds, base_ms
+
+    log2_cost = hash_handler(scheme, min_rounds, argon2_memory_kib).rounds_cost == "log2"
+    if log2_cost:
+        rounds = min_rounds + int(math.log2(target_ms / base_ms))
+    else:
+        rounds = int(min_rounds * target_ms / base_ms)
+    rounds = min(rounds, max_rounds)
+
+    elapsed_ms = time_hash_ms(scheme, rounds, argon2_memory_kib)
+    while elapsed_ms > target_ms and rounds > min_rounds:
+        rounds -= 1
+        elapsed_ms = time_hash_ms(scheme, rounds, argon2_memory_kib)
+
+    # A fixed part of argon2's cost (filling the memory) makes the linear prediction low, a round is cheap to try
+    while not log2_cost and rounds < max_rounds:
+        next_ms = time_hash_ms(scheme, rounds + 1, argon2_memory_kib)
+        if next_ms > target_ms:
+            break
+        rounds, elapsed_ms = rounds + 1, next_ms
+    return rounds, elapsed_ms
+
+
+def load_password_hash_policy(scheme: str, rounds: int | None, target_ms: float, rounds_tolerance: int, argon2_memory_kib: int,
+                              rehash_downward: bool = False, calibrate: bool = False) -> PasswordHashPolicy:
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unsupported password hash scheme {scheme}, expected one of {', '.join(SCHEMES)}")
+    if rounds is not None:
+        return PasswordHashPolicy(scheme, rounds, rounds_tolerance=rounds_tolerance, argon2_memory_kib=argon2_memory_kib, rehash_downward=rehash_downward)
+    if not calibrate:
+        raise ValueError("PASSWORD_HASH_ROUNDS has to be pinned outside development, `python -m app.cli calibrate-password-hash` prints the rounds for this host")
+
+    rounds, elapsed_ms = calibrate_rounds(scheme, target_ms, argon2_memory_kib=argon2_memory_kib)
+    print(f"Password hashing calibrated to {scheme} with {rounds} rounds, {elapsed_ms:.0f} ms per hash (target {target_ms:.0f} ms)")
+    return PasswordHashPolicy(scheme, rounds, rounds_tolerance=rounds_tolerance, argon2_memory_kib=argon2_memory_kib, calibrated_ms=elapsed_ms,
+                              rehash_downward=rehash_downward)
@@ -0,0 +1,110 @@
+'''
+Cache in front of the user lookups of the service layer, keyed by user id and by email.
+Lookups go to a per-process LRU first and then to the shared cache backend, invalidations are published
+on the backend so that every worker drops its local copy as well.
+Values are plain dicts, the service functions rebuild the schemas from them.
+Only found users are cached, the writes in the service layer invalidate the affected entries explicitly.
+'''
+
+from .cache import LRUTTLCache
+from .cache_backends import CacheBackend, cache_backend
+from .config import *
+
+INVALIDATION_CHANNEL = "profile-cache:invalidate"
+
+
+class ProfileCache:
+    def __init__(self, backend: CacheBackend, max_entries: int, ttl_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.store = LRUTTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+        self.backend_hits = 0
+        self.backend_misses = 0
+
+    def subscribe(self):
+        # From the app's lifespan, with Redis this connects. Until then only this worker's own invalidations reach its LRU
+        self.backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    def _get(self, key: str):
+        value = self.store.get(key)
+        return value if value is not None else self._get_from_backend(key)
+
+    async def _get_async(self, key: str):
+        # For the event loop, only a miss of the local LRU goes to the backend
+        value = self.store.get(key)
+        return value if value is not None else await self.backend.call(self._get_from_backend, key)
+
+    def _get_from_backend(self, key: str):
+        value = self.backend.get(key)
+        if value is None:
+            self.backend_misses += 1
+            return None
+        self.backend_hits += 1
+        self.store.set(key, value)
+        return value
+
+    # User records (credentials and role), by id and by email
+    def get_user(self, user_id: int) -> dict | None:
+        return self._get(f"user:{user_id}")
+
+    async def get_user_async(self, user_id: int) -> dict | None:
+        return await self._get_async(f"user:{user_id}")
+
+    def get_user_by_email(self, email: str) -> dict | None:
+        user_id = self._get(f"email:{email}")
+        if user_id is None:
+            return None
+        return self.get_user(user_id)
+
+    async def get_user_by_email_async(self, email: str) -> dict | None:
+        user_id = await self._get_async(f"email:{email}")
+        if user_id is None:
+            return None
+        return await self.get_user_async(user_id)
+
+    def set_user(self, user: dict):
+        entries = {f"user:{user['id']}": user, f"email:{user['email']}": user["id"]}
+        for key, value in entries.items():
+            self.store.set(key, value)
+        self.backend.set_many(entries, ttl_seconds=self.ttl_seconds)
+
+    # Detailed user info, as served by /authenticate, /user-info and /users/{user_id}
+    def get_profile(self, user_id: int) -> dict | None:
+        return self._get(f"profile:{user_id}")
+
+    async def get_profile_async(self, user_id: int) -> dict | None:
+        return await self._get_async(f"profile:{user_id}")
+
+    def set_profile(self, user_id: int, profile: dict):
+        self.store.set(f"profile:{user_id}", profile)
+        self.backend.set(f"profile:{user_id}", profile, ttl_seconds=self.ttl_seconds)
+
+    def invalidate_user(self, user_id: int | None = None, email: str | None = None):
+        keys = self._keys(user_id, email)
+        self.store.delete(*keys)
+        self.backend.delete(*keys)
+        self.backend.publish(INVALIDATION_CHANNEL, {"user_id": user_id, "email": email})
+
+    def _on_invalidate(self, message: dict):
+        self.store.delete(*self._keys(message["user_id"], message["email"]))
+
+    @staticmethod
+    def _keys(user_id: int | None, email: str | None) -> list[str]:
+        keys = []
+        if user_id is not None:
+            keys += [f"user:{user_id}", f"profile:{user_id}"]
+        if email is not None:
+            keys.append(f"email:{email}")
+        return keys
+
+    def stats(self) -> dict:
+        return {
+            **self.store.stats(),
+            "backend": self.backend.name,
+            "backend_hits": self.backend_hits,
+            "backend_misses": self.backend_misses,
+        }
+
+
+profile_cache = ProfileCache(backend=cache_backend, max_entries=PROFILE_CACHE_MAX_ENTRIES, ttl_seconds=PROFILE_CACHE_TTL_SECONDS)
@@ -0,0 +1,80 @@
+'''
+Limits on password attempts, so that a client hammering /login or /change-password is turned away before it costs
+a hash. Each limiter is a GCRA (generic cell rate algorithm) on the cache backend: one value per identity, the time
+at which its bucket would be full again, updated atomically by the backend. That makes it a sliding window
+without the per-request entries of a log, and the Redis backend shares it between the workers.
+
+Attempts are charged before the hash, so a burst can't get past the limiter while the first hashes run, and given
+back once the password turns out right: only failures count. The per-email limit is on the email and the client IP
+together, a limit on the email alone would let anyone lock a known user out of /login by failing on purpose. The
+cost is that guesses at one account from many addresses are only limited per address.
+'''
+
+import math
+
+from fastapi import HTTPException, Request
+
+from .cache_backends import CacheBackend, cache_backend
+from .metrics import rate_limit_decisions_total
+from .config import *
+
+
+class RateLimiter:
+    def __init__(self, backend: CacheBackend, scope: str, limit: int, period_seconds: float):
+        # `limit` requests per period, all of which may come at once
+        self.backend = backend
+        self.scope = scope
+        self.enabled = limit > 0
+        self.burst = limit
+        self.interval_seconds = period_seconds / limit if self.enabled else 0
+
+    def _key(self, identity: str) -> str:
+        return f"rate-limit:{self.scope}:{identity}"
+
+    def retry_after(self, identity: str) -> float:
+        if not self.enabled:
+            return 0.0
+        retry_after = self.backend.rate_limit(self._key(identity), self.interval_seconds, self.burst)
+        rate_limit_decisions_total.inc(self.scope, "limited" if retry_after > 0 else "allowed")
+        return retry_after
+
+    def refund(self, identity: str):
+        if self.enabled:
+            self.backend.rate_limit_refund(self._key(identity), self.interval_seconds)
+
+
+# Shared by both endpoints, alternating between them doesn't give more attempts
+password_attempts_per_ip = RateLimiter(cache_backend, "ip", RATE_LIMIT_PER_IP, RATE_LIMIT_PERIOD_SECONDS)
+password_attempts_per_email = RateLimiter(cache_backend, "email", RATE_LIMIT_PER_EMAIL, RATE_LIMIT_PERIOD_SECONDS)
+
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy the peer is the proxy, the client is in the header it sets. Its last address is the one the
+    # proxy saw, any before it came from the client and can be anything
+    if TRUSTED_PROXY_HEADER:
+        forwarded_for = request.headers.get(TRUSTED_PROXY_HEADER, "").split(",")[-1].strip()
+        if forwarded_for:
+            return forwarded_for
+    return request.client.host if request.client else "unknown"
+
+
+def password_attempt_limits(request: Request, email: str) -> tuple[tuple[RateLimiter, str], ...]:
+    ip = client_ip(request)
+    return (password_attempts_per_ip, ip), (password_attempts_per_email, f"{email.lower()}:{ip}")
+
+
+async def limit_password_attempts(request: Request, email: str):
+    '''
+    Charges a password attempt to the client IP and to the email from it, raises 429 with Retry-After when either is
+    over its limit. Called before the user lookup, so unknown emails are limited the same way
+    '''
+    for limiter, identity in password_attempt_limits(request, email):
+        retry_after = await limiter.backend.call(limiter.retry_after, identity)
+        if retry_after > 0:
+            raise HTTPException(status_code=429, detail="Too many attempts, try again later", headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+async def refund_password_attempt(request: Request, email: str):
+    # The password was right, only failed attempts count against the limits
+    for limiter, identity in password_attempt_limits(request, email):
+        await limiter.backend.call(limiter.refund, identity)
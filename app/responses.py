@@ -0,0 +1,40 @@
+'''
+Response helpers. ORJSONResponse is the app's default response class, the helpers here also skip the response_model
+step: constant message bodies are encoded once at import and bodies already in the response model's shape are
+serialized directly.
+
+Returned Response objects are sent as they are, so cookies have to be set on them instead of on an injected
+`response: Response` parameter.
+'''
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+def message_body(message: str) -> bytes:
+    return orjson.dumps({"message": message})
+
+
+USER_REGISTERED = message_body("User registered successfully")
+ADMIN_REGISTERED = message_body("Admin registered successfully")
+LOGGED_IN = message_body("Logged in successfully")
+LOGGED_OUT = message_body("Logged out successfully")
+SESSION_REVOKED = message_body("Session revoked")
+PASSWORD_CHANGED = message_body("Password changed successfully")
+COOKIE_SET = message_body("Cookie has been set")
+NO_COOKIE_FOUND = message_body("No cookie found")
+
+
+def encoded_response(body: bytes, headers: dict | None = None) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def json_response(content, headers: dict | None = None) -> Response:
+    # For bodies already in the response model's shape, skips the response_model validation and serializes with orjson
+    return encoded_response(orjson.dumps(content), headers=headers)
+
+
+def model_response(model: BaseModel, headers: dict | None = None) -> Response:
+    # For an instance of the route's response_model, pydantic's serializer writes the JSON without revalidating it
+    return encoded_response(model.__pydantic_serializer__.to_json(model), headers=headers)
@@ -1,7 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
 from typing import Any, Optional
-from uuid import UUID
 
 '''
 Base classes have the common attributes for both reading and creating
@@ -29,6 +28,10 @@ class UserCredentials(BaseModel):
     password: str
 
 
+class LoginCredentials(UserCredentials):
+    device: Optional[str] = None        # Label of the session, defaults to the User-Agent
+
+
 class UserPasswordChangeSchema(UserCredentials):
     new_password: str
 
@@ -45,6 +48,17 @@ class User(BaseModel):
         orm_mode = True
 
 
+class UserRecord(BaseModel):
+    id: int
+    email: EmailStr
+    hashed_password: str
+    is_active: Optional[bool] = None
+    role: str
+
+    class Config:
+        orm_mode = True
+
+
 class UserInfo(User):
     fullname: Optional[str] = None
     designation: Optional[str] = None
@@ -71,20 +85,37 @@ class RegistrationWithInfoSchema(BaseModel):
     staff_id: int
 
 
+class SessionInfo(BaseModel):
+    id: int
+    device: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None      # Last login or refresh
+    current: bool
+
+
 # ===============Token Schemas================
 class AccessToken(BaseModel):
     access_token: str
 
 
 # ==============JWT Payload Schemas==========
+class AccessTokenProfileClaims(BaseModel):
+    email: EmailStr
+    fullname: Optional[str] = None
+    designation: Optional[str] = None
+    staff_id: Optional[int] = None
+
+
 class AccessTokenPayloadBase(BaseModel):
     sub: int
     role: str
     session_id: str
     token_type: str = 'access'
+    profile: Optional[AccessTokenProfileClaims] = None      # Only issued when AUTH_PROFILE_CLAIMS is on
 
 class AccessTokenInputData(AccessTokenPayloadBase):
     pass
 
 class AccessTokenPayload(AccessTokenPayloadBase):
-    exp: datetime | Any
\ No newline at end of file
+    exp: datetime | Any
+    jti: Optional[str] = None      # Unique id of the token, for the revocation denylist
\ No newline at end of file
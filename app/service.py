@@ -2,38 +2,118 @@
 Contains the functionalities of the API routes
 '''
 
-from uuid import uuid4
-from sqlalchemy.orm import Session, joinedload
+import base64
+from datetime import datetime, timedelta
+from typing import Iterator
+from uuid import UUID, uuid4
+
+import orjson
+from sqlalchemy import String, cast, delete, insert, literal, select, update
+from sqlalchemy.orm import Session
 
 from . import models, schemas
+from .database import SessionLocal, replica_set
+from .db_replicas import replica_read, replica_reads, served_by_replica
 
 from .utils import Utility
+from .profile_cache import profile_cache
+from .session_cache import session_cache
+from .token_denylist import token_denylist
+from .config import *
+
+
+def user_record(user: models.User) -> dict:
+    return {"id": user.id, "email": user.email, "hashed_password": user.hashed_password, "is_active": user.is_active, "role": user.role}
 
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+def cached_detailed_user_info(profile: dict) -> schemas.UserInfo | schemas.User:
+    # Profiles come straight from typed DB columns or the cache, so they are not validated again
+    if "staff_id" in profile:
+        return schemas.UserInfo.model_construct(**profile)
+    return schemas.User.model_construct(**profile)
 
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+@replica_read
+def get_user(db: Session, user_id: int) -> schemas.UserRecord | None:
+    cached_user = profile_cache.get_user(user_id)
+    if cached_user is None:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
+        if user is None:
+            return None
+        cached_user = user_record(user)
+        if not served_by_replica(db):
+            profile_cache.set_user(cached_user)
+    return schemas.UserRecord.model_construct(**cached_user)
+
+
+def get_user_by_email(db: Session, email: str) -> schemas.UserRecord | None:
+    cached_user = profile_cache.get_user_by_email(email)
+    if cached_user is None:
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user is None:
+            return None
+        cached_user = user_record(user)
+        profile_cache.set_user(cached_user)
+    return schemas.UserRecord.model_construct(**cached_user)
 
 
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
 
-def create_user(db: Session, register_info: schemas.UserCredentials, role: str = 'user'):
-    hashed_password = Utility.get_hashed_password(register_info.password)
+def create_user(db: Session, register_info: schemas.UserCredentials, role: str = 'user', hashed_password: str = None):
+    if hashed_password is None:
+        hashed_password = Utility.get_hashed_password(register_info.password)
     db_user = models.User(email=register_info.email, hashed_password=hashed_password, role=role)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    profile_cache.invalidate_user(user_id=db_user.id, email=db_user.email)
+    replica_set.stick_to_primary(db_user.id)
     return db_user
 
 
-def create_user_with_info(db: Session, register_info: schemas.RegistrationWithInfoSchema, role: str = 'user') -> bool:
+def update_user_password(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update({models.User.hashed_password: hashed_password})
+    db.commit()
+    profile_cache.invalidate_user(user_id=user_id)
+    replica_set.stick_to_primary(user_id)
+
+
+def password_rehash_statement(user_id: int, hashed_password: str, new_hashed_password: str):
+    # Only replaces the hash that was verified, a password changed in the meantime is kept
+    return update(models.User).where(models.User.id == user_id, models.User.hashed_password == hashed_password).values(hashed_password=new_hashed_password)
+
+
+def rehash_user_password(user_id: int, email: str, hashed_password: str, new_hashed_password: str) -> bool:
+    '''
+    Stores the rehash of a password hashed under an older policy. Uses its own session since it runs after the login
+    response, when the request's session is closed
+    '''
+    db = SessionLocal()
     try:
-        hashed_password = Utility.get_hashed_password(register_info.password)
+        updated = db.execute(password_rehash_statement(user_id, hashed_password, new_hashed_password)).rowcount == 1
+        db.commit()
+    finally:
+        db.close()
+
+    if updated:
+        profile_cache.invalidate_user(user_id=user_id, email=email)
+    return updated
+
+
+def delete_user(db: Session, user_id: int):
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user:
+        db.delete(user)
+        db.commit()
+        profile_cache.invalidate_user(user_id=user.id, email=user.email)
+
+
+def create_user_with_info(db: Session, register_info: schemas.RegistrationWithInfoSchema, role: str = 'user', hashed_password: str = None) -> bool:
+    try:
+        if hashed_password is None:
+            hashed_password = Utility.get_hashed_password(register_info.password)
         db_user = models.User(email=register_info.email, hashed_password=hashed_password, role=role)
         db.add(db_user)
         db.commit()
@@ -43,25 +123,76 @@ def create_user_with_info(db: Session, register_info: schemas.RegistrationWithIn
         db.add(user_info)
         db.commit()
         db.refresh(user_info)
+        profile_cache.invalidate_user(user_id=db_user.id, email=db_user.email)
+        replica_set.stick_to_primary(db_user.id)
         
         return True
     except Exception as e:
         print(e)
         db.rollback()
 
-        user = get_user_by_email(db, register_info.email)
+        user = db.query(models.User).filter(models.User.email == register_info.email).first()
         if user:
-            db.delete(user)
-            db.commit()
+            delete_user(db, user_id=user.id)
             
         return False
 
 
+def registration_conflicts_statement(emails: list[str], staff_ids: list[int]):
+    # Both checks in one round trip, staff ids are cast so the two sides of the union have the same type
+    return select(literal("email").label("field"), models.User.email.label("value")).where(models.User.email.in_(emails)).union_all(
+        select(literal("staff_id").label("field"), cast(models.UserInfo.staff_id, String).label("value")).where(models.UserInfo.staff_id.in_(staff_ids))
+    )
+
+
+def registration_conflicts(rows) -> tuple[set[str], set[int]]:
+    taken_emails, taken_staff_ids = set(), set()
+    for field, value in rows:
+        if field == "email":
+            taken_emails.add(value)
+        else:
+            taken_staff_ids.add(int(value))
+    return taken_emails, taken_staff_ids
+
+
+def find_registration_conflicts(db: Session, emails: list[str], staff_ids: list[int]) -> tuple[set[str], set[int]]:
+    '''
+    Returns the emails and staff ids of the given ones that are already registered
+    '''
+    return registration_conflicts(db.execute(registration_conflicts_statement(emails, staff_ids)))
+
+
+def bulk_create_users_with_info(db: Session, registrations: list[dict]) -> list[int] | None:
+    '''
+    Inserts the users and their user_infos with one multi row INSERT ... RETURNING each and a single commit.
+    The registrations hold email, hashed_password, role, fullname, designation and staff_id.
+    Returns the new user ids in the order of the registrations, or None if nothing was inserted
+    '''
+    try:
+        user_ids = db.scalars(
+            insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+            [{"email": registration["email"], "hashed_password": registration["hashed_password"], "role": registration["role"]} for registration in registrations]
+        ).all()
+        db.execute(
+            insert(models.UserInfo),
+            [{"fullname": registration["fullname"], "designation": registration["designation"], "staff_id": registration["staff_id"], "user_id": user_id} for registration, user_id in zip(registrations, user_ids)]
+        )
+        db.commit()
+        # Nothing to invalidate, only found users are cached
+        return list(user_ids)
+    except Exception as e:
+        print(e)
+        db.rollback()
+        return None
+
+
 def create_user_info(db: Session, user_info_create: schemas.UserInfoCreate, user_id: int):
     user_info = models.UserInfo(**user_info_create.model_dump(), user_id=user_id)
     db.add(user_info)
     db.commit()
     db.refresh(user_info)
+    profile_cache.invalidate_user(user_id=user_id)
+    replica_set.stick_to_primary(user_id)
     return user_info
 
 
@@ -74,6 +205,8 @@ def edit_user_info(db: Session, user_info_create: schemas.UserInfoCreate, user_i
 
     db.commit()
     db.refresh(user_info)
+    profile_cache.invalidate_user(user_id=user_id)
+    replica_set.stick_to_primary(user_id)
     return user_info
 
 
@@ -89,48 +222,229 @@ def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
     return db_item
 
 
-def delete_user_session(db: Session, user_id: int):
-    db.query(models.UserSession).filter(models.UserSession.user_id == user_id).delete()
+def delete_user_sessions_statement(user_id: int, *criteria):
+    return delete(models.UserSession).where(models.UserSession.user_id == user_id, *criteria).returning(models.UserSession.session_id)
+
+
+def end_user_sessions(session_ids: list[UUID]):
+    # A refresh fails once the session is gone, its access tokens are denylisted so they stop working right away too
+    session_cache.revoke(*[str(session_id) for session_id in session_ids])
+    token_denylist.revoke_sessions(*[str(session_id) for session_id in session_ids])
+
+
+def delete_user_sessions(db: Session, user_id: int, *criteria) -> list[UUID]:
+    # All the sessions of the user without criteria, returns the session ids that were deleted
+    deleted_session_ids = db.execute(delete_user_sessions_statement(user_id, *criteria)).scalars().all()
     db.commit()
+    if deleted_session_ids:
+        end_user_sessions(deleted_session_ids)
+    return deleted_session_ids
+
+
+def delete_user_session(db: Session, user_id: int, session_id: UUID) -> bool:
+    # Logout, the other sessions of the user stay signed in
+    return bool(delete_user_sessions(db, user_id, models.UserSession.session_id == session_id))
+
+
+def revoke_user_session(db: Session, user_id: int, id: int) -> UUID | None:
+    deleted_session_ids = delete_user_sessions(db, user_id, models.UserSession.id == id)
+    return deleted_session_ids[0] if deleted_session_ids else None
+
+
+def revoke_other_user_sessions(db: Session, user_id: int, session_id: UUID) -> int:
+    return len(delete_user_sessions(db, user_id, models.UserSession.session_id != session_id))
+
+
+def user_sessions_statement(user_id: int):
+    # Live sessions only, newest first along the (user_id, created_at) index
+    return (
+        select(models.UserSession.id, models.UserSession.session_id, models.UserSession.device, models.UserSession.created_at, models.UserSession.updated_at)
+        .where(models.UserSession.user_id == user_id, models.UserSession.created_at >= datetime.now() - timedelta(minutes=SESSION_EXPIRE_MINUTES))
+        .order_by(models.UserSession.created_at.desc())
+    )
+
 
+def user_session_info(row, current_session_id: str) -> dict:
+    return {"id": row.id, "device": row.device, "created_at": row.created_at, "updated_at": row.updated_at, "current": str(row.session_id) == current_session_id}
 
-def create_user_session(db: Session, user_id: int) -> models.UserSession:
-    user_session = models.UserSession(session_id = uuid4(), user_id = user_id)
+
+def get_user_sessions(db: Session, user_id: int, current_session_id: str) -> list[dict]:
+    return [user_session_info(row, current_session_id) for row in db.execute(user_sessions_statement(user_id))]
+
+
+def create_user_session(db: Session, user_id: int, device: str = "unknown") -> models.UserSession:
+    user_session = models.UserSession(session_id = uuid4(), user_id = user_id, device = device)
     db.add(user_session)
     db.commit()
     db.refresh(user_session)
+    session_cache.set(str(user_session.session_id), user_id=user_id, created_at=user_session.created_at)
     return user_session
 
 
-def get_detailed_user_info(db: Session, user_id: int) -> schemas.UserInfo | None:
-    user = get_user(db, user_id)
-    if user:
-        user_info: models.UserInfo = user.user_info
-        if user_info:
-            return schemas.UserInfo(user_id=user_id, email=user.email, fullname=user_info.fullname, designation=user_info.designation, staff_id=user_info.staff_id)
-        else:
-            return schemas.User(user_id=user_id, email=user.email)
-    return None
+def insert_user_session_statement(user_id: int, device: str):
+    # A new session per login, two clients with the same device label don't sign each other out
+    now = datetime.now()
+    return (
+        insert(models.UserSession)
+        .values(session_id=uuid4(), user_id=user_id, device=device, created_at=now, updated_at=now)
+        .returning(models.UserSession.session_id, models.UserSession.created_at)
+    )
 
 
-def get_detailed_users(db: Session, skip: int = 0, limit: int = 100) -> list[schemas.UserInfo] | list:
-    all_users_hybrid_detailed_info = db.query(models.User).options(joinedload(models.User.user_info)).all()     # Fetch all users with their respective user_info avoiding N + 1 queries
-    all_users_detailed_info: list[schemas.UserInfo] = []
-    for hybrid_user_info in all_users_hybrid_detailed_info:
-        if hybrid_user_info.user_info:
-            all_users_detailed_info.append(schemas.UserInfo(
-                user_id=hybrid_user_info.id, 
-                email=hybrid_user_info.email, 
-                fullname=hybrid_user_info.user_info.fullname,
-                designation=hybrid_user_info.user_info.designation,
-                staff_id=hybrid_user_info.user_info.staff_id
-                ))
-        else:
-            all_users_detailed_info.append(schemas.User(user_id=hybrid_user_info.id, email=hybrid_user_info.email))
-    return all_users_detailed_info
+def excess_user_sessions_statement(user_id: int):
+    # Everything but the newest MAX_SESSIONS_PER_USER sessions of the user
+    newest_session_ids = (
+        select(models.UserSession.id)
+        .where(models.UserSession.user_id == user_id)
+        .order_by(models.UserSession.created_at.desc(), models.UserSession.id.desc())
+        .limit(MAX_SESSIONS_PER_USER)
+    )
+    return delete_user_sessions_statement(user_id, models.UserSession.id.not_in(newest_session_ids))
+
+
+def open_user_session(db: Session, user_id: int, device: str = "unknown"):
+    user_session = db.execute(insert_user_session_statement(user_id, device)).first()
+    excess_session_ids = db.execute(excess_user_sessions_statement(user_id)).scalars().all()
+    db.commit()
+    session_cache.set(str(user_session.session_id), user_id=user_id, created_at=user_session.created_at)
+    if excess_session_ids:
+        end_user_sessions(excess_session_ids)
+    return user_session
+
+
+def expired_sessions_batch_statement(expired_before: datetime, batch_size: int):
+    # DELETE ... WHERE id IN (SELECT ... LIMIT n), a range scan of ix_sessions_created_at that keeps every
+    # transaction and its locks small however many sessions have piled up
+    batch = select(models.UserSession.id).where(models.UserSession.created_at < expired_before).limit(batch_size)
+    return delete(models.UserSession).where(models.UserSession.id.in_(batch.scalar_subquery())).execution_options(synchronize_session=False)
+
+
+def delete_expired_sessions_batch(expired_before: datetime, batch_size: int) -> int:
+    # Its own session, it's run by the session reaper outside of any request
+    db = SessionLocal()
+    try:
+        deleted = db.execute(expired_sessions_batch_statement(expired_before, batch_size)).rowcount
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def rotate_user_session_statement(session_id: UUID, user_id: int, created_after: datetime):
+    # Validates and rotates in one UPDATE ... RETURNING, no row comes back for an unknown, foreign or expired session
+    return (
+        update(models.UserSession)
+        .where(models.UserSession.session_id == session_id, models.UserSession.user_id == user_id, models.UserSession.created_at >= created_after)
+        .values(session_id=uuid4())
+        .returning(models.UserSession.session_id, models.UserSession.created_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rotate_user_session(db: Session, session_id: UUID, user_id: int, created_after: datetime):
+    rotated_session = db.execute(rotate_user_session_statement(session_id, user_id, created_after)).first()
+    db.commit()
+
+    if rotated_session is None:
+        session_cache.revoke(str(session_id))
+        return None
+
+    session_cache.rotate(str(session_id), str(rotated_session.session_id), user_id=user_id, created_at=rotated_session.created_at)
+    return rotated_session
+
+
+def detailed_users_statement():
+    # Only the profile columns in one joined query, rows are plain tuples so no ORM objects or identity map are involved
+    return (
+        select(models.User.id, models.User.email, models.UserInfo.id.label("user_info_id"), models.UserInfo.fullname, models.UserInfo.designation, models.UserInfo.staff_id)
+        .outerjoin(models.UserInfo, models.UserInfo.user_id == models.User.id)
+        .order_by(models.User.id)
+    )
+
+
+def detailed_user_profile(row) -> dict:
+    # Same shape as the cached profiles, the user_info fields are left out when there's no user_info
+    profile = {"user_id": row.id, "email": row.email}
+    if row.user_info_id is not None:
+        profile.update(fullname=row.fullname, designation=row.designation, staff_id=row.staff_id)
+    return profile
+
+
+def user_info_response_body(profile: dict) -> dict:
+    # Serialized as schemas.UserInfo, the user_info fields are null when there's no user_info
+    return {"user_id": profile["user_id"], "email": profile["email"], "fullname": profile.get("fullname"), "designation": profile.get("designation"), "staff_id": profile.get("staff_id")}
+
+
+@replica_read
+def get_detailed_user_profile(db: Session, user_id: int) -> dict | None:
+    cached_profile = profile_cache.get_profile(user_id)
+    if cached_profile is not None:
+        return cached_profile
+
+    row = db.execute(detailed_users_statement().filter(models.User.id == user_id)).first()
+    if row is None:
+        return None
+    profile = detailed_user_profile(row)
+    if not served_by_replica(db):
+        profile_cache.set_profile(user_id, profile)
+    return profile
+
+
+def get_detailed_user_info(db: Session, user_id: int) -> schemas.UserInfo | schemas.User | None:
+    profile = get_detailed_user_profile(db, user_id=user_id)
+    if profile is None:
+        return None
+    return cached_detailed_user_info(profile)
+
+
+def encode_users_cursor(last_user_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_user_id).encode()).decode().rstrip("=")
+
+
+def decode_users_cursor(cursor: str) -> int:
+    # Raises ValueError for anything that wasn't produced by encode_users_cursor
+    return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+
+
+def detailed_user_export_line(row) -> bytes:
+    return orjson.dumps(detailed_user_profile(row)) + b"\n"
+
+
+def detailed_users_page_statement(skip: int, limit: int, after_id: int | None):
+    statement = detailed_users_statement()
+    if after_id is not None:
+        statement = statement.filter(models.User.id > after_id)     # Keyset pagination, the primary key index seeks straight to the page
+    else:
+        statement = statement.offset(skip)
+    return statement.limit(limit)
+
+
+@replica_read
+def get_detailed_users(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None) -> list[dict]:
+    '''
+    Returns the page as response ready dicts in the schemas.UserInfo shape
+    '''
+    rows = db.execute(detailed_users_page_statement(skip, limit, after_id))
+    return [user_info_response_body(detailed_user_profile(row)) for row in rows]
+
+
+def export_detailed_users(batch_size: int = 1000) -> Iterator[bytes]:
+    '''
+    Yields every user as an NDJSON line. Uses its own session since the response is streamed after the request's
+    dependencies are closed, and yield_per fetches from a server side cursor so memory stays at one batch
+    '''
+    db = SessionLocal()
+    try:
+        with replica_reads(db):
+            rows = db.execute(detailed_users_statement().execution_options(yield_per=batch_size))
+            for row in rows:
+                yield detailed_user_export_line(row)
+    finally:
+        db.close()
 
 
 def get_user_by_staff_id(db: Session, staff_id: int):
+    # On the primary, it's the uniqueness check before a write and a lagging replica would miss a staff_id just taken
     user_info = db.query(models.UserInfo).filter(models.UserInfo.staff_id == staff_id).first()
     if user_info:
         return user_info.user
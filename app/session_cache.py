@@ -0,0 +1,72 @@
+'''
+Cache of the session state (owner and creation time) used on the token refresh path, on the shared cache backend.
+It's only trusted to reject a refresh early, a session that looks valid here is still checked by the rotation UPDATE,
+so a stale entry can never keep a deleted session alive.
+'''
+
+from datetime import datetime, timedelta
+
+from .cache_backends import CacheBackend, cache_backend
+from .config import *
+
+
+class SessionStateCache:
+    def __init__(self, backend: CacheBackend, tombstone_seconds: float, refresh_lock_seconds: float, refresh_grace_seconds: float):
+        self.backend = backend
+        self.tombstone_seconds = tombstone_seconds
+        self.refresh_lock_seconds = refresh_lock_seconds
+        self.refresh_grace_seconds = refresh_grace_seconds
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def get(self, session_id: str) -> dict | None:
+        return self.backend.get(self._key(session_id))
+
+    def set(self, session_id: str, user_id: int, created_at: datetime):
+        remaining = (created_at + timedelta(minutes=SESSION_EXPIRE_MINUTES) - datetime.now()).total_seconds()
+        if remaining > 0:
+            self.backend.set(self._key(session_id), {"user_id": user_id, "created_at": created_at.isoformat()}, ttl_seconds=remaining)
+
+    def revoke(self, *session_ids: str):
+        # Rotated and deleted session ids are remembered for a while so replays are rejected without the DB
+        self.backend.set_many({self._key(session_id): {"revoked": True} for session_id in session_ids}, ttl_seconds=self.tombstone_seconds)
+
+    def rotate(self, old_session_id: str, new_session_id: str, user_id: int, created_at: datetime):
+        self.revoke(old_session_id)
+        self.set(new_session_id, user_id=user_id, created_at=created_at)
+
+    # ============== Refresh coalescing ==============
+    def acquire_refresh_lock(self, session_id: str) -> bool:
+        # Expires by itself in case the worker holding it dies before releasing it
+        return self.backend.add(f"refresh-lock:{session_id}", True, ttl_seconds=self.refresh_lock_seconds)
+
+    def release_refresh_lock(self, session_id: str):
+        self.backend.delete(f"refresh-lock:{session_id}")
+
+    def remember_rotation(self, old_session_id: str, user_id: int, access_token: str):
+        # Requests still presenting the old session's token during the grace window get the same new token
+        self.backend.set(f"session-rotation:{old_session_id}", {"user_id": user_id, "access_token": access_token}, ttl_seconds=self.refresh_grace_seconds)
+
+    def get_rotation(self, old_session_id: str, user_id: int) -> str | None:
+        rotation = self.backend.get(f"session-rotation:{old_session_id}")
+        if rotation is None or rotation["user_id"] != user_id:
+            return None
+        return rotation["access_token"]
+
+    def is_known_invalid(self, session_id: str, user_id: int, created_after: datetime) -> bool:
+        state = self.get(session_id)
+        if state is None:
+            return False
+        if state.get("revoked"):
+            return True
+        return state["user_id"] != user_id or datetime.fromisoformat(state["created_at"]) < created_after
+
+
+session_cache = SessionStateCache(
+    backend=cache_backend,
+    tombstone_seconds=SESSION_CACHE_TOMBSTONE_SECONDS,
+    refresh_lock_seconds=REFRESH_LOCK_SECONDS,
+    refresh_grace_seconds=REFRESH_GRACE_SECONDS
+)
@@ -0,0 +1,54 @@
+'''
+Deletes the sessions past SESSION_EXPIRE_MINUTES, which are otherwise only rejected when they are refreshed and
+would stay in the sessions table and its indexes forever. Runs as a background task of the app every
+SESSION_REAPER_INTERVAL_SECONDS, or once with `python -m app.cli reap-sessions`.
+'''
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from .cache_backends import cache_backend
+from .db_service import db_service
+from .metrics import sessions_reaped_total
+from .config import *
+
+
+async def reap_expired_sessions(batch_size: int = SESSION_REAPER_BATCH_SIZE, pause_ms: float = SESSION_REAPER_PAUSE_MS) -> dict:
+    '''
+    Deletes the expired sessions `batch_size` rows per transaction, sleeping `pause_ms` between the batches, until
+    a batch comes back short. Returns the rows reclaimed, the batches and the time it took
+    '''
+    expired_before = datetime.now() - timedelta(minutes=SESSION_EXPIRE_MINUTES)
+    started_at = time.perf_counter()
+    reclaimed = batches = 0
+
+    while True:
+        deleted = await db_service.delete_expired_sessions_batch(expired_before=expired_before, batch_size=batch_size)
+        reclaimed += deleted
+        batches += 1
+        sessions_reaped_total.inc(amount=deleted)
+        if deleted < batch_size:
+            break
+        await asyncio.sleep(pause_ms / 1000)
+
+    return {"reclaimed": reclaimed, "batches": batches, "seconds": time.perf_counter() - started_at}
+
+
+async def run_session_reaper(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        # One worker per interval does the run, with a shared cache backend
+        if not await cache_backend.call(cache_backend.add, "session-reaper", True, ttl_seconds=interval_seconds):
+            continue
+        try:
+            result = await reap_expired_sessions()
+            print(f"Session reaper | Reclaimed {result['reclaimed']} expired sessions in {result['batches']} batches, {result['seconds']:.2f} s")
+        except Exception as e:      # Keep the task alive, the next interval tries again
+            print(f"Session reaper | Error: {e}")
+
+
+def start_session_reaper() -> asyncio.Task | None:
+    if SESSION_REAPER_INTERVAL_SECONDS <= 0:
+        return None
+    return asyncio.create_task(run_session_reaper(SESSION_REAPER_INTERVAL_SECONDS), name="session-reaper")
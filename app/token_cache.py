@@ -0,0 +1,43 @@
+'''
+Per worker cache of verified access tokens, so a cookie that keeps coming back is decoded and validated once.
+Keyed by the SHA-256 digest of the token (the raw tokens aren't kept) and expiring at the token's exp, which is
+also when its session can be rotated. Revocation is still checked on every hit through the token denylist, whose
+filter answers without I/O, so a token logged out on another worker isn't served from here either.
+'''
+
+import hashlib
+import time
+
+import app.schemas as schemas
+from .cache import LRUTTLCache
+from .config import *
+
+
+class VerifiedTokenCache:
+    def __init__(self, max_entries: int):
+        self.enabled = max_entries > 0
+        self.store = LRUTTLCache(max_entries=max_entries, ttl_seconds=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> schemas.AccessTokenPayload | None:
+        # The payload is shared by the requests presenting the token, it must not be modified
+        if not self.enabled:
+            return None
+        return self.store.get(self._key(token))
+
+    def set(self, token: str, payload: schemas.AccessTokenPayload, exp: float):
+        remaining = exp - time.time()
+        if self.enabled and remaining > 0:
+            self.store.set(self._key(token), payload, ttl_seconds=remaining)
+
+    def evict(self, *tokens: str):
+        self.store.delete(*(self._key(token) for token in tokens))
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+verified_token_cache = VerifiedTokenCache(max_entries=VERIFIED_TOKEN_CACHE_MAX_ENTRIES)
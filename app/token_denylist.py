@@ -0,0 +1,170 @@
+'''
+Denylist of revoked access tokens, by their jti or by the id of their session, so a token stops working at logout
+or when its session is signed out from another device instead of at its exp.
+
+Revoked jtis are stored on the shared cache backend until the token expires, grouped in time buckets by exp.
+Every worker keeps a Bloom filter per bucket of the jtis revoked since it started (revocations are published on
+the backend), which answers "not revoked" for almost every request without any I/O. Only jtis the filter
+may contain are confirmed on the backend, and buckets are dropped as a whole once all their tokens are expired.
+
+The worker subscribes from the app's lifespan, not at import. Until then every token is checked on the backend, and
+tokens issued before it subscribed may have been revoked before, those are checked on the backend until they have
+expired, i.e. for ACCESS_TOKEN_EXPIRE_MINUTES after startup.
+'''
+
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+
+from .cache_backends import CacheBackend, cache_backend
+from .metrics import token_denylist_lookups_total, token_revocations_total
+from .config import *
+
+REVOCATION_CHANNEL = "token-denylist:revoke"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing, the k positions are derived from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenDenylist:
+    def __init__(self, backend: CacheBackend, bucket_seconds: int, bucket_capacity: int, error_rate: float):
+        self.backend = backend
+        self.bucket_seconds = bucket_seconds
+        self.bucket_capacity = bucket_capacity
+        self.error_rate = error_rate
+        self.started_at = math.inf      # When it subscribed to the revocations
+
+        self.filters: dict[int, BloomFilter] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        # From the app's lifespan, with Redis this connects
+        self.backend.subscribe(REVOCATION_CHANNEL, self._on_revoke)
+        self.started_at = min(self.started_at, time.time())
+
+    @staticmethod
+    def _timestamp(exp: int | float | datetime) -> float:
+        return exp.timestamp() if isinstance(exp, datetime) else float(exp)
+
+    def _bucket(self, exp: float) -> int:
+        return int(exp // self.bucket_seconds)
+
+    def _key(self, bucket: int, revoked_id: str) -> str:
+        return f"revoked:{bucket}:{revoked_id}"
+
+    def _add_to_filter(self, revoked_id: str, bucket: int):
+        with self._lock:
+            bloom_filter = self.filters.get(bucket)
+            if bloom_filter is None:
+                bloom_filter = self.filters[bucket] = BloomFilter(self.bucket_capacity, self.error_rate)
+                # Buckets whose tokens have all expired can't match anything anymore
+                current_bucket = self._bucket(time.time())
+                for expired_bucket in [expired for expired in self.filters if expired < current_bucket]:
+                    del self.filters[expired_bucket]
+            bloom_filter.add(revoked_id)
+
+    def _revoke(self, revoked_ids: list[str], buckets: list[int], ttl_seconds: float):
+        # Every id in every bucket
+        self.backend.set_many({self._key(bucket, revoked_id): True for bucket in buckets for revoked_id in revoked_ids}, ttl_seconds=ttl_seconds)
+        message = {"ids": revoked_ids, "buckets": buckets}
+        self._on_revoke(message)
+        self.backend.publish(REVOCATION_CHANNEL, message)
+
+    def revoke(self, jti: str, exp: int | float | datetime):
+        exp = self._timestamp(exp)
+        remaining = exp - time.time()
+        if remaining <= 0:      # Already rejected by its exp
+            return
+
+        self._revoke([jti], [self._bucket(exp)], ttl_seconds=remaining)
+        token_revocations_total.inc()
+
+    def revoke_sessions(self, *session_ids: str):
+        '''
+        Denies every access token of the sessions, e.g. when they are signed out from another device. Their tokens
+        expire within ACCESS_TOKEN_EXPIRE_MINUTES, so the session ids go into each bucket until then
+        '''
+        if not session_ids:
+            return
+        now = time.time()
+        ttl_seconds = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        self._revoke(list(session_ids), list(range(self._bucket(now), self._bucket(now + ttl_seconds) + 1)), ttl_seconds=ttl_seconds)
+        token_revocations_total.inc(amount=len(session_ids))
+
+    def _on_revoke(self, message: dict):
+        for bucket in message["buckets"]:
+            for revoked_id in message["ids"]:
+                self._add_to_filter(revoked_id, bucket)
+
+    def _warming_up(self, exp: float) -> bool:
+        # Issued before this worker listened for revocations
+        return exp <= self.started_at + ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+    def _filtered(self, revoked_ids: list[str], exp: float) -> bool:
+        # Whether the filter answers "not revoked" without I/O
+        if self._warming_up(exp):
+            return False
+        bloom_filter = self.filters.get(self._bucket(exp))
+        if bloom_filter is None or not any(revoked_id in bloom_filter for revoked_id in revoked_ids):
+            token_denylist_lookups_total.inc("filtered")
+            return True
+        return False
+
+    def _lookup(self, revoked_ids: list[str], exp: float) -> bool:
+        bucket = self._bucket(exp)
+        revoked = bool(self.backend.get_many([self._key(bucket, revoked_id) for revoked_id in revoked_ids]))
+        if revoked:
+            token_denylist_lookups_total.inc("revoked")
+        else:
+            token_denylist_lookups_total.inc("warmup" if self._warming_up(exp) else "false_positive")
+        return revoked
+
+    @staticmethod
+    def _token_ids(jti: str | None, session_id: str | None) -> list[str]:
+        # A token is denied by its own jti or by its session's id
+        return [token_id for token_id in (jti, session_id) if token_id is not None]
+
+    def is_revoked(self, jti: str | None, exp: int | float | datetime, session_id: str | None = None) -> bool:
+        exp = self._timestamp(exp)
+        token_ids = self._token_ids(jti, session_id)
+        return bool(token_ids) and not self._filtered(token_ids, exp) and self._lookup(token_ids, exp)
+
+    async def is_revoked_async(self, jti: str | None, exp: int | float | datetime, session_id: str | None = None) -> bool:
+        # For the event loop, only a lookup on the backend leaves it
+        exp = self._timestamp(exp)
+        token_ids = self._token_ids(jti, session_id)
+        return bool(token_ids) and not self._filtered(token_ids, exp) and await self.backend.call(self._lookup, token_ids, exp)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": len(self.filters),
+                "filter_bytes": sum(len(bloom_filter.bits) for bloom_filter in self.filters.values()),
+            }
+
+
+token_denylist = TokenDenylist(
+    backend=cache_backend,
+    bucket_seconds=TOKEN_DENYLIST_BUCKET_SECONDS,
+    bucket_capacity=TOKEN_DENYLIST_BUCKET_CAPACITY,
+    error_rate=TOKEN_DENYLIST_ERROR_RATE
+)
@@ -1,39 +1,65 @@
 import os
+import threading
 from datetime import datetime, timedelta, timezone
 from typing import Any
-from fastapi import Response
-from passlib.context import CryptContext
-from dotenv import load_dotenv
+from uuid import uuid4
+from fastapi import HTTPException, Response
 import jwt
 import app.schemas as schemas
+from .password_hasher import PasswordHasher, PasswordHasherBusy
+from .password_policy import PasswordHashPolicy, load_password_hash_policy
+from .jwt_keys import KeyRing
 from .config import *
 
 def ensure_initialized(method):
+    # Initializes on first use when the app's lifespan hasn't done it yet, e.g. in scripts and benchmarks
     def wrapper(cls, *args, **kwargs):
         if not cls.initialized:
-            raise Exception("Utils not initialized")
+            cls.lazy_initialize()
         return method(cls, *args, **kwargs)
     return wrapper
 
 class Utility:
     ALGORITHM = "HS256"
     JWT_SECRET_KEY = None
+    key_ring: KeyRing = None        # Asymmetric signing and verification keys, when ALGORITHM isn't HS256
+    password_policy: PasswordHashPolicy = None
     password_context = None
+    password_hasher: PasswordHasher = None
 
     SUPERUSER_PASSWORD = None
 
     initialized = False
+    _initialize_lock = threading.Lock()
 
     @classmethod
     def initialize(cls):
         try:
-            load_dotenv()
-            cls.JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-
-            if cls.JWT_SECRET_KEY is None:
-                raise Exception("JWT signing Keys not set")
-
-            cls.password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+            cls.ALGORITHM = JWT_ALGORITHM
+            if cls.ALGORITHM == "HS256":
+                cls.JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+
+                if cls.JWT_SECRET_KEY is None:
+                    raise Exception("JWT signing Keys not set")
+            else:
+                cls.key_ring = KeyRing(cls.ALGORITHM, private_key_files=JWT_PRIVATE_KEY_FILES, public_key_files=JWT_PUBLIC_KEY_FILES)
+
+            cls.password_policy = load_password_hash_policy(
+                scheme=PASSWORD_HASH_SCHEME,
+                rounds=PASSWORD_HASH_ROUNDS,
+                target_ms=PASSWORD_HASH_TARGET_MS,
+                rounds_tolerance=PASSWORD_HASH_ROUNDS_TOLERANCE,
+                argon2_memory_kib=PASSWORD_HASH_ARGON2_MEMORY_KIB,
+                rehash_downward=PASSWORD_HASH_REHASH_DOWNWARD,
+                calibrate=ENVIRONMENT == "development"
+            )
+            cls.password_context = cls.password_policy.context()
+            cls.password_hasher = PasswordHasher(
+                hash_func=cls.password_context.hash,
+                verify_func=cls.password_context.verify,
+                max_workers=PASSWORD_HASH_WORKERS,
+                max_queue_depth=PASSWORD_HASH_QUEUE_DEPTH
+            )
 
             cls.SUPERUSER_PASSWORD = os.getenv('SUPERUSER_PASSWORD')
 
@@ -41,8 +67,21 @@ class Utility:
             
             print("***** APP INITIALIZED *****")
         except Exception as e:
-            raise Exception("Failed to initialize utils")
-        
+            raise Exception("Failed to initialize utils") from e
+
+    @classmethod
+    def lazy_initialize(cls):
+        with cls._initialize_lock:
+            if not cls.initialized:
+                cls.initialize()
+
+    @classmethod
+    @ensure_initialized
+    def warm_up(cls):
+        # The calibration has already hashed, else one verify loads the hash backend before the first login has to
+        if cls.password_policy.calibrated_ms is None:
+            cls.password_context.dummy_verify()
+
     @classmethod
     @ensure_initialized
     def app_init_test(cls):
@@ -57,12 +96,44 @@ class Utility:
     @ensure_initialized
     def verify_password(cls, password: str, hashed_pass: str) -> bool:
         return cls.password_context.verify(password, hashed_pass)
+
+    @classmethod
+    @ensure_initialized
+    async def get_hashed_password_async(cls, password: str) -> str:
+        try:
+            return await cls.password_hasher.hash(password)
+        except PasswordHasherBusy:
+            raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
+
+    @classmethod
+    @ensure_initialized
+    async def get_hashed_passwords_async(cls, passwords: list[str]) -> list[str]:
+        return await cls.password_hasher.hash_many(passwords)
+
+    @classmethod
+    @ensure_initialized
+    async def verify_password_async(cls, password: str, hashed_pass: str) -> bool:
+        try:
+            return await cls.password_hasher.verify(password, hashed_pass)
+        except PasswordHasherBusy:
+            raise HTTPException(status_code=503, detail="Server busy, try again later", headers={"Retry-After": "1"})
     
+    @classmethod
+    @ensure_initialized
+    def password_needs_update(cls, hashed_pass: str) -> bool:
+        # Only parses the hash, cheap enough to check on every login
+        return cls.password_context.needs_update(hashed_pass)
+
     @classmethod
     @ensure_initialized
     def verify_plain_password(cls, password: str, plain_password: str) -> bool:
         return password == plain_password
 
+    @classmethod
+    @ensure_initialized
+    def verify_superuser_password(cls, password: str) -> bool:
+        return cls.verify_plain_password(password, cls.SUPERUSER_PASSWORD)
+
     @classmethod
     @ensure_initialized
     def create_access_token(cls, data: schemas.AccessTokenInputData, expires_delta: int = None) -> str:
@@ -71,8 +142,11 @@ class Utility:
         else:
             expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
-        encoded_jwt = schemas.AccessTokenPayload(**data.model_dump(), exp=expire).model_dump()
-        encoded_jwt = jwt.encode(encoded_jwt, cls.JWT_SECRET_KEY, cls.ALGORITHM)
+        encoded_jwt = schemas.AccessTokenPayload(**data.model_dump(), exp=expire, jti=uuid4().hex).model_dump(exclude_none=True)
+        if cls.key_ring is not None:
+            encoded_jwt = jwt.encode(encoded_jwt, cls.key_ring.signing_key, cls.ALGORITHM, headers={"kid": cls.key_ring.signing_kid})
+        else:
+            encoded_jwt = jwt.encode(encoded_jwt, cls.JWT_SECRET_KEY, cls.ALGORITHM)
 
         return encoded_jwt
     
@@ -88,12 +162,23 @@ class Utility:
     )
 
 
+    @classmethod
+    def verification_key(cls, jwtoken: str):
+        if cls.key_ring is None:
+            return cls.JWT_SECRET_KEY
+
+        # Any key of the ring, so tokens signed before a rotation stay valid
+        key = cls.key_ring.verification_key(jwt.get_unverified_header(jwtoken).get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        return key
+
     @classmethod
     @ensure_initialized
     def decodeJWT(cls, jwtoken: str, options: dict[str, Any] = None) -> dict:
         try:
             # Decode and verify the token
-            payload = jwt.decode(jwtoken, cls.JWT_SECRET_KEY, cls.ALGORITHM, options)
+            payload = jwt.decode(jwtoken, cls.verification_key(jwtoken), [cls.ALGORITHM], options)
             return payload
         except jwt.ExpiredSignatureError as e:
             print(f"{jwtoken} | Token expired")
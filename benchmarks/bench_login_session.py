@@ -0,0 +1,44 @@
+'''
+Per login session write cost: delete_user_sessions + create_user_session against open_user_session (the insert of the
+login's session and the MAX_SESSIONS_PER_USER trim)
+'''
+
+import argparse
+
+from app import models, service
+from .common import bench_sessionmaker, measure, print_comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    SessionLocal = bench_sessionmaker()
+    db = SessionLocal()
+
+    user = db.query(models.User).filter(models.User.email == "bench-session@example.com").first()
+    if user is None:
+        user = models.User(email="bench-session@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+    user_id = user.id
+
+    def delete_then_create():
+        service.delete_user_sessions(db, user_id)
+        service.create_user_session(db=db, user_id=user_id)
+
+    def insert_and_trim():
+        service.open_user_session(db=db, user_id=user_id)
+
+    print_comparison(f"Login session write ({db.get_bind().url.render_as_string()})", {
+        "delete + create (3 round trips)": measure(delete_then_create, args.iterations),
+        "insert + trim (2 round trips)": measure(insert_and_trim, args.iterations),
+    })
+
+    service.delete_user_sessions(db, user_id)
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
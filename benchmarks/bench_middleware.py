@@ -0,0 +1,117 @@
+'''
+Per request overhead of the middleware stack: the previous BaseHTTPMiddleware versions of the process time and
+authentication middlewares against the pure ASGI ones, driven in-process through the ASGI interface
+'''
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault('JWT_SECRET_KEY', 'bench_key')
+os.environ.setdefault('PASSWORD_HASH_ROUNDS', '12')
+
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.authenticator import AuthenticationMiddleware
+from app.config import BASE_PATH
+from app.middleware import ProcessTimeMiddleware
+from app.utils import Utility
+from .common import print_comparison, summarize
+
+
+class LegacyProcessTimeMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        response = await call_next(request)
+        process_time = time.time() - start_time
+        response.headers["X-Process-Time"] = f"{process_time * 1000} ms"
+        return response
+
+
+class LegacyAuthenticationMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path in [f"{BASE_PATH}/logout"]:
+            return await call_next(request)
+
+        response = await call_next(request)
+
+        if request.scope.get("auth_required", False):
+            delete_access_token = getattr(request.state, 'delete_access_token', False)
+            if delete_access_token:
+                response.delete_cookie("access_token")
+            else:
+                new_access_token = getattr(request.state, 'new_access_token', None)
+                if new_access_token:
+                    Utility.set_access_token_cookie(response, new_access_token)
+
+        return response
+
+
+def build_app(process_time_middleware, authentication_middleware) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(process_time_middleware)
+    app.add_middleware(authentication_middleware)
+
+    @app.get(f"{BASE_PATH}/plain")
+    async def plain():
+        return {"message": "ok"}
+
+    @app.get(f"{BASE_PATH}/rotated")
+    async def rotated(request: Request):
+        # What the Authenticator dependency leaves behind after refreshing a token
+        request.scope["auth_required"] = True
+        request.state.new_access_token = "rotated-token"
+        return {"message": "ok"}
+
+    return app
+
+
+async def drive(app: FastAPI, path: str, iterations: int, warmup: int = 200) -> dict:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+
+    async def send(message):
+        pass
+
+    samples_ns = []
+    for i in range(warmup + iterations):
+        request_messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if request_messages:
+                return request_messages.pop()
+            await asyncio.Event().wait()      # Like a server, the client stays connected until the response is sent
+
+        started_at = time.perf_counter_ns()
+        await app(dict(scope), receive, send)
+        if i >= warmup:
+            samples_ns.append(time.perf_counter_ns() - started_at)
+    return summarize(samples_ns)
+
+
+async def run(iterations: int):
+    Utility.initialize()
+    legacy_app = build_app(LegacyProcessTimeMiddleware, LegacyAuthenticationMiddleware)
+    asgi_app = build_app(ProcessTimeMiddleware, AuthenticationMiddleware)
+
+    for path in (f"{BASE_PATH}/plain", f"{BASE_PATH}/rotated"):
+        print_comparison(f"GET {path}", {
+            "BaseHTTPMiddleware": await drive(legacy_app, path, iterations),
+            "pure ASGI": await drive(asgi_app, path, iterations),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == '__main__':
+    main()
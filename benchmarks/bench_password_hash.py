@@ -0,0 +1,49 @@
+'''
+Cost of password hashing per policy: hash and verify latency for a range of rounds of each scheme, next to the
+rounds the startup calibration picks for PASSWORD_HASH_TARGET_MS on this host
+'''
+
+import argparse
+
+from app.config import PASSWORD_HASH_ARGON2_MEMORY_KIB, PASSWORD_HASH_TARGET_MS
+from app.password_policy import ROUNDS_LIMITS, SCHEMES, calibrate_rounds, hash_handler
+from .common import measure, print_comparison
+
+PASSWORD = "bench-password"
+
+
+def installed(scheme: str) -> bool:
+    try:
+        hash_handler(scheme, ROUNDS_LIMITS[scheme][0], PASSWORD_HASH_ARGON2_MEMORY_KIB).hash(PASSWORD)
+        return True
+    except Exception as e:
+        print(f"Skipping {scheme}: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--schemes", nargs="+", choices=SCHEMES, default=list(SCHEMES))
+    parser.add_argument("--steps", type=int, default=4, help="Rounds measured per scheme, from its minimum up")
+    parser.add_argument("--target-ms", type=float, default=PASSWORD_HASH_TARGET_MS)
+    args = parser.parse_args()
+
+    for scheme in filter(installed, args.schemes):
+        min_rounds, max_rounds = ROUNDS_LIMITS[scheme]
+        hash_results, verify_results = {}, {}
+        for rounds in range(min_rounds, min(min_rounds + args.steps, max_rounds + 1)):
+            handler = hash_handler(scheme, rounds, PASSWORD_HASH_ARGON2_MEMORY_KIB)
+            hashed_password = handler.hash(PASSWORD)
+            hash_results[f"{rounds} rounds"] = measure(lambda: handler.hash(PASSWORD), args.iterations, warmup=1)
+            verify_results[f"{rounds} rounds"] = measure(lambda: handler.verify(PASSWORD, hashed_password), args.iterations, warmup=1)
+
+        print_comparison(f"{scheme} hash", hash_results)
+        print_comparison(f"{scheme} verify", verify_results)
+
+        rounds, elapsed_ms = calibrate_rounds(scheme, args.target_ms, argon2_memory_kib=PASSWORD_HASH_ARGON2_MEMORY_KIB)
+        print(f"  calibration for {args.target_ms:.0f} ms: {rounds} rounds, {elapsed_ms:.1f} ms per hash")
+
+
+if __name__ == '__main__':
+    main()
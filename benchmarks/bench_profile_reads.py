@@ -0,0 +1,71 @@
+'''
+Profile read path: full ORM users with joinedload, copied into schemas and validated again as the response_model,
+against the column projected query with rows serialized straight to JSON bytes
+'''
+
+import argparse
+import json
+
+import orjson
+from pydantic import TypeAdapter
+from sqlalchemy.orm import joinedload
+
+from app import models, schemas, service
+from .common import bench_sessionmaker, measure, print_comparison
+
+BENCH_EMAIL_DOMAIN = "bench-profile.example.com"
+
+
+def seed_users(db, count: int):
+    existing = db.query(models.User).filter(models.User.email.like(f"%@{BENCH_EMAIL_DOMAIN}")).count()
+    for i in range(existing, count):
+        user = models.User(email=f"user{i}@{BENCH_EMAIL_DOMAIN}", hashed_password="x" * 60)
+        if i % 2 == 0:      # Half of them with user_info, like a partially filled directory
+            user.user_info = models.UserInfo(fullname=f"User {i}", designation="Engineer", staff_id=1_000_000 + i)
+        db.add(user)
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000, help="Users seeded and read per iteration")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    SessionLocal = bench_sessionmaker()
+    db = SessionLocal()
+    seed_users(db, args.users)
+
+    # What FastAPI does with the returned objects: validate them against the response_model, dump them, encode
+    response_adapter = TypeAdapter(list[schemas.UserInfo])
+
+    def orm_and_response_model():
+        users = db.query(models.User).options(joinedload(models.User.user_info)).order_by(models.User.id).limit(args.users).all()
+        user_infos = [
+            schemas.UserInfo(user_id=user.id, email=user.email, fullname=user.user_info.fullname, designation=user.user_info.designation, staff_id=user.user_info.staff_id)
+            if user.user_info else schemas.User(user_id=user.id, email=user.email)
+            for user in users
+        ]
+        validated = response_adapter.validate_python(user_infos, from_attributes=True)
+        body = json.dumps(response_adapter.dump_python(validated, mode="json")).encode()
+        db.expunge_all()        # A request gets a fresh session, don't let the identity map carry objects over
+        return body
+
+    def projected_columns():
+        return orjson.dumps(service.get_detailed_users(db, limit=args.users))
+
+    assert orjson.loads(orm_and_response_model()) == orjson.loads(projected_columns())
+
+    results = {
+        "ORM + response_model": measure(orm_and_response_model, args.iterations),
+        "columns + orjson": measure(projected_columns, args.iterations),
+    }
+    print_comparison(f"GET /users page of {args.users} ({db.get_bind().url.render_as_string()})", results)
+    for name, result in results.items():
+        print(f"  {name:<32} {args.users / result['mean_ms'] * 1000:12,.0f} objects/s")
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
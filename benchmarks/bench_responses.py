@@ -0,0 +1,84 @@
+'''
+Response rendering of /login and /authenticate without their DB and hashing work: FastAPI's stdlib json
+JSONResponse with dict bodies and the response_model, ORJSONResponse as the default response class, and the
+pre-encoded message / direct serialization helpers the routes use, driven in-process through the ASGI interface
+'''
+
+import argparse
+import asyncio
+import os
+
+os.environ.setdefault('JWT_SECRET_KEY', 'bench_key')
+os.environ.setdefault('PASSWORD_HASH_ROUNDS', '12')
+
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from app import responses, schemas, service
+from app.config import BASE_PATH
+from app.responses import encoded_response, json_response, model_response
+from app.utils import Utility
+from .bench_middleware import drive
+from .common import print_comparison
+
+PROFILE = {"user_id": 42, "email": "bench@example.com", "fullname": "Bench User", "designation": "Tester", "staff_id": 4242}
+
+
+def build_app(default_response_class, fast_path: bool) -> FastAPI:
+    app = FastAPI(default_response_class=default_response_class)
+    access_token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=PROFILE["user_id"], role="user", session_id="bench-session"))
+    # Built up front like the db_service calls do, only what happens to the returned model is measured
+    user_info_model = schemas.UserInfo(**PROFILE)
+
+    if fast_path:
+        @app.get(f"{BASE_PATH}/login")
+        async def login():
+            response = encoded_response(responses.LOGGED_IN)
+            Utility.set_access_token_cookie(response, access_token)
+            return response
+
+        @app.get(f"{BASE_PATH}/authenticate", response_model=schemas.UserInfo)
+        async def authenticate():
+            return json_response(service.user_info_response_body(PROFILE))
+
+        @app.get(f"{BASE_PATH}/user-info", response_model=schemas.UserInfo)
+        async def user_info():
+            return model_response(user_info_model)
+    else:
+        @app.get(f"{BASE_PATH}/login")
+        async def login(response: Response):
+            Utility.set_access_token_cookie(response, access_token)
+            return {"message": "Logged in successfully"}
+
+        @app.get(f"{BASE_PATH}/authenticate", response_model=schemas.UserInfo)
+        async def authenticate():
+            return PROFILE
+
+        @app.get(f"{BASE_PATH}/user-info", response_model=schemas.UserInfo)
+        async def user_info():
+            return user_info_model
+
+    return app
+
+
+async def run(iterations: int):
+    Utility.initialize()
+    apps = {
+        "JSONResponse + response_model": build_app(JSONResponse, fast_path=False),
+        "ORJSONResponse + response_model": build_app(ORJSONResponse, fast_path=False),
+        "pre-encoded / direct": build_app(ORJSONResponse, fast_path=True),
+    }
+
+    for path in (f"{BASE_PATH}/login", f"{BASE_PATH}/authenticate", f"{BASE_PATH}/user-info"):
+        print_comparison(f"GET {path}", {name: await drive(app, path, iterations) for name, app in apps.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+Cost of Authenticator.verify_jwt per request: full decode + AccessTokenPayload validation against a verified token
+cache hit, and the average over a mix of requests at different cache hit rates
+'''
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault('JWT_SECRET_KEY', 'bench_key')
+os.environ.setdefault('PASSWORD_HASH_ROUNDS', '12')
+
+from app import schemas
+from app.authenticator import Authenticator
+from app.jwt_keys import ASYMMETRIC_ALGORITHMS, KeyRing, generate_private_key
+from app.token_cache import verified_token_cache
+from app.utils import Utility
+from .common import print_comparison, summarize
+
+HIT_RATES = (0.0, 0.5, 0.9, 0.99)
+
+
+def use_algorithm(algorithm: str):
+    if algorithm == "HS256":
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pem", delete=False) as key_file:
+        key_file.write(generate_private_key(algorithm))
+    Utility.ALGORITHM = algorithm
+    Utility.key_ring = KeyRing(algorithm, private_key_files=[key_file.name], public_key_files=[])
+    os.unlink(key_file.name)
+
+
+def issue_token(user_id: int) -> str:
+    return Utility.create_access_token(data=schemas.AccessTokenInputData(sub=user_id, role="user", session_id=f"bench-session-{user_id}"))
+
+
+async def measure_mix(authenticator: Authenticator, hit_rate: float, iterations: int) -> dict:
+    cached_token = issue_token(0)
+    await authenticator.verify_jwt(cached_token)
+    # Misses get tokens never seen before, issued up front so that signing isn't measured
+    fresh_tokens = [issue_token(user_id) for user_id in range(1, iterations + 1)]
+    draws = [random.random() < hit_rate for _ in range(iterations)]
+
+    samples_ns = []
+    for is_hit, fresh_token in zip(draws, fresh_tokens):
+        token = cached_token if is_hit else fresh_token
+        started_at = time.perf_counter_ns()
+        await authenticator.verify_jwt(token)
+        samples_ns.append(time.perf_counter_ns() - started_at)
+    return summarize(samples_ns)
+
+
+async def run(iterations: int, algorithm: str):
+    Utility.initialize()
+    use_algorithm(algorithm)
+    authenticator = Authenticator()
+
+    verified_token_cache.enabled = False
+    results = {"decode + validate (no cache)": await measure_mix(authenticator, 0.0, iterations)}
+    verified_token_cache.enabled = True
+    for hit_rate in HIT_RATES:
+        verified_token_cache.store.clear()
+        results[f"cache, {hit_rate:.0%} hits"] = await measure_mix(authenticator, hit_rate, iterations)
+
+    print_comparison(f"verify_jwt ({algorithm})", results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--algorithm", choices=("HS256", *ASYMMETRIC_ALGORITHMS), default="HS256")
+    args = parser.parse_args()
+    asyncio.run(run(args.iterations, args.algorithm))
+
+
+if __name__ == '__main__':
+    main()
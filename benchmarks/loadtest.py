@@ -0,0 +1,258 @@
+'''
+Load generator for the auth endpoints, an asyncio/httpx driver with one scenario per hot path:
+register, login, authenticate (valid token), refresh (expired token), user_info_edit and admin_list.
+
+By default the app is served in-process (httpx ASGITransport) on a fresh SQLite stand-in, which needs nothing
+running and is good for comparing commits. With DB_ASYNC_MODE=True it runs on the same file through aiosqlite.
+Pass --url to load a running server instead, e.g. uvicorn workers on Postgres, with the same JWT_SECRET_KEY (or
+key files) and SUPERUSER_PASSWORD in the env as the server, since the refresh scenario mints expired tokens for
+the sessions it logs in. The login scenario needs the server's RATE_LIMIT_PER_IP and RATE_LIMIT_PER_EMAIL raised
+or set to 0, else it measures the 429s.
+
+    python -m benchmarks.loadtest --requests 500 --concurrency 16 --output results/head.json
+    python -m benchmarks.loadtest --compare results/base.json results/head.json
+'''
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+import httpx
+import jwt
+import orjson
+
+LOADTEST_DATABASE_FILE = "loadtest.db"
+# Before anything imports app.config, only used when the app is served in-process. The virtual users log in far
+# more often than the password attempt limits allow
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{LOADTEST_DATABASE_FILE}")
+os.environ.setdefault("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{LOADTEST_DATABASE_FILE}")
+os.environ.setdefault("RATE_LIMIT_PER_IP", "0")
+os.environ.setdefault("RATE_LIMIT_PER_EMAIL", "0")
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "12")
+
+from .common import percentile
+
+SCENARIOS = ("register", "login", "authenticate", "refresh", "user_info_edit", "admin_list")
+PASSWORD = "loadtest-password"
+
+
+class VirtualUser:
+    def __init__(self, index: int, run_id: str):
+        self.index = index
+        self.email = f"vu{index}-{run_id}@loadtest.example.com"
+        self.staff_id = int(run_id) * 10_000 + index
+        self.access_token: str | None = None
+
+    @property
+    def cookies(self) -> dict:
+        return {"cookie": f"access_token={self.access_token}"}
+
+
+def access_token_from(response: httpx.Response) -> str | None:
+    for header in response.headers.get_list("set-cookie"):
+        if header.startswith("access_token="):
+            return header.split(";", 1)[0].split("=", 1)[1] or None
+    return None
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, base_path: str, concurrency: int, requests: int):
+        self.client = client
+        self.base_path = base_path
+        self.concurrency = concurrency
+        self.requests = requests
+        self.run_id = str(int(time.time()) % 100_000)
+        self.users = [VirtualUser(index, self.run_id) for index in range(concurrency)]
+        self.admin = VirtualUser(concurrency, self.run_id)
+        self.registered = 0
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await self.client.request(method, f"{self.base_path}{path}", **kwargs)
+
+    # ============== Setup ==============
+    async def setup(self):
+        response = await self.request("POST", "/superuser", json={"email": self.admin.email, "password": PASSWORD, "superuser_password": os.getenv("SUPERUSER_PASSWORD")})
+        response.raise_for_status()
+        await self.login(self.admin)
+
+        # The virtual users in one bulk import, hashing in parallel instead of one /register-full each
+        rows = b"".join(orjson.dumps({"email": user.email, "password": PASSWORD, "fullname": f"User {user.index}", "designation": "Tester", "staff_id": user.staff_id}) + b"\n" for user in self.users)
+        response = await self.request("POST", "/users/import", files={"file": ("users.ndjson", rows, "application/x-ndjson")}, headers=self.admin.cookies)
+        response.raise_for_status()
+        await asyncio.gather(*(self.login(user) for user in self.users))
+
+    async def login(self, user: VirtualUser) -> httpx.Response:
+        response = await self.request("POST", "/login", json={"email": user.email, "password": PASSWORD})
+        user.access_token = access_token_from(response) or user.access_token
+        return response
+
+    # ============== Scenarios, one request each ==============
+    async def register(self, user: VirtualUser) -> httpx.Response:
+        self.registered += 1
+        return await self.request("POST", "/register", json={"email": f"new{self.registered}-{user.email}", "password": PASSWORD})
+
+    async def authenticate(self, user: VirtualUser) -> httpx.Response:
+        return await self.request("GET", "/authenticate", headers=user.cookies)
+
+    async def refresh(self, user: VirtualUser) -> httpx.Response:
+        # The current token re-signed as expired, so each request rotates the user's session once
+        payload = jwt.decode(user.access_token, options={"verify_signature": False})
+        response = await self.request("GET", "/authenticate", headers={"cookie": f"access_token={expired_copy(payload)}"})
+        user.access_token = access_token_from(response) or user.access_token
+        return response
+
+    async def user_info_edit(self, user: VirtualUser) -> httpx.Response:
+        response = await self.request("PUT", "/user-info", headers=user.cookies, json={"fullname": f"User {user.index} {time.monotonic_ns()}", "designation": "Tester", "staff_id": user.staff_id})
+        user.access_token = access_token_from(response) or user.access_token
+        return response
+
+    async def admin_list(self, user: VirtualUser) -> httpx.Response:
+        return await self.request("GET", "/users?limit=100", headers=self.admin.cookies)
+
+    # ============== Driver ==============
+    async def run_scenario(self, name: str) -> dict:
+        scenario: Callable[[VirtualUser], Awaitable[httpx.Response]] = getattr(self, name)
+        remaining = self.requests
+        latencies_ns: list[int] = []
+        statuses: dict[str, int] = {}
+
+        async def virtual_user(user: VirtualUser):
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                started_at = time.perf_counter_ns()
+                try:
+                    status = str((await scenario(user)).status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies_ns.append(time.perf_counter_ns() - started_at)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(virtual_user(user) for user in self.users))
+        elapsed = time.perf_counter() - started_at
+
+        latencies_ms = sorted(latency / 1e6 for latency in latencies_ns)
+        return {
+            "requests": len(latencies_ms),
+            "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+            "statuses": statuses,
+            "throughput_rps": len(latencies_ms) / elapsed,
+            "mean_ms": sum(latencies_ms) / len(latencies_ms),
+            "p50_ms": percentile(latencies_ms, 0.50),
+            "p95_ms": percentile(latencies_ms, 0.95),
+            "p99_ms": percentile(latencies_ms, 0.99),
+            "max_ms": latencies_ms[-1],
+        }
+
+
+def expired_copy(payload: dict) -> str:
+    from app import schemas
+    from app.utils import Utility
+
+    if not Utility.initialized:
+        Utility.initialize()
+    data = schemas.AccessTokenInputData(**{field: payload[field] for field in schemas.AccessTokenInputData.model_fields if field in payload})
+    return Utility.create_access_token(data=data, expires_delta=timedelta(seconds=-1))
+
+
+@asynccontextmanager
+async def in_process_client():
+    # Fresh SQLite stand-in, the settings have to be in place before the app is imported
+    if os.path.exists(LOADTEST_DATABASE_FILE):
+        os.remove(LOADTEST_DATABASE_FILE)
+    os.environ.setdefault("JWT_SECRET_KEY", "loadtest_key")
+    os.environ.setdefault("SUPERUSER_PASSWORD", "loadtest_admin")
+
+    from app import models
+    from app.app import app
+    from app.database import engine
+    models.Base.metadata.create_all(bind=engine)
+
+    # Started and stopped like under a server, the shutdown disposes the engines. An open aiosqlite connection
+    # would otherwise keep the process alive after the run
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest") as client:
+            yield client
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict):
+    print(f"\nLoad test of {results['target']} at {results['concurrency']} concurrent users (commit {results['commit']})")
+    for name, result in results["scenarios"].items():
+        print(f"  {name:<16} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+              f"p99 {result['p99_ms']:9.2f} ms  errors {result['errors']}/{result['requests']} {result['statuses']}")
+
+
+def compare(base_path: str, head_path: str):
+    with open(base_path, "rb") as base_file, open(head_path, "rb") as head_file:
+        base, head = orjson.loads(base_file.read()), orjson.loads(head_file.read())
+
+    print(f"\n{base_path} ({base['commit']}) -> {head_path} ({head['commit']})")
+    for name, head_result in head["scenarios"].items():
+        base_result = base["scenarios"].get(name)
+        if base_result is None:
+            continue
+        changes = "  ".join(
+            f"{metric} {base_result[metric]:.2f} -> {head_result[metric]:.2f} ({(head_result[metric] / base_result[metric] - 1) * 100:+.1f}%)"
+            for metric in ("throughput_rps", "p50_ms", "p99_ms") if base_result[metric]
+        )
+        print(f"  {name:<16} {changes}")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    client_context = httpx.AsyncClient(base_url=args.url, timeout=60) if args.url else in_process_client()
+    async with client_context as client:
+        load_test = LoadTest(client, base_path=args.base_path, concurrency=args.concurrency, requests=args.requests)
+        await load_test.setup()
+        scenarios = {name: await load_test.run_scenario(name) for name in args.scenarios}
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or f"in-process, {os.environ['DATABASE_URL']}",
+        "concurrency": args.concurrency,
+        "requests_per_scenario": args.requests,
+        "python": sys.version.split()[0],
+        "scenarios": scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Base URL of a running server, defaults to serving the app in-process on SQLite")
+    parser.add_argument("--base-path", default="/auth/v1")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users, each with its own account and session")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="Compare two saved results instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = asyncio.run(run(args))
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "wb") as output_file:
+            output_file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+        print(f"Saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+The settings are read at import, so they are set here before any test module imports the app
+'''
+
+import os
+import tempfile
+
+import pytest
+
+TEST_DATABASE_FILE = os.path.join(tempfile.mkdtemp(prefix="fast-auth-tests-"), "test.db")
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{TEST_DATABASE_FILE}")
+os.environ.setdefault("ASYNC_DATABASE_URL", f"sqlite+aiosqlite:///{TEST_DATABASE_FILE}")
+os.environ.setdefault("JWT_SECRET_KEY", "test_key")
+os.environ.setdefault("SUPERUSER_PASSWORD", "test_superuser_password")
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "4")
+os.environ.setdefault("SESSION_REAPER_INTERVAL_SECONDS", "0")
+# The endpoint tests sign in many times from the one test client, the limiters are tested on their own
+os.environ.setdefault("RATE_LIMIT_PER_IP", "0")
+os.environ.setdefault("RATE_LIMIT_PER_EMAIL", "0")
+
+
+@pytest.fixture(scope="session")
+def database():
+    # The schema is Alembic's in production, the tests create it from the models
+    from app import models
+    from app.database import engine
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@pytest.fixture
+def db(database):
+    from app.database import SessionLocal
+    db = SessionLocal()
+    yield db
+    db.close()
+
+
+@pytest.fixture(scope="session")
+def started_app(database):
+    # Runs the lifespan once, clients built from it share its hasher and cache listeners
+    from fastapi.testclient import TestClient
+    from app.app import app
+    with TestClient(app):
+        yield app
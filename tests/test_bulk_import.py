@@ -0,0 +1,59 @@
+'''
+Bulk registration imports, run the way `python -m app.cli import-users` does for the configured DB_ASYNC_MODE
+'''
+
+import asyncio
+import itertools
+
+from app import models
+from app.cli import import_users
+
+staff_ids = itertools.count(100000)
+
+
+def registration(name: str, staff_id: int | None = None) -> dict:
+    return {"email": f"{name}@import.example.com", "password": "import-password", "fullname": name, "designation": "Importer",
+            "staff_id": next(staff_ids) if staff_id is None else staff_id}
+
+
+def run_import(rows: list[dict | None]) -> list[dict]:
+    return asyncio.run(import_users(rows, role="user"))
+
+
+def test_repeated_rows_of_the_import_are_rejected(database):
+    first = registration("repeated-first")
+    rows = [first, {**registration("repeated-email"), "email": first["email"]}, registration("repeated-staff", staff_id=first["staff_id"])]
+
+    results = run_import(rows)
+
+    assert [result["status"] for result in results] == ["created", "failed", "failed"]
+    assert results[1]["detail"] == "Email repeated in the import"
+    assert results[2]["detail"] == "Staff id repeated in the import"
+
+
+def test_rows_taken_in_the_database_are_rejected(database):
+    existing = registration("existing")
+    run_import([existing])
+    rows = [{**registration("taken-email"), "email": existing["email"]}, registration("taken-staff", staff_id=existing["staff_id"]), registration("fresh")]
+
+    results = run_import(rows)
+
+    assert [result["status"] for result in results] == ["failed", "failed", "created"]
+    assert results[0]["detail"] == "Email already registered"
+    assert results[1]["detail"] == "Staff id already exists"
+
+
+def test_user_ids_follow_the_row_order(db):
+    rows = [registration(f"ordered-{number}") for number in range(25)]
+    rows.insert(10, None)       # A failed row in between shifts the rows after it
+
+    results = run_import(rows)
+
+    assert [result["row"] for result in results] == list(range(1, 27))
+    for row, result in zip(rows, results):
+        if row is None:
+            assert result["status"] == "failed"
+            continue
+        user = db.query(models.User).filter(models.User.email == row["email"]).one()
+        assert result["user_id"] == user.id
+        assert user.user_info.staff_id == row["staff_id"]
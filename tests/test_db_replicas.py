@@ -0,0 +1,79 @@
+'''
+Replica routing of the service reads against two SQLite files, the "replica" is a copy of the primary taken before
+the last profile update, like a replica lagging behind
+'''
+
+import os
+import shutil
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("JWT_SECRET_KEY", "test_key")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import models, service
+from app.cache_backends import InMemoryCacheBackend
+from app.db_replicas import Replica, ReplicaSet, RoutingSession
+from app.profile_cache import profile_cache
+
+
+@pytest.fixture
+def routing(tmp_path):
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    models.Base.metadata.create_all(bind=primary)
+    replica_set = ReplicaSet([], max_lag_seconds=5, sticky_seconds=10, backend=InMemoryCacheBackend())
+    db = sessionmaker(bind=primary, class_=RoutingSession, replica_set=replica_set, autoflush=False)()
+
+    user = models.User(email="replica@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    user_info = models.UserInfo(fullname="Old Name", designation="Tester", staff_id=1, user_id=user.id)
+    db.add(user_info)
+    db.commit()
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    user_info.fullname = "New Name"
+    db.commit()
+    user_id = user.id
+    profile_cache.invalidate_user(user_id=user_id, email=user.email)
+
+    replica_engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    replica = Replica("replica0", replica_engine)
+    replica.lag_seconds = 0.0
+    replica_set.replicas.append(replica)
+
+    # A fresh session, the writes above would otherwise keep it on the primary
+    db.close()
+    db = sessionmaker(bind=primary, class_=RoutingSession, replica_set=replica_set, autoflush=False)()
+    yield db, replica, replica_set, user_id
+    db.close()
+    primary.dispose()
+    replica_engine.dispose()
+
+
+def test_positional_user_id_reads_its_writes(routing):
+    db, replica, replica_set, user_id = routing
+    replica_set.stick_to_primary(user_id)
+
+    user_info = service.get_detailed_user_info(db, user_id)
+
+    assert user_info.fullname == "New Name"
+    assert replica.reads == 0
+
+
+def test_replica_reads_do_not_fill_the_profile_cache(routing):
+    db, replica, replica_set, user_id = routing
+
+    assert service.get_detailed_user_info(db, user_id).fullname == "Old Name"
+    assert service.get_user(db, user_id) is not None
+    assert replica.reads == 2
+    assert profile_cache.get_profile(user_id) is None
+    assert profile_cache.get_user(user_id) is None
+
+
+def test_staff_id_uniqueness_check_reads_the_primary(routing):
+    db, replica, replica_set, user_id = routing
+
+    assert service.get_user_by_staff_id(db, 1).id == user_id
+    assert replica.reads == 0
@@ -0,0 +1,86 @@
+'''
+Metrics exposition, of this worker alone and merged with the snapshots other workers flushed to METRICS_MULTIPROC_DIR
+'''
+
+import os
+import time
+
+import orjson
+
+from app.metrics import MetricsRegistry
+
+OTHER_WORKER_PID = 999999999
+
+
+def metric_registry(multiproc_dir=None) -> MetricsRegistry:
+    # The same metrics on every worker
+    registry = MetricsRegistry(multiproc_dir=multiproc_dir, flush_seconds=5)
+    registry.counter("logins_total", "Logins", ("result",))
+    registry.gauge("in_flight", "Requests in flight")
+    registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    return registry
+
+
+def write_other_worker_snapshot(multiproc_dir, registry: MetricsRegistry, written_at: float):
+    snapshot = {"pid": OTHER_WORKER_PID, "written_at": written_at, "metrics": registry.snapshot()}
+    (multiproc_dir / f"metrics-{OTHER_WORKER_PID}.json").write_bytes(orjson.dumps(snapshot))
+
+
+def rendered_samples(registry: MetricsRegistry) -> dict[str, str]:
+    lines = registry.render().splitlines()
+    return dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+
+
+def test_histogram_buckets_are_cumulative_with_count_and_sum():
+    registry = metric_registry()
+    for value in (0.05, 0.1, 0.5, 5.0):     # A bucket holds the values up to and including its bound
+        registry.metrics["latency_seconds"].observe(value, "/login")
+
+    samples = rendered_samples(registry)
+
+    assert samples['latency_seconds_bucket{route="/login",le="0.1"}'] == "2"
+    assert samples['latency_seconds_bucket{route="/login",le="1.0"}'] == "3"
+    assert samples['latency_seconds_bucket{route="/login",le="+Inf"}'] == "4"
+    assert samples['latency_seconds_count{route="/login"}'] == "4"
+    assert float(samples['latency_seconds_sum{route="/login"}']) == 5.65
+
+
+def test_label_values_are_escaped():
+    registry = metric_registry()
+    registry.metrics["logins_total"].inc('say "hi"\\\n')
+
+    assert rendered_samples(registry) == {'logins_total{result="say \\"hi\\"\\\\\\n"}': "1"}
+
+
+def test_counters_and_histograms_are_summed_across_workers(tmp_path):
+    registry, other_worker = metric_registry(tmp_path), metric_registry()
+    registry.metrics["logins_total"].inc("ok", amount=2)
+    other_worker.metrics["logins_total"].inc("ok", amount=3)
+    other_worker.metrics["logins_total"].inc("failed")
+    registry.metrics["latency_seconds"].observe(0.05, "/login")
+    other_worker.metrics["latency_seconds"].observe(0.5, "/login")
+    write_other_worker_snapshot(tmp_path, other_worker, written_at=time.time())
+
+    samples = rendered_samples(registry)
+
+    assert samples['logins_total{result="ok"}'] == "5"
+    assert samples['logins_total{result="failed"}'] == "1"
+    assert samples['latency_seconds_bucket{route="/login",le="0.1"}'] == "1"
+    assert samples['latency_seconds_count{route="/login"}'] == "2"
+
+
+def test_gauges_are_per_worker_and_dropped_for_stale_workers(tmp_path):
+    registry, other_worker = metric_registry(tmp_path), metric_registry()
+    registry.metrics["in_flight"].set(1)
+    other_worker.metrics["in_flight"].set(7)
+    other_worker.metrics["logins_total"].inc("ok")
+
+    write_other_worker_snapshot(tmp_path, other_worker, written_at=time.time())
+    assert rendered_samples(registry)[f'in_flight{{worker="{OTHER_WORKER_PID}"}}'] == "7"
+
+    # Not flushed for more than 3 flush intervals, the worker has stopped
+    write_other_worker_snapshot(tmp_path, other_worker, written_at=time.time() - 3 * registry.flush_seconds - 1)
+    samples = rendered_samples(registry)
+
+    assert [name for name in samples if name.startswith("in_flight")] == [f'in_flight{{worker="{os.getpid()}"}}']
+    assert samples['logins_total{result="ok"}'] == "1"      # What it counted still happened
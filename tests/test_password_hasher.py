@@ -0,0 +1,94 @@
+'''
+Password hasher saturation: once the workers and the queue are taken, hashing is refused right away
+'''
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.password_hasher import PasswordHasher, PasswordHasherBusy
+from app.utils import Utility
+
+
+@pytest.fixture
+def gate():
+    # Holds the jobs on the workers until set
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def hasher(gate):
+    def hash_func(password: str) -> str:
+        gate.wait(timeout=5)
+        if password == "failing":
+            raise ValueError("hash failed")
+        return f"hashed-{password}"
+
+    hasher = PasswordHasher(hash_func=hash_func, verify_func=lambda password, hashed_pass: True, max_workers=2, max_queue_depth=1)
+    yield hasher
+    hasher.shutdown()
+
+
+async def fill(hasher: PasswordHasher, password: str = "password") -> list[asyncio.Task]:
+    jobs = [asyncio.create_task(hasher.hash(password)) for _ in range(hasher.max_workers + hasher.max_queue_depth)]
+    await asyncio.sleep(0.01)
+    return jobs
+
+
+def test_full_hasher_rejects_the_next_call(hasher, gate):
+    async def saturate():
+        jobs = await fill(hasher)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash("one too many")
+        gate.set()
+        return await asyncio.gather(*jobs)
+
+    assert asyncio.run(saturate()) == ["hashed-password"] * 3
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_full_hasher_is_a_503_with_retry_after(hasher, monkeypatch):
+    Utility.lazy_initialize()       # Else the first use would replace the hasher
+    monkeypatch.setattr(Utility, "password_hasher", hasher)
+
+    async def saturate():
+        await fill(hasher)
+        with pytest.raises(HTTPException) as error:
+            await Utility.get_hashed_password_async("one too many")
+        return error.value
+
+    error = asyncio.run(saturate())
+
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "1"}
+
+
+@pytest.mark.parametrize("password", ["password", "failing"])
+def test_slots_are_released_when_the_jobs_finish(hasher, gate, password):
+    async def fill_twice():
+        jobs = await fill(hasher, password)
+        gate.set()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        gate.clear()
+        # All the slots are free again, a second round is accepted in full
+        jobs = await fill(hasher)
+        gate.set()
+        return await asyncio.gather(*jobs)
+
+    assert asyncio.run(fill_twice()) == ["hashed-password"] * 3
+    assert hasher.stats()["in_flight"] == 0
+    assert hasher.stats()["rejected"] == 0
+
+
+def test_bulk_hashing_works_from_one_event_loop_after_another():
+    hasher = PasswordHasher(hash_func=lambda password: f"hashed-{password}", verify_func=lambda password, hashed_pass: True, max_workers=1, max_queue_depth=0)
+    passwords = [f"password-{number}" for number in range(4)]
+
+    # More passwords than workers, the bulk window makes them wait and is bound to the loop they waited on
+    for _ in range(2):
+        assert asyncio.run(hasher.hash_many(passwords)) == [f"hashed-{password}" for password in passwords]
+    hasher.shutdown()
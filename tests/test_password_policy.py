@@ -0,0 +1,43 @@
+'''
+Password hashing policy: the calibration floor, rehashing only upward and the pinned rounds outside development
+'''
+
+import pytest
+
+from app import password_policy
+from app.password_policy import PasswordHashPolicy, calibrate_rounds, hash_handler, load_password_hash_policy
+
+
+def bcrypt_hash(rounds: int) -> str:
+    return hash_handler("bcrypt", rounds, 65536).hash("password")
+
+
+def test_calibration_never_goes_below_the_default(monkeypatch):
+    # Hardware too slow for the target even at the default cost
+    monkeypatch.setattr(password_policy, "time_hash_ms", lambda scheme, rounds, argon2_memory_kib: 1000.0)
+
+    rounds, _ = calibrate_rounds("bcrypt", target_ms=250)
+
+    assert rounds == 12
+
+
+def test_only_weaker_hashes_are_rehashed():
+    context = PasswordHashPolicy("bcrypt", rounds=6, rounds_tolerance=1).context()
+
+    assert context.needs_update(bcrypt_hash(4))
+    assert not context.needs_update(bcrypt_hash(5))
+    assert not context.needs_update(bcrypt_hash(8))
+
+
+def test_costlier_hashes_are_rehashed_down_on_request():
+    context = PasswordHashPolicy("bcrypt", rounds=6, rounds_tolerance=1, rehash_downward=True).context()
+
+    assert context.needs_update(bcrypt_hash(8))
+    assert not context.needs_update(bcrypt_hash(7))
+
+
+def test_rounds_have_to_be_pinned_outside_development():
+    with pytest.raises(ValueError):
+        load_password_hash_policy("bcrypt", rounds=None, target_ms=250, rounds_tolerance=1, argon2_memory_kib=65536)
+
+    assert load_password_hash_policy("bcrypt", rounds=5, target_ms=250, rounds_tolerance=1, argon2_memory_kib=65536).rounds == 5
@@ -0,0 +1,89 @@
+'''
+Password attempt limits on the in-memory backend, with limiters of their own instead of the app's (disabled by conftest)
+'''
+
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException, Request
+
+from app import rate_limiter
+from app.cache_backends import InMemoryCacheBackend
+from app.rate_limiter import RateLimiter, client_ip, limit_password_attempts, refund_password_attempt
+
+
+def request_from(ip: str, headers: dict[str, str] | None = None) -> Request:
+    return Request({"type": "http", "client": (ip, 50000), "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]})
+
+
+def attempt(request: Request, email: str = "limited@example.com"):
+    asyncio.run(limit_password_attempts(request, email))
+
+
+@pytest.fixture
+def limiters(monkeypatch):
+    backend = InMemoryCacheBackend()
+    monkeypatch.setattr(rate_limiter, "password_attempts_per_ip", RateLimiter(backend, "ip", 6, period_seconds=0.6))
+    monkeypatch.setattr(rate_limiter, "password_attempts_per_email", RateLimiter(backend, "email", 3, period_seconds=0.3))
+
+
+def test_burst_up_to_the_limit_then_429(limiters):
+    request = request_from("10.0.0.1")
+    for _ in range(3):
+        attempt(request)
+
+    with pytest.raises(HTTPException) as error:
+        attempt(request)
+
+    assert error.value.status_code == 429
+    assert error.value.headers == {"Retry-After": "1"}      # One interval, 0.1 s, rounded up
+
+
+def test_retry_after_counts_the_seconds_left():
+    limiter = RateLimiter(InMemoryCacheBackend(), "email", 2, period_seconds=60)
+    assert limiter.retry_after("user") == limiter.retry_after("user") == 0
+
+    assert limiter.retry_after("user") == pytest.approx(30, abs=0.1)
+
+
+def test_attempts_recover_after_the_period(limiters):
+    request = request_from("10.0.0.2")
+    for _ in range(3):
+        attempt(request)
+    with pytest.raises(HTTPException):
+        attempt(request)
+
+    time.sleep(0.3)
+
+    for _ in range(3):
+        attempt(request)
+
+
+def test_successful_attempts_are_refunded(limiters):
+    request = request_from("10.0.0.3")
+    for _ in range(10):
+        attempt(request)
+        asyncio.run(refund_password_attempt(request, "limited@example.com"))
+
+    for _ in range(3):
+        attempt(request)
+
+
+def test_failures_from_one_ip_do_not_lock_the_email_out_elsewhere(limiters):
+    for _ in range(3):
+        attempt(request_from("10.0.0.4"))
+    with pytest.raises(HTTPException):
+        attempt(request_from("10.0.0.4"))
+
+    attempt(request_from("10.0.0.5"))
+
+
+def test_client_ip_comes_from_the_trusted_proxy_header(monkeypatch):
+    request = request_from("10.0.0.6", {"X-Forwarded-For": "198.51.100.1, 203.0.113.7"})
+    assert client_ip(request) == "10.0.0.6"
+
+    monkeypatch.setattr(rate_limiter, "TRUSTED_PROXY_HEADER", "X-Forwarded-For")
+
+    assert client_ip(request) == "203.0.113.7"      # The address the proxy saw, the first one is the client's say
+    assert client_ip(request_from("10.0.0.6")) == "10.0.0.6"
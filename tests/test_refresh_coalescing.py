@@ -0,0 +1,70 @@
+'''
+Single flight refreshes: concurrent refreshes of one session in a worker share one rotation
+'''
+
+import asyncio
+
+import pytest
+
+from app import schemas, service
+from app.authenticator import Authenticator, refreshes_in_flight
+from app.db_service import db_service
+from app.utils import Utility
+
+
+def session_payload(db, email: str) -> schemas.AccessTokenPayload:
+    user = service.create_user(db, schemas.UserCredentials(email=email, password="password"), hashed_password="not-a-hash")
+    user_session = service.open_user_session(db, user_id=user.id, device="tests")
+    access_token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=user.id, role=user.role, session_id=str(user_session.session_id)))
+    return schemas.AccessTokenPayload(**Utility.decodeJWT(access_token))
+
+
+@pytest.fixture
+def rotations(monkeypatch):
+    # Session ids rotated through db_service, each rotation is slow enough for the other refreshes to arrive during it.
+    # Rotated by the sync service, the `db` fixture is a sync session whatever DB_ASYNC_MODE is
+    rotated_session_ids = []
+
+    async def slow_rotate_user_session(*args, **kwargs):
+        rotated_session_ids.append(kwargs["session_id"])
+        await asyncio.sleep(0.05)
+        return service.rotate_user_session(*args, **kwargs)
+
+    monkeypatch.setattr(db_service, "rotate_user_session", slow_rotate_user_session)
+    return rotated_session_ids
+
+
+def test_concurrent_refreshes_rotate_once(db, rotations):
+    payload = session_payload(db, "coalesced-refresh@example.com")
+    authenticator = Authenticator()
+
+    async def refresh_concurrently():
+        return await asyncio.gather(*(authenticator.refreshed_access_token(payload, db) for _ in range(10)))
+
+    access_tokens = asyncio.run(refresh_concurrently())
+
+    assert len(rotations) == 1
+    assert len(set(access_tokens)) == 1
+    assert Utility.decodeJWT(access_tokens[0])["session_id"] != payload.session_id
+    assert not refreshes_in_flight
+
+
+def test_waiters_take_over_a_cancelled_refresh(db, rotations):
+    payload = session_payload(db, "cancelled-refresh@example.com")
+    authenticator = Authenticator()
+
+    async def cancel_the_first_refresh():
+        first = asyncio.create_task(authenticator.refreshed_access_token(payload, db))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(authenticator.refreshed_access_token(payload, db)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        first.cancel()
+        access_tokens = await asyncio.wait_for(asyncio.gather(*waiters), timeout=5)
+        return first, access_tokens
+
+    first, access_tokens = asyncio.run(cancel_the_first_refresh())
+
+    assert first.cancelled()
+    assert len(rotations) == 2
+    assert len(set(access_tokens)) == 1
+    assert not refreshes_in_flight
@@ -0,0 +1,71 @@
+'''
+The session endpoints, each TestClient stands for a device with its own cookies
+'''
+
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import BASE_PATH
+
+
+@pytest.fixture
+def email(started_app):
+    email = f"sessions-{uuid4().hex[:8]}@example.com"
+    response = TestClient(started_app).post(f"{BASE_PATH}/register", json={"email": email, "password": "sessions-password"})
+    assert response.status_code == 200
+    return email
+
+
+def sign_in(app, email: str, device: str) -> TestClient:
+    client = TestClient(app)
+    response = client.post(f"{BASE_PATH}/login", json={"email": email, "password": "sessions-password", "device": device})
+    assert response.status_code == 200
+    return client
+
+
+def sessions(client: TestClient) -> dict[str, dict]:
+    response = client.get(f"{BASE_PATH}/sessions")
+    assert response.status_code == 200
+    return {session["device"]: session for session in response.json()}
+
+
+def test_sessions_are_listed_per_device(started_app, email):
+    laptop = sign_in(started_app, email, "laptop")
+    sign_in(started_app, email, "phone")
+
+    listed = sessions(laptop)
+
+    assert set(listed) == {"laptop", "phone"}
+    assert listed["laptop"]["current"] and not listed["phone"]["current"]
+
+
+def test_revoked_session_is_signed_out_right_away(started_app, email):
+    laptop = sign_in(started_app, email, "laptop")
+    phone = sign_in(started_app, email, "phone")
+    assert phone.get(f"{BASE_PATH}/authenticate").status_code == 200      # Its token is in the verified token cache
+
+    response = laptop.delete(f"{BASE_PATH}/sessions/{sessions(laptop)['phone']['id']}")
+
+    assert response.status_code == 200
+    assert phone.get(f"{BASE_PATH}/authenticate").status_code == 403
+    assert laptop.get(f"{BASE_PATH}/authenticate").status_code == 200
+    assert set(sessions(laptop)) == {"laptop"}
+    assert laptop.delete(f"{BASE_PATH}/sessions/{2**31 - 1}").status_code == 404
+
+
+def test_revoking_the_other_sessions_keeps_the_current_one(started_app, email):
+    laptop = sign_in(started_app, email, "laptop")
+    others = [sign_in(started_app, email, device) for device in ("phone", "tablet")]
+    for other in others:
+        assert other.get(f"{BASE_PATH}/authenticate").status_code == 200
+
+    response = laptop.delete(f"{BASE_PATH}/sessions")
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Revoked 2 sessions"}
+    for other in others:
+        assert other.get(f"{BASE_PATH}/authenticate").status_code == 403
+    assert laptop.get(f"{BASE_PATH}/authenticate").status_code == 200
+    assert set(sessions(laptop)) == {"laptop"}
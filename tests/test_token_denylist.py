@@ -0,0 +1,128 @@
+'''
+Token denylist on the in-memory backend, each TokenDenylist stands for a worker subscribed to the same backend
+'''
+
+import asyncio
+import math
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException, Request
+
+from app import schemas
+from app.authenticator import Authenticator
+from app.cache_backends import InMemoryCacheBackend, cache_backend
+from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.token_cache import verified_token_cache
+from app.token_denylist import TokenDenylist, token_denylist
+from app.utils import Utility
+
+
+class CountingBackend(InMemoryCacheBackend):
+    def __init__(self):
+        super().__init__()
+        self.gets = 0
+
+    def get_many(self, keys: list[str]):
+        self.gets += 1
+        return super().get_many(keys)
+
+
+def worker(backend: InMemoryCacheBackend, bucket_seconds: int = 60) -> TokenDenylist:
+    denylist = TokenDenylist(backend, bucket_seconds=bucket_seconds, bucket_capacity=1000, error_rate=0.01)
+    denylist.subscribe()
+    # Past the warm up, as if it had been listening for longer than a token lives
+    denylist.started_at -= ACCESS_TOKEN_EXPIRE_MINUTES * 60 + 1
+    return denylist
+
+
+@pytest.fixture
+def backend():
+    return CountingBackend()
+
+
+def test_revocation_reaches_the_other_workers(backend):
+    first, second = worker(backend), worker(backend)
+    exp = time.time() + 300
+
+    first.revoke("revoked-jti", exp)
+
+    assert second.is_revoked("revoked-jti", exp)
+    assert first.is_revoked("revoked-jti", exp)
+
+
+def test_unrelated_jti_is_answered_by_the_filter(backend):
+    denylist = worker(backend)
+    exp = time.time() + 300
+    denylist.revoke("revoked-jti", exp)
+    gets = backend.gets
+
+    assert not denylist.is_revoked("other-jti", exp)
+    assert not denylist.is_revoked("other-jti", exp + 3600)      # A bucket without revocations
+    assert backend.gets == gets
+
+
+def test_tokens_issued_before_subscribing_are_checked_on_the_backend(backend):
+    exp = time.time() + 300
+    worker(backend).revoke("revoked-jti", exp)
+
+    # Subscribed after the revocation was published, its filter doesn't have it
+    late_worker = TokenDenylist(backend, bucket_seconds=60, bucket_capacity=1000, error_rate=0.01)
+    assert late_worker.is_revoked("revoked-jti", exp)
+    late_worker.subscribe()
+    assert late_worker.is_revoked("revoked-jti", exp)
+    gets = backend.gets
+    assert not late_worker.is_revoked("other-jti", exp)
+    assert backend.gets == gets + 1
+
+    # Issued after it subscribed, the filter answers
+    assert not late_worker.is_revoked("other-jti", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60 + 1)
+    assert backend.gets == gets + 1
+
+
+def test_expired_buckets_are_dropped(backend):
+    denylist = worker(backend, bucket_seconds=1)
+    exp = time.time() + 0.2
+    denylist.revoke("expiring-jti", exp)
+    expired_bucket = denylist._bucket(exp)
+    assert expired_bucket in denylist.filters
+
+    time.sleep(math.floor(exp) + 1 - time.time() + 0.05)
+    denylist.revoke("later-jti", time.time() + 60)
+
+    assert expired_bucket not in denylist.filters
+    assert denylist.stats()["buckets"] == 1
+    assert backend.get(denylist._key(expired_bucket, "expiring-jti")) is None
+
+
+def test_revoked_token_is_not_served_from_the_verified_token_cache():
+    token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=1, role="user", session_id="denylist-session"))
+    authenticator = Authenticator()
+    payload = asyncio.run(authenticator.verify_jwt(token))
+    assert verified_token_cache.get(token) is payload
+
+    token_denylist.revoke(payload.jti, payload.exp)
+
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(authenticator.verify_jwt(token))
+    assert verified_token_cache.get(token) is None
+
+
+def test_unreachable_backend_is_a_503_not_a_logout(monkeypatch):
+    class UnreachableBackend(InMemoryCacheBackend):
+        def get_many(self, keys: list[str]):
+            raise ConnectionError("cache backend down")
+
+    monkeypatch.setattr(token_denylist, "backend", UnreachableBackend())
+    monkeypatch.setattr(token_denylist, "started_at", math.inf)      # Every token is looked up on the backend
+    monkeypatch.setattr(cache_backend, "unavailable_errors", (ConnectionError,))
+    token = Utility.create_access_token(data=schemas.AccessTokenInputData(sub=1, role="user", session_id="unreachable-session"))
+    request = Request({"type": "http", "headers": [(b"cookie", f"access_token={token}".encode())]})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(Authenticator()(request, db=None))
+
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "1"}
+    assert not getattr(request.state, "delete_access_token", False)
@@ -0,0 +1,55 @@
+'''
+Keyset paging of the admin user listing through the X-Next-Cursor header
+'''
+
+import asyncio
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.cli import import_users
+from app.config import BASE_PATH
+
+
+@pytest.fixture
+def admin(started_app):
+    client = TestClient(started_app)
+    credentials = {"email": "paging-admin@example.com", "password": "paging-password"}
+    client.post(f"{BASE_PATH}/superuser", json={**credentials, "superuser_password": "test_superuser_password"})
+    assert client.post(f"{BASE_PATH}/login", json=credentials).status_code == 200
+    return client
+
+
+@pytest.fixture
+def users(started_app):
+    rows = [{"email": f"paged-{number}@example.com", "password": "paging-password", "fullname": f"Paged {number}",
+             "designation": "Paged", "staff_id": 200000 + number} for number in range(12)]
+    asyncio.run(import_users(rows, role="user"))
+
+
+def test_paging_returns_every_user_once(admin, users):
+    everyone = admin.get(f"{BASE_PATH}/users", params={"limit": 1000}).json()
+
+    paged, cursor, pages = [], None, 0
+    while True:
+        response = admin.get(f"{BASE_PATH}/users", params={"limit": 5, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        paged += [user["user_id"] for user in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(everyone) >= 12
+    assert sorted(paged) == sorted(user["user_id"] for user in everyone)
+    assert len(paged) == len(set(paged))
+    assert pages >= 3
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "%%%", base64.urlsafe_b64encode(b"last").decode(), ""])
+def test_malformed_cursor_is_a_400(admin, cursor):
+    response = admin.get(f"{BASE_PATH}/users", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}